@@ -0,0 +1,633 @@
+'''benchmarks for the parts of CLS that run once per card
+run with `python bench.py [NAME ...]`, with no names every benchmark is run
+'''
+
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+from utils import *
+from macros import MacroStore, ArgFrame, compileValue, compileBody, compileMathTemplate, compileMathText
+from tests.legacy import legacyCommaSplit, legacyEvalEscapes, legacyParseList, LegacyCompiler, LegacyLayoutParser, legacyParseCSV, legacyParseData
+from tests.samples import examples, suits, exampleCorpus, makeLayout, makeTokenSheet, fitTexts
+
+benchmarks = {}
+
+def benchmark(name:str):
+    '''register a benchmark function under name'''
+    def inner(func):
+        benchmarks[name] = func
+        return func
+    return inner
+
+def timeIt(func, rounds:int=5) -> float:
+    '''run func a few times and return the best time in seconds'''
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        took = time.perf_counter() - start
+        if best is None or took < best:
+            best = took
+    return best
+
+def report(label:str, seconds:float, baseline:float=None):
+    if baseline is None:
+        print(f'  {label:<32} {seconds*1000:9.2f}ms')
+    else:
+        print(f'  {label:<32} {seconds*1000:9.2f}ms  {baseline/seconds:6.2f}x')
+
+def makeDeck(rows:int) -> list[dict]:
+    '''a fake data file in the shape of the playing card examples'''
+    return [{
+        'suit': suits[i%4],
+        'rank': str(i%13+1),
+        'card-index': str(i+1),
+        'repeat-index': str(i%9+1),
+    } for i in range(rows)]
+
+#property values pulled from the examples
+cardValues = (
+    '1/8in, 1/8in',
+    '.3in, .6in',
+    'images/[suit]-small.png',
+    '[if| [in| [suit],  spade, club], [black], [red]]',
+    '[in| [rank], 4, 5, 6]',
+    '[=| [repeat-index] + 1]',
+    '.3in, [if|? [repeat-index] == 1, 3/4in, 1in]',
+    'Spell [if| [ne| [suit], []], - [suit]]',
+    '[for-each| (any, earth), [icon| [item]]\\s\\s]',
+    '[capitalize| [suit]]',
+    '[card-index][suit][rank].png',
+)
+
+#values that lean on the pure macros, the text ones from the examples and made up ones like them
+pureValues = (
+    '[capitalize| [suit]]',
+    '[capitalize| the [suit] of the deck]',
+    '[upper| [suit]]',
+    '[length| (a, b, [suit])]',
+    '[substr| [suit], 2, 3]',
+    '[slice| (a, b, [suit], d), 1, 3]',
+    '[/| [suit]\\s\\n]',
+)
+
+@benchmark('macros')
+def macroBench():
+    '''evaluate a set of property values once per card, cold compiles every
+    value from scratch like the old scanner did, warm uses the compile cache,
+    then values made mostly of pure macros with the macro cache off and on'''
+    deck = makeDeck(2000)
+    store = MacroStore()
+    store.add('elementName', 'bench')
+    store.add('propertyName', 'bench')
+    store.add('red', '#ff1569')
+    store.add('black', '#1a1a5e')
+    store.add('icon', '<img source="img/[suit]-small.png"/>')
+
+    def run(cold, values=cardValues):
+        def func():
+            for row in deck:
+                store.macros.update(row)
+                if cold:
+                    compileValue.cache_clear()
+                    MacroStore.cache.clear()
+                for value in values:
+                    store.parse(value)
+        return func
+
+    pure = set(MacroStore.pureMacros)
+    def offAndOn(values):
+        '''the best time with the macro cache off and on, timed in turns so a slow stretch hits both'''
+        MacroStore.cache.clear()
+        times = {False: [], True: []}
+        for _ in range(5):
+            for cached in (False, True):
+                if cached:
+                    MacroStore.pureMacros.update(pure)
+                else:
+                    MacroStore.pureMacros.clear()
+                times[cached].append(timeIt(run(False, values), rounds=1))
+        MacroStore.pureMacros.update(pure)
+        return min(times[False]), min(times[True])
+
+    print(f'{len(deck)} cards, {len(cardValues)} properties each')
+    cold = timeIt(run(True), rounds=3)
+    report('cold (scan every card)', cold)
+    uncached, cached = offAndOn(cardValues)
+    report('compiled, no macro cache', uncached, cold)
+    report('compiled, pure macros cached', cached, cold)
+    print(f'  {MacroStore.cache.summary()}')
+
+    print(f'{len(deck)} cards, {len(pureValues)} properties using pure macros each')
+    uncached, cached = offAndOn(pureValues)
+    report('no macro cache', uncached)
+    report('pure macros cached', cached, uncached)
+    print(f'  {MacroStore.cache.summary()}')
+
+mathValues = (
+    '[=| [rank] * 0.25 + 1]',
+    '[=| [repeat-index] + 1]',
+    '[=| 1/8in + [card-index] % 9 * 1/4in]',
+    '[=| [rank] - 1/8in * 3 + 1/4in * 2]',
+)
+
+@benchmark('math')
+def mathBench():
+    '''evaluate math on every card, cold compiles every expression from scratch
+    after its macros are evaluated like [=| ] used to, warm runs the cached
+    templates with constants folded'''
+    deck = makeDeck(2000)
+    store = MacroStore()
+    store.add('elementName', 'bench')
+    store.add('propertyName', 'bench')
+
+    def run(cold):
+        def func():
+            for row in deck:
+                store.macros.update(row)
+                if cold:
+                    compileMathTemplate.cache_clear()
+                    compileMathText.cache_clear()
+                for value in mathValues:
+                    store.parse(value)
+        return func
+
+    print(f'{len(deck)} cards, {len(mathValues)} expressions each')
+    cold = timeIt(run(True), rounds=3)
+    report('cold (compile every card)', cold)
+    report('warm (templates cached)', timeIt(run(False), rounds=3), cold)
+
+userMacros = {
+    'pip': '<img src="img/[suit]-[1].png"/>',
+    'pips': '[dup| [1], [pip| small]]',
+    'row': '[for-each| (spade, heart, club), [pips| 2][item]\\s]',
+    'card': '[row][pip| big][row]',
+}
+
+@benchmark('user-macros')
+def userMacroBench():
+    '''call nested user macros on every card, copied gives every call its own
+    store like user macros used to, frames pushes the arguments on a stack
+    and compiled bodies look numbered args up by index'''
+    from utils import makeList
+    deck = makeDeck(2000)
+    store = MacroStore()
+    store.add('elementName', 'bench')
+    store.add('propertyName', 'bench')
+
+    def copied(value):
+        def func(context, *args):
+            newStore = context.store.copy()
+            newStore.add('arg-total', str(len(args)))
+            for num, arg in enumerate(args):
+                newStore.add(str(num+1), arg)
+            newStore.add('args', makeList(args))
+            return newStore.parse(value)
+        return func
+
+    def framed(value):
+        def func(context, *args):
+            return context.store.parseIn(ArgFrame(args), value)
+        return func
+
+    def compiled(value):
+        body = compileBody(value)
+        def func(context, *args):
+            return context.store.evalBody(ArgFrame(args), body)
+        return func
+
+    def run(makeMacro):
+        for name, value in userMacros.items():
+            store.macros[name] = (makeMacro(value), (0, 99))
+        def func():
+            for row in deck:
+                store.macros.update(row)
+                store.parse('[card]')
+        return func
+
+    print(f'{len(deck)} cards, {len(userMacros)} nested user macros')
+    baseline = timeIt(run(copied), rounds=3)
+    report('store copied per call', baseline)
+    report('argument frames', timeIt(run(framed), rounds=3), baseline)
+    report('frames, bodies compiled', timeIt(run(compiled), rounds=3), baseline)
+
+factions = ['faction' + str(i) for i in range(30)]
+switchValue = '[switch| [faction], ' + ', '.join(f'{name}, #{i:06x}' for i, name in enumerate(factions)) + ', default, black]'
+
+@benchmark('switch')
+def switchBench():
+    '''a 30 case [switch| ] on every card, linear walks the cases like [switch| ]
+    used to, indexed looks constant cases up in a dict'''
+    from utils import ListParser, evalEscapes
+    store = MacroStore()
+    store.add('elementName', 'bench')
+    store.add('propertyName', 'bench')
+    rows = [{'faction': factions[i%len(factions)]} for i in range(2000)]
+
+    def linearSwitch(context, sentinal, *args):
+        sentinal = evalEscapes(context.parse(sentinal))
+        args = list(args)
+        default = args.pop()
+        args.pop()
+        for pair in range(0, len(args), 2):
+            testValue = context.parse(args[pair])
+            testList = ListParser(testValue, context.elem, context.prop).parse()
+            if testList is not None:
+                if sentinal in testList:
+                    return args[pair+1]
+            elif sentinal == evalEscapes(testValue):
+                return args[pair+1]
+        return default
+    indexed = store.macros['switch']
+
+    def run():
+        for row in rows:
+            store.macros.update(row)
+            store.parse(switchValue)
+
+    print(f'{len(rows)} cards, {len(factions)} cases')
+    store.macros['switch'] = (linearSwitch, (3, 99))
+    linear = timeIt(run, rounds=3)
+    report('linear', linear)
+    store.macros['switch'] = indexed
+    report('indexed', timeIt(run, rounds=3), linear)
+
+@benchmark('lexer')
+def lexerBench():
+    '''the scanners in utils.lexer against the character at a time loops they
+    replaced, run over every value in the examples'''
+    from parsers import CSVParser
+    from macros import MacroCompiler
+    values, lines = exampleCorpus()
+    #the examples barely use lists, so every value gets a turn as one
+    lists = [f'({value})' for value in values]
+    print(f'{len(values)} values, {len(lists)} lists, {len(lines)} data lines, each run 20 times')
+
+    def each(func, corpus):
+        def run():
+            for _ in range(20):
+                for value in corpus:
+                    try:
+                        func(value)
+                    except (CLSError, IndexError):
+                        pass
+        return run
+
+    parser = CSVParser('')
+    pairs = (
+        ('commaSplit', legacyCommaSplit, commaSplit, values),
+        ('evalEscapes', legacyEvalEscapes, evalEscapes, values),
+        ('ListParser', legacyParseList, lambda value: ListParser(value, None, None).parse(), lists),
+        ('CSVParser.parseRow', legacyCommaSplit, parser.parseRow, lines),
+        ('MacroCompiler', lambda value: LegacyCompiler(value).compile(), lambda value: MacroCompiler(value).compile(), values),
+    )
+    for name, old, new, corpus in pairs:
+        baseline = timeIt(each(old, corpus), rounds=3)
+        report(f'{name} (char loop)', baseline)
+        report(f'{name} (lexer)', timeIt(each(new, corpus), rounds=3), baseline)
+
+unitValues = ('1/4in', '22pt', '.3in', '1 1/2in', '-5mm', '50%', '300', '3/4in', '1in', '12px')
+
+@benchmark('units')
+def unitBench():
+    '''parse and convert the kind of numbers properties use, with the result cache
+    turned off and on, and converting through toInt(dpi=) and toIntAt()'''
+    from utils.data import parseUnit
+    rounds = 20000
+    print(f'{rounds} rounds of {len(unitValues)} values')
+
+    def parse(func):
+        def run():
+            for _ in range(rounds):
+                for value in unitValues:
+                    func(value, '-+', ('px', 'in', 'mm', '%', 'pt'))
+        return run
+    uncached = timeIt(parse(parseUnit.__wrapped__), rounds=3)
+    report('fromStr, patterns cached', uncached)
+    report('fromStr, results cached', timeIt(parse(parseUnit), rounds=3), uncached)
+
+    units = [Unit.fromStr(value, '-+', ('px', 'in', 'mm', '%', 'pt')) for value in unitValues]
+    def convert(fast):
+        def run():
+            for _ in range(rounds):
+                for unit in units:
+                    if fast:
+                        unit.toIntAt(300)
+                    else:
+                        unit.toInt(dpi=300)
+        return run
+    slow = timeIt(convert(False), rounds=3)
+    report('toInt(dpi=)', slow)
+    report('toIntAt()', timeIt(convert(True), rounds=3), slow)
+
+typedMacros = {
+    'margin': '[=| 1/8in * [rank] % 3]',
+    'left': '[=| [margin] + 1/16in]',
+    'right': '[=| 2.5in - [left] - [margin]]',
+    'wide': '[?| [right] > 2in]',
+}
+
+@benchmark('typed')
+def typedBench():
+    '''math that feeds into more math and comparisons, with numbers passed along
+    as TypedText and with them turned back into plain text after every macro'''
+    import macros
+    deck = makeDeck(2000)
+    store = MacroStore()
+    store.add('elementName', 'bench')
+    store.add('propertyName', 'bench')
+    for name, value in typedMacros.items():
+        store.add(name, value)
+
+    def run():
+        for row in deck:
+            store.macros.update(row)
+            store.parse('[if| [wide], [right], [left]]')
+
+    print(f'{len(deck)} cards, {len(typedMacros)} chained macros')
+    formatNumber = macros.formatNumber
+    macros.formatNumber = lambda num: str(formatNumber(num))
+    MacroStore.cache.clear()
+    plain = timeIt(run, rounds=3)
+    report('plain text', plain)
+    macros.formatNumber = formatNumber
+    MacroStore.cache.clear()
+    report('typed values', timeIt(run, rounds=3), plain)
+
+    #what validateXY does with the results, the parse caches start empty each round
+    from utils import data
+    def validate(values):
+        def run():
+            data.parseUnit.cache_clear()
+            data.numberUnit.cache_clear()
+            for value in values:
+                Unit.fromStr(value, signs='-+^', units=('px', 'in', 'mm', '%')).toIntAt(300)
+        return run
+    for label, expr in (('repeating', '[=| [right] * [rank] / 7]'), ('different', '[=| [right] * [card-index] / 7]')):
+        typed = []
+        for row in deck:
+            store.macros.update(row)
+            typed.append(store.parse(expr))
+        print(f'reading {len(typed)} results as positions, {len(set(typed))} {label} values')
+        plain = timeIt(validate([str(value) for value in typed]))
+        report('plain text', plain)
+        report('typed values', timeIt(validate(typed)), plain)
+
+@benchmark('layout')
+def layoutBench():
+    '''parse synthetic layouts of increasing size, with the regex scanner and the
+    character at a time loop it replaced'''
+    from parsers import LayoutParser
+    for elements in (10, 100, 1000, 5000):
+        source = makeLayout(elements)
+        print(f'{elements} elements, {len(source)} characters')
+        baseline = timeIt(lambda: LegacyLayoutParser(source, 'bench.cls').parseLayoutFile(), rounds=3)
+        report('char loop', baseline)
+        report('regex', timeIt(lambda: LayoutParser(source, 'bench.cls').parseLayoutFile(), rounds=3), baseline)
+
+def peakMemory(func) -> tuple[object, int]:
+    '''returns what func returns and the most memory it had allocated at once'''
+    tracemalloc.start()
+    try:
+        result = func()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+@benchmark('data')
+def dataBench():
+    '''read a token sheet into cards through buildLayout and with the list building code
+    it replaced, how long until the first card is ready and how much memory reading every card takes,
+    then hand every card to a macro store as a copy of its row and as an overlay'''
+    import shutil
+    import tempfile
+    from renderer import buildLayout
+    source = makeTokenSheet(4000)
+    cards = sum(i%40+1 for i in range(4000))
+    print(f'4000 rows, {cards} cards, {len(source)//1024}KB')
+
+    folder = tempfile.mkdtemp()
+    with open(os.path.join(folder, 'tokens.csv'), 'w', encoding='utf-8') as file:
+        file.write(source)
+    with open(os.path.join(folder, 'tokens.cls'), 'w', encoding='utf-8') as file:
+        file.write('layout {\n    size: 1in, 1in\n    data: tokens.csv\n}\n\nname {\n    type: text\n    text: [name]\n}\n')
+
+    def legacy():
+        return legacyParseData(legacyParseCSV(source))
+    def streamed():
+        return buildLayout('tokens.cls', folder).data
+    baseline = timeIt(lambda: legacy()[0], rounds=3)
+    report('first card (lists)', baseline)
+    report('first card (buildLayout)', timeIt(lambda: next(iter(streamed())), rounds=3), baseline)
+    baseline = timeIt(lambda: sum(1 for card in legacy()), rounds=3)
+    report('every card (lists)', baseline)
+    report('every card (buildLayout)', timeIt(lambda: sum(1 for card in streamed()), rounds=3), baseline)
+    for label, func in (('lists', legacy), ('buildLayout', streamed)):
+        count, peak = peakMemory(lambda: sum(1 for card in func()))
+        print(f'  {"memory ("+label+")":<32} {peak/1024/1024:9.2f}MB')
+
+    #what rendering does with each card
+    data = streamed()
+    store = {}
+    def copies():
+        for card in data:
+            store.update(card.row | card.counts)
+    def overlays():
+        for card in data:
+            card.addTo(store)
+    baseline = timeIt(copies, rounds=3)
+    report('into a store (copies)', baseline)
+    report('into a store (overlays)', timeIt(overlays, rounds=3), baseline)
+    report('last 100 cards', timeIt(lambda: data[-100:], rounds=3))
+    shutil.rmtree(folder)
+
+def walkElements(elements:dict):
+    '''yield every element prototype in a layout, including subelements'''
+    for proto in elements.values():
+        yield proto
+        yield from walkElements(proto.subelements)
+
+def loadExample(folder:str, filename:str):
+    '''build one of the example layouts, returns the layout and a renderer for it'''
+    from renderer import buildLayout, CardRenderer
+    layout = buildLayout(filename, os.path.join(examples, folder))
+    return layout, CardRenderer(layout)
+
+def compileDeck(renderer, layout):
+    '''compile every card of a layout without painting anything'''
+    for row in layout.data:
+        row.addTo(renderer.store.macros)
+        renderer.compile(layout.elements, {})
+
+@benchmark('compile')
+def compileBench():
+    '''compile every card of the playing card example, with and without
+    properties being validated ahead of time in buildLayout, then with
+    elements memoized on the columns they depend on'''
+    layout, renderer = loadExample('playing cards', 'ranks.cls')
+    layout.data = list(layout.data) * 50
+    protos = list(walkElements(layout.elements))
+    folded = [(proto.static, proto.dynamic, proto.dependencies) for proto in protos]
+    staticCount = sum(len(static) for static, dynamic, deps in folded)
+    dynamicCount = sum(len(dynamic) for static, dynamic, deps in folded)
+    print(f'{len(layout.data)} cards, {staticCount} static and {dynamicCount} dynamic properties')
+
+    for proto in protos:
+        proto.static, proto.dynamic, proto.dependencies = {}, proto.compiled, None
+    unfolded = timeIt(lambda: compileDeck(renderer, layout), rounds=3)
+    report('every property per card', unfolded)
+
+    for proto, (static, dynamic, deps) in zip(protos, folded):
+        proto.static, proto.dynamic = static, dynamic
+    report('static properties folded', timeIt(lambda: compileDeck(renderer, layout), rounds=3), unfolded)
+
+    for proto, (static, dynamic, deps) in zip(protos, folded):
+        proto.dependencies = deps
+    def memoized():
+        renderer.memo = {}
+        compileDeck(renderer, layout)
+    report('memoized on dependencies', timeIt(memoized, rounds=3), unfolded)
+
+
+def legacyLabelPaint(elem, painter, upperLeft, size):
+    '''LabelElement.paint as it was when text was painted by a QLabel'''
+    from PySide6.QtCore import Qt
+    from PySide6.QtGui import QColor
+    from PySide6.QtWidgets import QLabel
+    from elements import countPrintingChars
+    label = QLabel()
+    label.setTextFormat(Qt.RichText)
+    label.setAttribute(Qt.WA_TranslucentBackground, True)
+    label.setAlignment(elem.vAlign|elem.hAlign)
+    label.setWordWrap(elem.wordWrap)
+    label.resize(size)
+    if len(elem.shrinkFont) > 0:
+        textLen = countPrintingChars(elem.text)
+        for num, newSize in elem.shrinkFont:
+            if textLen >= num:
+                elem.fontSize = newSize
+            else:
+                break
+    style = ['QLabel {']
+    style.append(f'font-size: {elem.fontSize}px;\n')
+    style.append(f'font-family: {elem.fontFamily};\n')
+    style.append(f'color: {elem.fontColor.name(QColor.HexArgb)};\n')
+    if elem.italic: style.append('font-style: italic;\n')
+    if 'fontWeight' in elem:
+        style.append(f'font-weight: {elem.fontWeight.value};\n')
+    else:
+        if elem.bold: style.append('font-weight: bold;\n')
+    if elem.overline: style.append('text-decoration: overline;\n')
+    if elem.underline: style.append('text-decoration: underline;\n')
+    if elem.lineThrough: style.append('text-decoration: line-through;\n')
+    style.append('}')
+    label.setStyleSheet(build(style))
+    label.setText(re.sub(r'\n', '<br>', elem.text))
+    painter.drawPixmap(upperLeft, label.grab())
+
+def textElements(folder:str, filename:str) -> list:
+    '''every compiled text element of every card in an example, with the size it's painted at'''
+    from PySide6.QtCore import QSize
+    from elements import LabelElement
+    layout, renderer = loadExample(folder, filename)
+    found = []
+    def walk(elements):
+        for elem in elements.values():
+            if elem.type is LabelElement:
+                found.append((elem, QSize(elem.width, elem.height)))
+            walk(elem.subelements)
+    for row in layout.data if layout.data is not None else [None]:
+        if row is not None:
+            row.addTo(renderer.store.macros)
+        elements = {}
+        renderer.compile(layout.elements, elements)
+        walk(elements)
+    return found
+
+@benchmark('text')
+def textBench():
+    '''paint every text element of the text heavy examples with a QLabel per element,
+    as text used to be painted, and with a QTextDocument painted straight onto the card,
+    laid out every time and kept in the text cache'''
+    from PySide6.QtCore import QPoint
+    from PySide6.QtGui import QImage, QPainter
+    from elements import LabelElement, TextCache
+    for folder, filename in (('alchemy', 'spells.cls'), ('werewolf', 'werewolf.cls'), ('playing cards', 'indexes.cls')):
+        found = textElements(folder, filename)
+        print(f'{filename}: {len(found)} text elements')
+        image = QImage(1200, 1200, QImage.Format_ARGB32_Premultiplied)
+        def paintAll(paint):
+            def run():
+                painter = QPainter(image)
+                try:
+                    for elem, size in found:
+                        paint(elem, painter, QPoint(0, 0), size)
+                finally:
+                    painter.end()
+            return run
+        def legacyPaintAll():
+            #QLabel only finds images in rich text from the working directory
+            path = os.getcwd()
+            os.chdir(os.path.join(examples, folder))
+            try:
+                paintAll(legacyLabelPaint)()
+            finally:
+                os.chdir(path)
+        baseline = timeIt(legacyPaintAll, rounds=3)
+        report('QLabel', baseline)
+        TextCache.budget = 0
+        report('QTextDocument', timeIt(paintAll(LabelElement.paint), rounds=3), baseline)
+        TextCache.budget = 32*1024*1024
+        TextCache.clearCache()
+        report('QTextDocument, cached', timeIt(paintAll(LabelElement.paint), rounds=3), baseline)
+        print(f'  {TextCache.stats()}')
+
+
+@benchmark('autofit')
+def autoFitBench():
+    '''find the largest font size that fits card text in a box by stepping down one pixel
+    at a time, by binary search, and by binary search on remembered measurements'''
+    from PySide6.QtCore import Qt, QSize
+    from elements import TextCache, makeTextDocument
+    elems = [AttrDict(text=text, fontFamily='Verdana', fontSize=60, italic=False, bold=False,
+        overline=False, underline=False, lineThrough=False, wordWrap=True, directory='') for text in fitTexts]
+    align = Qt.AlignTop|Qt.AlignHCenter
+    box = QSize(600, 240)
+    cards = 20
+    print(f'{len(elems)} texts fit into {box.width()}x{box.height()}px from 60px, {cards} cards')
+
+    def stepDown(elem):
+        for fontSize in range(elem.fontSize, 1, -1):
+            doc = makeTextDocument(elem, align, box.width(), fontSize)
+            if doc.size().height() <= box.height() and doc.idealWidth() <= box.width():
+                return fontSize
+        return 1
+    def fitAll(func):
+        def run():
+            TextCache.clearCache()
+            for _ in range(cards):
+                for elem in elems:
+                    func(elem)
+        return run
+
+    baseline = timeIt(fitAll(stepDown), rounds=3)
+    report('one pixel at a time', baseline)
+    TextCache.measureLimit = 0
+    report('binary search', timeIt(fitAll(lambda elem: TextCache.fitFontSize(elem, align, box)), rounds=3), baseline)
+    TextCache.measureLimit = 50000
+    report('binary search, measurements kept', timeIt(fitAll(lambda elem: TextCache.fitFontSize(elem, align, box)), rounds=3), baseline)
+
+
+if __name__ == '__main__':
+    from PySide6.QtWidgets import QApplication
+    app = QApplication()
+    names = sys.argv[1:] or list(benchmarks)
+    for name in names:
+        if name not in benchmarks:
+            print(f"unknown benchmark '{name}', choose from {', '.join(benchmarks)}")
+            sys.exit(1)
+        print(f'{name}:')
+        benchmarks[name]()
@@ -2,14 +2,16 @@
 
 import os
 import re
-from collections import ChainMap
+import math
+import threading
+from collections import ChainMap, OrderedDict
 from PySide6.QtCore import *
 from PySide6.QtGui import *
-from PySide6.QtWidgets import *
 from PySide6.QtSvg import *
 from utils import *
+from macros import compileValue
 
-__all__ = ["elemClasses", "ElementProtoype", "validateString", "validateNumber", "validateToggle",]
+__all__ = ["elemClasses", "ElementProtoype", "TextCache", "validateString", "validateNumber", "validateToggle",]
 
 def validateString(frame, elem):
     elem[frame.prop] = evalEscapes(frame.value)
@@ -22,9 +24,9 @@ def validateNumber(signs='+', units=('px', 'in', 'mm'), out=int):
             return False
         else:
             if out == int:
-                value = num.toInt(dpi=frame.layout.dpi)
+                value = num.toIntAt(frame.layout.dpi)
             elif out == float:
-                value = num.toFloat(dpi=frame.layout.dpi)
+                value = num.toFloatAt(frame.layout.dpi)
             else:
                 value = num
             elem[frame.prop] = value
@@ -77,9 +79,9 @@ def validateXY(frame, elem):
             value = value.toInt(whole=containerDim)
         elif value.sign == '^':
             #TODO consider making ^ a signal not a sign to allow ^-.3
-            value = containerDim - elem[dim] - value.toInt(dpi=frame.layout.dpi)
+            value = containerDim - elem[dim] - value.toIntAt(frame.layout.dpi)
         else:
-            value = value.toInt(dpi=frame.layout.dpi)
+            value = value.toIntAt(frame.layout.dpi)
         elem[frame.prop] = value
         return True
 
@@ -95,7 +97,7 @@ def validateHeightWidth(frame, elem):
     if value.unit == '%':
         value = value.toInt(whole=containerDim)
     else:
-        value = value.toInt(dpi=frame.layout.dpi)
+        value = value.toIntAt(frame.layout.dpi)
     elem[frame.prop] = value
     return True
 
@@ -123,6 +125,10 @@ alignments = {'left':Qt.AlignLeft, 'right':Qt.AlignRight, 'center':Qt.AlignHCent
         'top':Qt.AlignTop, 'bottom':Qt.AlignBottom, 'middle':Qt.AlignVCenter}
 validateAlignment = validateChoices(alignments)
 
+#these validators look at the container or at other properties of the element,
+#so they can't be run ahead of time even when the value has no macros
+contextValidators = {validateXY, validateHeightWidth, validateDraw}
+
 def countShortcut(min, *props):
     def func(value):
         values = commaSplit(value)
@@ -153,10 +159,45 @@ class ElementProtoype(ChainMap):
         self.name = name
         self.type = type_
         self.renames = renames
+        self.compiled = {prop: compileValue(value) for prop, value in self.items()}
+        #values are compiled once here, then evaluated for every card
+        self.static = {}
+        self.dynamic = dict(self.compiled)
+        self.dependencies = None
+        #the columns this element depends on, None means it has to be compiled for every card
         if container is not None:
             self.qualName = f'{container}->{name}'
         else:
             self.qualName = name
+
+    def prevalidate(self, layout):
+        '''properties without macros whose validators don't look at the container
+        come out the same on every card, so validate them once here and keep the result.
+        anything that fails stays dynamic so the error is raised while rendering like before'''
+        frame = AttrDict(name=self.qualName, layout=layout, container=None, containerValue=None)
+        self.static = {}
+        self.dynamic = {}
+        for prop, compiled in self.compiled.items():
+            func = self.type.validators.get(prop)
+            if compiled.hasMacros or func in contextValidators or func in threadValidators:
+                self.dynamic[prop] = compiled
+                continue
+            if func is None:
+                continue
+            elem = AttrDict(name=self.qualName, type=self.type)
+            frame.elem = elem
+            frame.prop = prop
+            frame.value = compiled.source
+            try:
+                result = func(frame, elem)
+            except CLSError:
+                result = False
+            if result:
+                for key, value in elem.items():
+                    if key not in ('name', 'type'):
+                        self.static[key] = value
+            else:
+                self.dynamic[prop] = compiled
     
     def validate(self, frame:AttrDict):
         trueProp = frame.prop
@@ -189,13 +230,14 @@ class ElementProtoype(ChainMap):
             frame.container = container.copy()
          
         elem = AttrDict(name=self.qualName, type=self.type)
+        elem.update(self.static)
         frame.elem = elem
         
         store.add('elementName', self.qualName)
         
         xyProps = ['x', 'y']
 
-        for prop, value in self.items():
+        for prop, compiled in self.dynamic.items():
             if prop in xyProps:
                 continue
             if frame.container != 'layout' and prop in frame.container:
@@ -204,7 +246,7 @@ class ElementProtoype(ChainMap):
                 frame.containerValue = None
             store.add('propertyName', prop)
             frame.prop = prop
-            frame.value = store.parse(value)
+            frame.value = store.evaluate(compiled)
             #the validate function puts the new value on element
             self.validate(frame)
 
@@ -216,12 +258,11 @@ class ElementProtoype(ChainMap):
             #x and y need to be validated after width and height
             if prop not in self:
                 continue
-            value = self[prop]
             if frame.container != 'layout' and prop in frame.container:
                 frame.containerValue = frame.container[prop]
             store.add('propertyName', prop)
             frame.prop = prop
-            frame.value = store.parse(value)
+            frame.value = store.evaluate(self.compiled[prop])
             self.validate(frame)
         
         if hasattr(self.type, 'postCompile'):
@@ -300,17 +341,89 @@ def validateShrinkFont(frame, elem):
         if parsedSize is None:
             frame.value = size
             return False
-        result.append((parsedNum.toInt(), parsedSize.toInt(dpi=frame.layout.dpi)))
+        result.append((parsedNum.toInt(), parsedSize.toIntAt(frame.layout.dpi)))
     elem[frame.prop] = result
     return True
 
+def validateText(frame, elem):
+    elem[frame.prop] = evalEscapes(frame.value)
+    #images in the text are found relative to the layout
+    elem.directory = frame.layout.directory
+    return True
+
 def validateFontWeight(frame, elem):
+    #weights follow style sheets, which clamp numbers to the weights Qt has
     if frame.value == '':
         return True
-    value = Unit.fromStr(frame.value, signs='+', units=('',))
-    if value is None:
+    if frame.value.lower() in fontWeights:
+        weight = fontWeights[frame.value.lower()]
+    else:
+        value = Unit.fromStr(frame.value, signs='+', units=('',))
+        if value is None:
+            return False
+        weight = min(max(value.toInt(), 1), 1000)
+    try:
+        elem.fontWeight = QFont.Weight(weight)
+    except ValueError:
+        #older versions of PySide only take the named weights
+        elem.fontWeight = min(QFont.Weight, key=lambda named: abs(named.value-weight))
+    return True
+
+fontWeights = {'normal': 400, 'bold': 700}
+
+colorFunction = re.compile(r'(rgb|hsv|hsl)(a?)\(([^()]*)\)')
+colorNumber = re.compile(r'\s*([+-]?(?:\d*\.)?\d+)(%?)\s*')
+
+def parseColor(string:str) -> QColor|None:
+    '''read a color the way a style sheet does, a name, #hex, or one of
+    rgb(), rgba(), hsv(), hsva(), hsl() and hsla(), None if it isn't a color'''
+    string = string.strip()
+    match = colorFunction.fullmatch(string)
+    if match is None:
+        if string.lower() == 'transparent':
+            return QColor(Qt.transparent)
+        color = QColor(string)
+        return color if color.isValid() else None
+
+    kind, alpha, args = match.groups()
+    nums = []
+    for i, arg in enumerate(args.split(',')):
+        num = colorNumber.fullmatch(arg)
+        if num is None:
+            return None
+        value = float(num[1])
+        if num[2] == '%':
+            #a hue goes around to 359, everything else up to 255
+            value *= (359 if i == 0 and kind != 'rgb' else 255)/100
+        nums.append(value)
+    if len(nums) != (4 if alpha else 3):
+        return None
+    #style sheets round each value to an int, an alpha of 1 or less is a fraction
+    ints = [math.floor(value+0.5) if value >= 0 else math.ceil(value-0.5) for value in nums]
+    if alpha:
+        if ints[3] <= 1:
+            ints[3] = int(nums[3]*255)
+    else:
+        ints.append(255)
+    if kind == 'rgb':
+        first = range(0, 256)
+    else:
+        #a hue of -1 is a gray
+        first = range(-1, 360)
+    if ints[0] not in first or any(value < 0 or value > 255 for value in ints[1:]):
+        return None
+    if kind == 'rgb':
+        return QColor.fromRgb(*ints)
+    elif kind == 'hsv':
+        return QColor.fromHsv(*ints)
+    else:
+        return QColor.fromHsl(*ints)
+
+def validateColor(frame, elem):
+    color = parseColor(evalEscapes(frame.value))
+    if color is None:
         return False
-    elem.fontWeight = value.toInt()
+    elem[frame.prop] = color
     return True
 
 
@@ -335,6 +448,7 @@ class LabelElement():
         fontSize = '22pt',
         fontColor = 'black',
         shrinkFont = '()',
+        autoFit = 'no',
         wordWrap = 'yes',
         hAlign = 'center',
         vAlign = 'top',
@@ -347,11 +461,12 @@ class LabelElement():
     ))
 
     validators = Element.validators.new_child(dict(
-        text = validateString,
+        text = validateText,
         fontFamily = validateString,
         fontSize = validateNumber(units=validFontSizes),
-        fontColor = validateString,
+        fontColor = validateColor,
         shrinkFont = validateShrinkFont,
+        autoFit = validateToggle,
         wordWrap = validateToggle,
         vAlign = validateAlignment,
         hAlign = validateAlignment,
@@ -377,6 +492,7 @@ class LabelElement():
         'font-size': 'fontSize',
         'font FONT-SIZE': 'fontSize',
         'shrink-font': 'shrinkFont',
+        'auto-fit': 'autoFit',
         'word-wrap': 'wordWrap',
         'v-align': 'vAlign',
         'align V-ALIGN': 'vAlign',
@@ -389,14 +505,6 @@ class LabelElement():
 
     @staticmethod
     def paint(elem, painter:QPainter, upperLeft:QPoint, size:QSize):
-
-
-        label = QLabel()        
-        label.setTextFormat(Qt.RichText)
-        label.setAttribute(Qt.WA_TranslucentBackground, True)
-        label.setAlignment(elem.vAlign|elem.hAlign)
-        label.setWordWrap(elem.wordWrap)
-        label.resize(size)
         
         if len(elem.shrinkFont) > 0:
             textLen = countPrintingChars(elem.text)
@@ -406,25 +514,182 @@ class LabelElement():
                 else:
                     break
 
-        style = ['QLabel {']
-        style.append(f'font-size: {elem.fontSize}px;\n')
-        style.append(f'font-family: {elem.fontFamily};\n')
-        style.append(f'color: {elem.fontColor};\n')
-        if elem.italic: style.append('font-style: italic;\n')
-        if 'fontWeight' in elem:
-            style.append(f'font-weight: {elem.fontWeight};\n')
-        else:
-            if elem.bold: style.append('font-weight: bold;\n')
-        if elem.overline: style.append('text-decoration: overline;\n')
-        if elem.underline: style.append('text-decoration: underline;\n')
-        if elem.lineThrough: style.append('text-decoration: line-through;\n')
-        #style += "font-variant-numeric: lining-nums;\n" someday *dreamy sigh*
-        style.append('}')
-        label.setStyleSheet(build(style))
-        
-        
-        label.setText(re.sub(r'\n', '<br>', elem.text))
-        painter.drawPixmap(upperLeft, label.grab())
+        align = elem.vAlign|elem.hAlign
+        #Qt's rich text isn't safe to use from two threads at once, so text is
+        #laid out and painted one element at a time, other elements still paint alongside
+        with TextCache.textLock:
+            if elem.autoFit:
+                #font-size becomes the largest the text may be
+                elem.fontSize = TextCache.fitFontSize(elem, align, size)
+            doc = TextCache.getDocument(elem, align, size.width())
+
+            #vertical alignment is up to us, rounded down to whole pixels like QLabel does
+            height = doc.size().height()
+            if align & Qt.AlignVCenter:
+                offset = max((size.height()-height)/2, 0)
+            elif align & Qt.AlignBottom:
+                offset = max(size.height()-height, 0)
+            else:
+                offset = 0
+
+            painter.save()
+            painter.setClipRect(QRect(upperLeft, size), Qt.IntersectClip)
+            painter.translate(upperLeft.x(), upperLeft.y()+math.floor(offset))
+            if not painter.transform().isRotating():
+                #keep lines and images crisp when they line up with the pixels
+                painter.setRenderHint(QPainter.Antialiasing, False)
+                painter.setRenderHint(QPainter.SmoothPixmapTransform, False)
+            context = QAbstractTextDocumentLayout.PaintContext()
+            context.palette.setColor(QPalette.Text, elem.fontColor)
+            doc.documentLayout().draw(painter, context)
+            painter.restore()
+
+class TextCache():
+    '''a static class that holds laid out text, so text that repeats from card to card
+    is only laid out once. the color is applied when painting, so it isn't part of the key'''
+    cache = OrderedDict()
+    #key -> (document, cost), least recently used first
+    budget = 32*1024*1024
+    #roughly how many bytes of documents to hold on to
+    size = 0
+    hits = 0
+    misses = 0
+    evictions = 0
+    measurements = OrderedDict()
+    #key -> size, for fitting text, least recently used first
+    measureLimit = 50000
+    lock = threading.Lock()
+    #held while the cache changes, so cards can be painted on more than one thread
+    textLock = threading.RLock()
+    #held while text is laid out or painted
+
+    @staticmethod
+    def cost(text:str) -> int:
+        '''a rough guess at the bytes a laid out document takes, from measuring Qt 6'''
+        return 8*1024 + 32*len(text)
+
+    @staticmethod
+    def key(elem, align:Qt.AlignmentFlag, width:int, fontSize:int) -> tuple:
+        '''everything that changes how the text of a text element is laid out'''
+        fontWeight = elem.fontWeight if 'fontWeight' in elem else None
+        return (elem.text, elem.directory, elem.fontFamily, fontSize, elem.italic, elem.bold, fontWeight,
+            elem.overline, elem.underline, elem.lineThrough, elem.wordWrap, align, width)
+
+    @staticmethod
+    def getDocument(elem, align:Qt.AlignmentFlag, width:int) -> QTextDocument:
+        '''returns the laid out text of a text element, documents are shared so don't change them'''
+        #documents hold on to the fonts of the thread that laid them out
+        key = (threadKey(),) + TextCache.key(elem, align, width, elem.fontSize)
+        with TextCache.lock:
+            entry = TextCache.cache.get(key)
+            if entry is not None:
+                TextCache.cache.move_to_end(key)
+                TextCache.hits += 1
+                return entry[0]
+            TextCache.misses += 1
+
+        doc = makeTextDocument(elem, align, width)
+        cost = TextCache.cost(elem.text)
+        with TextCache.lock:
+            if cost <= TextCache.budget and key not in TextCache.cache:
+                TextCache.cache[key] = (doc, cost)
+                TextCache.size += cost
+                while TextCache.size > TextCache.budget:
+                    oldKey, (oldDoc, oldCost) = TextCache.cache.popitem(last=False)
+                    TextCache.size -= oldCost
+                    TextCache.evictions += 1
+        return doc
+
+    @staticmethod
+    def measure(elem, align:Qt.AlignmentFlag, width:int, fontSize:int) -> QSizeF:
+        '''the size the text of a text element takes up at fontSize, measurements are kept
+        so fitting the same text again doesn't lay anything out'''
+        key = TextCache.key(elem, align, width, fontSize)
+        with TextCache.lock:
+            size = TextCache.measurements.get(key)
+            if size is not None:
+                TextCache.measurements.move_to_end(key)
+                return size
+        doc = makeTextDocument(elem, align, width, fontSize)
+        #idealWidth catches lines that can't wrap
+        size = QSizeF(doc.idealWidth(), doc.size().height())
+        with TextCache.lock:
+            TextCache.measurements[key] = size
+            if len(TextCache.measurements) > TextCache.measureLimit:
+                TextCache.measurements.popitem(last=False)
+        return size
+
+    @staticmethod
+    def fitFontSize(elem, align:Qt.AlignmentFlag, size:QSize) -> int:
+        '''the largest font size up to elem.fontSize that fits the text in size, or 1 if none do'''
+        low = 1
+        high = elem.fontSize
+        while low < high:
+            mid = (low+high+1)//2
+            measured = TextCache.measure(elem, align, size.width(), mid)
+            if measured.height() <= size.height() and measured.width() <= size.width():
+                low = mid
+            else:
+                high = mid-1
+        return low
+
+    @staticmethod
+    def stats() -> str:
+        '''how well the cache is doing, as one line'''
+        lookups = TextCache.hits + TextCache.misses
+        rate = TextCache.hits/lookups*100 if lookups > 0 else 0
+        return (f'text cache: {TextCache.hits} hits, {TextCache.misses} misses ({rate:.1f}% hit), '
+            f'{TextCache.evictions} evicted, {len(TextCache.cache)} held in '
+            f'{TextCache.size/1024/1024:.1f}MB of {TextCache.budget/1024/1024:.0f}MB, '
+            f'{len(TextCache.measurements)} measurements')
+
+    @staticmethod
+    def clearCache():
+        with TextCache.lock:
+            TextCache.cache = OrderedDict()
+            TextCache.size = 0
+            TextCache.hits = 0
+            TextCache.misses = 0
+            TextCache.evictions = 0
+            TextCache.measurements = OrderedDict()
+
+def makeTextFont(elem, fontSize:int=None) -> QFont:
+    '''the font for a text element, at fontSize if it's given'''
+    font = QFont()
+    families = [family.strip().strip('\'"') for family in elem.fontFamily.split(',')]
+    families = [family for family in families if family != '']
+    if len(families) > 0:
+        font.setFamilies(families)
+    font.setPixelSize(elem.fontSize if fontSize is None else fontSize)
+    if elem.italic:
+        font.setItalic(True)
+    if 'fontWeight' in elem:
+        font.setWeight(elem.fontWeight)
+    elif elem.bold:
+        font.setWeight(QFont.Bold)
+    font.setOverline(elem.overline)
+    font.setUnderline(elem.underline)
+    font.setStrikeOut(elem.lineThrough)
+    return font
+
+def makeTextDocument(elem, align:Qt.AlignmentFlag, width:int, fontSize:int=None) -> QTextDocument:
+    '''lay out the rich text of a text element in a box width wide, the way QLabel does'''
+    doc = QTextDocument()
+    doc.setUndoRedoEnabled(False)
+    doc.setDefaultFont(makeTextFont(elem, fontSize))
+    #the trailing separator makes the layout's folder the base, not its parent
+    doc.setBaseUrl(QUrl.fromLocalFile(os.path.join(elem.directory, '')))
+    doc.setHtml(elem.text.replace('\n', '<br>'))
+    option = doc.defaultTextOption()
+    option.setAlignment(align)
+    if elem.wordWrap:
+        option.setWrapMode(QTextOption.WordWrap)
+    else:
+        option.setWrapMode(QTextOption.ManualWrap)
+    doc.setDefaultTextOption(option)
+    doc.setDocumentMargin(0)
+    doc.setTextWidth(width)
+    return doc
 
 
 def validateScale(frame, elem):
@@ -442,7 +707,7 @@ def validateScale(frame, elem):
 
 def validateImage(frame, elem):
 
-    elem[frame.prop] = ImageGetter.getImage(frame.value)
+    elem[frame.prop] = ImageGetter.getImage(resolvePath(frame.layout.directory, frame.value))
     return True
 
 class ImageElement():
@@ -477,7 +742,7 @@ class ImageElement():
 
     @staticmethod
     def paint(elem, painter:QPainter, upperLeft:QPoint, size:QSize):
-        painter.drawPixmap(upperLeft, elem.source)
+        painter.drawImage(upperLeft, elem.source)
 
     @staticmethod
     def midCompile(elem):
@@ -511,14 +776,17 @@ class ImageElement():
         
         elem.width = elem.source.width()
         elem.height = elem.source.height()
-        elem.source = QPixmap.fromImage(elem.source)
 
 
 def validateSVG(frame, elem):
-    elem[frame.prop] = SvgGetter.getSvg(frame.value)
+    elem[frame.prop] = SvgGetter.getSvg(resolvePath(frame.layout.directory, frame.value))
     return elem[frame.prop].isValid()
 
 
+#images and svgs are kept per thread by their getters, so
+#they're looked up for every card instead of once in buildLayout
+threadValidators = {validateImage, validateSVG}
+
 class SVGElement():
     defaults = ImageElement.defaults.new_child(dict(
         id = '',
@@ -1,63 +1,329 @@
 import os
 import re
 import random
-from collections import ChainMap, deque
-from typing import Union, Callable, Collection
+import time
+import threading
+from collections import ChainMap, OrderedDict
+from functools import lru_cache
+from typing import Union, Callable, Collection, Iterable, Mapping
 import operator
 from utils import *
 
-__all__ = ['MacroStore']
+__all__ = ['MacroStore', 'MacroCache', 'MacroProfiler', 'ArgFrame', 'LocalFrame', 'CompiledValue', 'DependencyFinder', 'compileValue', 'compileBody']
 
 
+class MacroCache():
+    '''a bounded LRU cache for the results of pure macros. stores on other threads share it,
+    get and put only make single dict calls, which the GIL keeps whole, so they don't take the lock'''
+    def __init__(self, size:int):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        #for the methods that change more than one thing at once
+
+    def get(self, key:tuple) -> str|None:
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            try:
+                self.entries.move_to_end(key)
+            except KeyError:
+                #another thread pushed it out after it was found
+                pass
+        return result
+
+    def put(self, key:tuple, value:str):
+        self.entries[key] = value
+        if len(self.entries) > self.size:
+            try:
+                self.entries.popitem(last=False)
+            except KeyError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        '''hit and miss counts, for checking if the cache is paying off'''
+        total = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, size=len(self.entries),
+            hitRate=self.hits/total if total > 0 else 0.0)
+
+    def count(self, hits:int, misses:int):
+        '''add lookups made by another cache, like the one in a worker process'''
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def summary(self) -> str:
+        '''stats() as one line, like TextCache.stats()'''
+        stats = self.stats()
+        return (f"macro cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hitRate']:.1%} hit), "
+            f"{stats['size']} of {self.size} held")
+
+class MacroProfiler():
+    '''records how many times each macro is called and how long it takes,
+    broken down by element and property. turn it on by setting MacroStore.profiler
+    total time includes the macros called by a macro, self time doesn't'''
+    def __init__(self):
+        self.entries = {}
+        #(macro, element, property) -> [calls, total, self]
+        self.local = threading.local()
+        #local.children is the time spent in called macros, for each macro still running on a thread
+        self.lock = threading.Lock()
+
+    def run(self, key:tuple[str, str, str], func:Callable, *args):
+        '''call func and charge the time it takes to key'''
+        children = getattr(self.local, 'children', None)
+        if children is None:
+            children = self.local.children = []
+        children.append(0.0)
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            took = time.perf_counter() - start
+            own = took - children.pop()
+            if len(children) > 0:
+                children[-1] += took
+            self.add(key, 1, took, own)
+
+    def add(self, key:tuple[str, str, str], calls:int, total:float, own:float):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = [0, 0.0, 0.0]
+            entry[0] += calls
+            entry[1] += total
+            entry[2] += own
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+        self.local = threading.local()
+
+    def merge(self, entries:dict):
+        '''add the entries of another profiler, like one from a worker process'''
+        for key, (calls, total, own) in entries.items():
+            self.add(key, calls, total, own)
+
+    def rows(self) -> list[dict]:
+        '''every entry as a dict, slowest self time first'''
+        with self.lock:
+            rows = [dict(macro=macro, element=elem, property=prop, calls=calls, total=total, self=own)
+                for (macro, elem, prop), (calls, total, own) in self.entries.items()]
+        rows.sort(key=lambda row: row['self'], reverse=True)
+        return rows
+
+    def table(self, limit:int=None) -> str:
+        '''a text table of the slowest macros, first by macro then by element and property'''
+        byMacro = {}
+        for row in self.rows():
+            calls, total, own = byMacro.get(row['macro'], (0, 0.0, 0.0))
+            byMacro[row['macro']] = (calls+row['calls'], total+row['total'], own+row['self'])
+        macros = sorted(byMacro.items(), key=lambda item: item[1][2], reverse=True)
+
+        lines = [f"{'macro':<20} {'calls':>9} {'total ms':>11} {'self ms':>11}"]
+        for name, (calls, total, own) in macros[:limit]:
+            lines.append(f'{name:<20} {calls:>9} {total*1000:>11.2f} {own*1000:>11.2f}')
+        lines.append('')
+        rows = self.rows()[:limit]
+        elemWidth = max([len('element')] + [len(row['element']) for row in rows])
+        propWidth = max([len('property')] + [len(row['property']) for row in rows])
+        lines.append(f"{'macro':<20} {'element':<{elemWidth}} {'property':<{propWidth}} {'calls':>9} {'total ms':>11} {'self ms':>11}")
+        for row in rows:
+            lines.append(f"{row['macro']:<20} {row['element']:<{elemWidth}} {row['property']:<{propWidth}} {row['calls']:>9} {row['total']*1000:>11.2f} {row['self']*1000:>11.2f}")
+        return '\n'.join(lines)
+
+def argIndex(name:str) -> int|None:
+    '''the index into a user macro's arguments for a numbered arg like [1]'''
+    if name.isascii() and name.isdigit() and name[0] != '0':
+        return int(name)-1
+    return None
+
+class LocalFrame():
+    '''a single local macro, like [d] in [dup| ] or [item] in [for-each| ]
+    the value can be changed between iterations so one frame serves a whole loop'''
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name:str, value:str=''):
+        self.name = name
+        self.value = value
+
+    def get(self, name:str) -> str|None:
+        if name == self.name:
+            return self.value
+        return None
+
+class ArgFrame():
+    '''the arguments of a user macro, [args] is only built if it's used'''
+    __slots__ = ('args', 'list')
+
+    def __init__(self, args:tuple[str]):
+        self.args = args
+        self.list = None
+
+    def get(self, name:str) -> str|None:
+        if name == 'arg-total':
+            return str(len(self.args))
+        elif name == 'args':
+            if self.list is None:
+                self.list = makeList(self.args)
+            return self.list
+        else:
+            index = argIndex(name)
+            if index is not None and index < len(self.args):
+                return self.args[index]
+        return None
+
 class MacroStore():
 
     stdlib = {'': ''}
+    pureMacros = set()
+    #functions that always give the same result for the same parsed arguments
+    cache = MacroCache(4096)
+    profiler = None
+    #a MacroProfiler to time every macro call with, off by default
+
+    #limits that stop runaway macros, None turns a limit off
+    maxDepth = 64
+    #how deep macros can call each other, and how many times a value can be rescanned
+    maxCalls = 100000
+    #how many macros a single property can call
+    maxCardTime = 60.0
+    #how many seconds a card can spend evaluating macros, checked every 256 calls on the card
+    #and every 256 steps of [dup| ] and [for-each| ]
 
     @classmethod
-    def addStdlib(cls, name:str, value:Union[int, str]):
+    def addStdlib(cls, name:str, value:Union[int, str], pure:bool=False):
         '''with two strings, add text macro
-        with a string and an int, use as a decorator to add a function'''
+        with a string and an int, use as a decorator to add a function
+        pure macros must parse every argument and only depend on them,
+        their arguments are parsed up front and their results cached'''
         def inner(func:Callable):
-            if type(func) == str:
+            if isinstance(func, str):
                 cls.stdlib[name] = func
             else:
                 cls.stdlib[name] = (func, value)
+                if pure:
+                    cls.pureMacros.add(func)
             return func
-        if type(value) == str:
+        if isinstance(value, str):
             inner(value)
         else:
             return inner
 
     def __init__(self):
         self.macros = ChainMap({}, self.stdlib)
+        self.frames = []
+        #local macros from user macros, [dup| ] and [for-each| ], innermost last
+        self.chain = []
+        #the names of the macros currently being called, outermost first
+        self.calls = 0
+        #macro calls in the current property
+        self.cardCalls = 0
+        #macro calls on the current card, for checking the clock
+        self.deadline = None
+        self.directory = ''
+        #the folder file names are relative to, '' is the working directory
 
     def copy(self):
         '''make a copy of this MacroStore'''
         new = MacroStore()
         new.macros = self.macros.new_child()
+        new.directory = self.directory
         return new
 
     def add(self, name:str, value:Union[list[int], str]):
         '''with two strings, add text macro
         with a string and an int, use as a decorator to add a function'''
         def inner(func:Callable):
-            if type(func) == str:
+            if isinstance(func, str):
                 self.macros[name] = func
             else:
                 self.macros[name] = (func, value)
             return func
 
-        if type(value) == str:
+        if isinstance(value, str):
             inner(value)
         else:
             return inner
 
+    def lookup(self, name:str) -> str|tuple|None:
+        '''find a macro by name, local macros shadow the ones in the store'''
+        if len(self.frames) > 0:
+            for frame in reversed(self.frames):
+                value = frame.get(name)
+                if value is not None:
+                    return value
+        return self.macros.get(name)
+
+    def parseIn(self, frame:LocalFrame|ArgFrame, string:str) -> str:
+        '''parse string with the local macros of frame visible'''
+        self.frames.append(frame)
+        try:
+            return self.parse(string)
+        finally:
+            self.frames.pop()
+
     def call(self, name:str, context:Collection, args:str) -> str:
         '''call a macro by name'''
         #print(f'{name!r} : {args!r}')
-        if name in self.macros:
-            macro = self.macros[name]
-            if type(macro) == str:
+        self.checkLimits(name, context)
+        self.chain.append(name)
+        try:
+            if self.profiler is not None:
+                return self.profiler.run((name, context.elem, context.prop), self.callMacro, name, context, args)
+            return self.callMacro(name, context, args)
+        finally:
+            self.chain.pop()
+
+    def startCard(self):
+        '''start the clock for maxCardTime'''
+        self.cardCalls = 0
+        if self.maxCardTime is None:
+            self.deadline = None
+        else:
+            self.deadline = time.perf_counter() + self.maxCardTime
+
+    def describeChain(self, *names:str) -> str:
+        '''the macros being called, for error messages'''
+        names = [f'[{name}]' for name in [*self.chain, *names]]
+        if len(names) > 8:
+            names = names[:3] + [f'({len(names)-6} more)'] + names[-3:]
+        return ' -> '.join(names)
+
+    def checkLimits(self, name:str, context:Collection):
+        '''raise an error if calling another macro would go over a limit'''
+        self.calls += 1
+        self.cardCalls += 1
+        if self.maxDepth is not None and len(self.chain) >= self.maxDepth:
+            raise ExpansionLimitError(context.elem, context.prop,
+                f'macros nested more than {self.maxDepth} deep', self.describeChain(name))
+        if self.maxCalls is not None and self.calls > self.maxCalls:
+            raise ExpansionLimitError(context.elem, context.prop,
+                f'more than {self.maxCalls} macro calls', self.describeChain(name))
+        if self.cardCalls % 256 == 0:
+            self.checkClock(context, name)
+
+    def checkClock(self, context:Collection, *names:str):
+        '''raise an error if the card has gone past maxCardTime, reading the clock
+        takes a while so callers only check it every so often'''
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise ExpansionLimitError(context.elem, context.prop,
+                f'card took longer than {self.maxCardTime} seconds', self.describeChain(*names))
+
+    def callMacro(self, name:str, context:Collection, args:str) -> str:
+        macro = self.lookup(name)
+        if macro is not None:
+            if isinstance(macro, str):
                 return macro
             else:
                 func, signature = macro
@@ -66,7 +332,6 @@ class MacroStore():
                         raise CLSError('wrong number of arguments for [{macro}| ], expected {num} got {badnum}',
                         elem=context.elem, prop=context.prop, macro=name, num=signature, badnum=len(args)
                         )
-                    return func(context, *args)
 
                 else:
                     min, max = signature
@@ -78,124 +343,98 @@ class MacroStore():
                         raise CLSError('too many arguments for [{macro}| ], expected at most {num} got {badnum}',
                         elem=context.elem, prop=context.prop, macro=name, num=max, badnum=len(args)
                         )
-                    return func(context, *args)
+                if func in self.pureMacros:
+                    return self.callPure(func, context, args)
+                return func(context, *args)
         else:
             return ''
-        
-    def parseMacroArg(self, ps, context) -> str:
-        argB = []
-        macroStack = []
-        char = ''
-
-        while ps.pos < len(ps.string):
-            char = ps.string[ps.pos]
-
-            if char == '\\':
-                argB.append(ps.string[ps.pos:ps.pos+2])
-                ps.pos += 1
 
-            elif char in '[(':
-                macroStack.append(char)
-                argB.append(char)
-            
-            elif char == ')':
-                if len(macroStack) == 0:
-                    #we never saw the opener
-                    raise ImbalancedDelimError(context.elem, context.prop, ps.string)
-                opener = macroStack.pop()
-                if opener == '[':
-                    raise ImbalancedDelimError(context.elem, context.prop, ps.string)
-                argB.append(char)
-
-            elif char in ',|]':
-                if len(macroStack) == 0:
-                    ps.pos -= 1 #backtrack so evalMacro can see the comma/bracket
-                    return ''.join(argB).strip()
-                else:
-                    if char == ']':
-                        opener = macroStack.pop()
-                        if opener == '(':
-                            raise ImbalancedDelimError(context.elem, context.prop, ps.string)
-                    argB.append(char)
-            
-            else:
-                argB.append(char)
-
-            ps.pos += 1
+    def callPure(self, func:Callable, context:Collection, args:list[str]) -> str:
+        '''call a pure macro, using the cache if it's been called with these arguments before'''
+        args = [self.parse(arg) for arg in args]
+        key = (func, *args)
+        result = self.cache.get(key)
+        if result is None:
+            #the args are already parsed, so the macro is handed them as they are
+            parsed = Collection(**vars(context))
+            parsed.parse = keepParsed
+            result = func(parsed, *args)
+            self.cache.put(key, result)
+        return result
         
-        raise ImbalancedDelimError(context.elem, context.prop, ps.string)
-
-
-    def evalMacro(self, ps) -> str:
-        '''evalMacro parses out a macro then calls it with its arguments and context
+    def evalParts(self, compiled:'CompiledValue') -> list[str]:
+        '''evaluates the top layer of macros in a compiled value, returning
+        the text of each part. each macro is called with its arguments and context
         context includes:
          - store - this macroStore object
          - parse - a reference to the parse method of this object
          - source - the string the macro was found in, used for errors
          - prop - the property this macro was found in, used for errors
-         - elem - the element this macro was found in, used for errors'''
-        nameB = []
-        args = []
-        char = ''
-
+         - elem - the element this macro was found in, used for errors
+         - name - the name of the macro being called'''
         context = Collection(
             store=self,
             parse=self.parse,
-            source=ps.string,
+            source=compiled.source,
             prop = self.macros['propertyName'],
             elem = self.macros['elementName']
         )
-        while ps.pos < len(ps.string):
-            char = ps.string[ps.pos]
-            if char == '\\':
-                nameB.append(ps.string[ps.pos:ps.pos+2])
-                ps.pos += 1
-                
-            elif char in ',|':
-                ps.pos += 1
-                args.append(self.parseMacroArg(ps, context))
-            
-            elif char == ']':
-                name = build(nameB)
-                context.name = name
-                return self.call(name, context, args)
-            
-            elif char == ')': #? might be wrong, or might need a stack
-                raise ImbalancedDelimError(context.elem, context.prop, ps.string)
-
+        result = []
+        for part in compiled.parts:
+            if type(part) is str:
+                result.append(part)
+            elif type(part) is MacroCall:
+                context.name = part.name
+                result.append(self.call(part.name, context, part.args))
+            elif type(part) is ArgSlot:
+                #only found in user macro bodies, so the top frame holds the args
+                args = self.frames[-1].args
+                if part.index < len(args):
+                    result.append(args[part.index])
+                else:
+                    context.name = part.call.name
+                    result.append(self.call(part.call.name, context, part.call.args))
             else:
-                nameB.append(char)
+                raise part.error(context.elem, context.prop, compiled.source)
+
+        return result
 
-            ps.pos += 1
-        raise UnclosedMacroError(context.elem, context.prop, ps.string)
+    def evalCompiled(self, compiled:'CompiledValue') -> str:
+        '''evaluates the top layer of macros in a compiled value
+        a value that's a single macro gives back exactly what the macro did, TypedText and all'''
+        parts = self.evalParts(compiled)
+        if len(parts) == 1:
+            return parts[0]
+        return ''.join(parts)
 
     def evalValue(self, string:str) -> str:
         '''looks at a string, and if it finds a macro, parses it'''
-        ps = Collection()
-        ps.string = string
-        ps.pos = 0
-        result = []
-
-        char = ''
-
-        while ps.pos < len(ps.string):
-            char = ps.string[ps.pos]
-        
-            if char == '\\':
-                result.append(ps.string[ps.pos:ps.pos+2])
-                ps.pos += 1
-                #ignore escapes
-        
-            elif char == '[':
-                ps.pos += 1
-                result.append(self.evalMacro(ps))
-        
-            else:
-                result.append(char)
-            
-            ps.pos += 1
-
-        return ''.join(result)
+        return self.evalCompiled(compileValue(string))
+
+    def evaluate(self, compiled:'CompiledValue') -> str:
+        '''evaluate a compiled value until there are no more macros left'''
+        if len(self.chain) == 0:
+            #a new property, or something else evaluated on its own
+            self.calls = 0
+        passes = 0
+        result = compiled.source
+        while compiled.hasMacros:
+            passes += 1
+            if self.maxDepth is not None and passes > self.maxDepth:
+                names = [part.name for part in compiled.parts if type(part) is MacroCall]
+                raise ExpansionLimitError(self.macros['elementName'], self.macros['propertyName'],
+                    f'value rescanned more than {self.maxDepth} times', self.describeChain(*names[:1]))
+            result = self.evalCompiled(compiled)
+            compiled = compileValue(result)
+        return result
+
+    def evalBody(self, frame:ArgFrame, body:'CompiledValue') -> str:
+        '''evaluate a user macro body from compileBody() with its args in frame'''
+        self.frames.append(frame)
+        try:
+            return self.evaluate(body)
+        finally:
+            self.frames.pop()
 
     def parse(self, string:str) -> str:
         '''parse() turns a value into a real usable object, and evalValue
@@ -205,14 +444,240 @@ class MacroStore():
         that don't have anymore macros, but still have escapes incase of more
         square brackets.
         '''
-        while True:
-            match = re.search(r'(?<!\\)\[', string)
-            if match:
-                string = self.evalValue(string)
-            else:
-                break
-        return string
+        return self.evaluate(compileValue(string))
+
 
+def keepParsed(string:str) -> str:
+    '''parse for text that's already been parsed, parsing it again would give it back as it is'''
+    return string
+
+class MacroCall():
+    '''a macro found by the compiler, args are left as text because
+    macros decide for themselves if and when to parse them'''
+    __slots__ = ('name', 'args')
+
+    def __init__(self, name:str, args:list[str]):
+        self.name = name
+        self.args = args
+
+    def __repr__(self):
+        return f'MacroCall({self.name!r}, {self.args!r})'
+
+class DeferredError():
+    '''a syntax error found by the compiler, it's raised when evaluation
+    reaches it so errors come out in the same order they always have'''
+    __slots__ = ('error',)
+
+    def __init__(self, error:type[CLSError]):
+        self.error = error
+
+class ArgSlot():
+    '''a numbered arg like [1] in a user macro body, looked up by index
+    instead of by name. call is used if the macro got fewer args'''
+    __slots__ = ('call', 'index')
+
+    def __init__(self, call:MacroCall, index:int):
+        self.call = call
+        self.index = index
+
+    def __repr__(self):
+        return f'ArgSlot({self.index!r})'
+
+class CompiledValue():
+    '''a value broken up into literal text and macro calls'''
+    __slots__ = ('source', 'parts', 'hasMacros')
+
+    def __init__(self, source:str, parts:list):
+        self.source = source
+        self.parts = parts
+        self.hasMacros = re.search(r'(?<!\\)\[', source) is not None
+
+    def __repr__(self):
+        return f'CompiledValue({self.parts!r})'
+
+class MacroCompiler():
+    '''scans a value once and turns it into a CompiledValue
+    use compileValue() rather than this class directly, it caches results'''
+
+    class ScanError(Exception):
+        def __init__(self, error):
+            self.error = error
+
+    def __init__(self, string:str):
+        self.string = string
+        self.tokens = []
+        self.pos = 0
+
+    def compileMacroArg(self) -> str:
+        argB = []
+        macroStack = []
+
+        while self.pos < len(self.tokens):
+            token = self.tokens[self.pos]
+
+            if token == '[' or token == '(':
+                macroStack.append(token)
+            
+            elif token == ')':
+                if len(macroStack) == 0 or macroStack.pop() == '[':
+                    #we never saw the opener, or it was the wrong one
+                    raise self.ScanError(ImbalancedDelimError)
+
+            elif token == ',' or token == '|' or token == ']':
+                if len(macroStack) == 0:
+                    self.pos -= 1 #backtrack so compileMacro can see the comma/bracket
+                    return build(argB)
+                elif token == ']':
+                    if macroStack.pop() == '(':
+                        raise self.ScanError(ImbalancedDelimError)
+
+            argB.append(token)
+            self.pos += 1
+        
+        raise self.ScanError(ImbalancedDelimError)
+
+    def compileMacro(self) -> MacroCall:
+        nameB = []
+        args = []
+
+        while self.pos < len(self.tokens):
+            token = self.tokens[self.pos]
+                
+            if token == ',' or token == '|':
+                self.pos += 1
+                args.append(self.compileMacroArg())
+            
+            elif token == ']':
+                return MacroCall(build(nameB), args)
+            
+            elif token == ')': #? might be wrong, or might need a stack
+                raise self.ScanError(ImbalancedDelimError)
+
+            else:
+                nameB.append(token)
+
+            self.pos += 1
+        raise self.ScanError(UnclosedMacroError)
+
+    def compile(self) -> CompiledValue:
+        if '[' not in self.string:
+            #escapes and all, there's nothing to do
+            return CompiledValue(self.string, [self.string] if self.string != '' else [])
+        self.tokens = tokenize(self.string)
+        parts = []
+        textB = []
+
+        try:
+            while self.pos < len(self.tokens):
+                token = self.tokens[self.pos]
+            
+                if token == '[':
+                    self.pos += 1
+                    if len(textB) > 0:
+                        parts.append(''.join(textB))
+                        textB = []
+                    parts.append(self.compileMacro())
+            
+                else:
+                    #escapes are their own tokens, so they're ignored here
+                    textB.append(token)
+                
+                self.pos += 1
+        except self.ScanError as e:
+            if len(textB) > 0:
+                parts.append(''.join(textB))
+            parts.append(DeferredError(e.error))
+        else:
+            if len(textB) > 0:
+                parts.append(''.join(textB))
+
+        return CompiledValue(self.string, parts)
+
+@lru_cache(maxsize=8192)
+def compileValue(string:str) -> CompiledValue:
+    '''compile a value, values are cached so each unique string is only
+    scanned once no matter how many cards it's evaluated on'''
+    #TypedText is compiled as plain text, CompiledValues only hold strs
+    return MacroCompiler(str(string)).compile()
+
+def compileBody(string:str) -> CompiledValue:
+    '''compile the body of a user macro, numbered args at the top level are
+    turned into slots. args passed to other macros are left alone since
+    they're parsed wherever they end up'''
+    compiled = compileValue(string)
+    parts = []
+    for part in compiled.parts:
+        if type(part) is MacroCall and argIndex(part.name) is not None:
+            part = ArgSlot(part, argIndex(part.name))
+        parts.append(part)
+    return CompiledValue(string, parts)
+
+#macros that can give a different result with the same arguments
+impureMacros = {'rnd', 'file'}
+#macros that can turn escaped text into new macros, so what they end up calling can't be known ahead of time
+opaqueMacros = {'/', 'substr', 'slice'}
+
+class DependencyFinder():
+    '''finds which data columns and computed values a value depends on by following every
+    macro it uses, through arguments, user macros, the columns section and the values of columns themselves'''
+
+    def __init__(self, userMacros:dict[str, str], data:Iterable[Mapping]|None, computed:set[str]=set(), derived:dict[str, str]={}):
+        '''userMacros maps the name of each user macro to its body, data is read through once
+        computed names are set once per card, so they're treated like columns
+        derived maps the name of each column in the columns section to its body, they're columns
+        too but their bodies are followed like user macros rather than being run for every row'''
+        self.userMacros = userMacros
+        self.computed = set(computed)
+        self.derived = derived
+        self.columns = {}
+        #column -> the values in it that could call a macro, text without a [ can't
+        if data is not None:
+            for row in data:
+                for column, value in row.items():
+                    values = self.columns.setdefault(column, set())
+                    if '[' in value:
+                        values.add(value)
+
+    def findNames(self, compiled:CompiledValue, names:set):
+        '''add the name of every macro used in compiled to names, including macros in arguments'''
+        for part in compiled.parts:
+            if type(part) is MacroCall:
+                names.add(part.name)
+                for arg in part.args:
+                    self.findNames(compileValue(arg), names)
+
+    def find(self, values:list[CompiledValue]) -> frozenset|None:
+        '''returns the columns these values depend on, or None if they can't be known'''
+        pending = set()
+        for compiled in values:
+            self.findNames(compiled, pending)
+        seen = set()
+        columns = set()
+        while len(pending) > 0:
+            name = pending.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            #computed values shadow the columns section, which shadows data columns,
+            #which shadow user macros, which shadow the stdlib
+            if name in self.computed:
+                columns.add(name)
+            elif name in self.derived:
+                columns.add(name)
+                self.findNames(compileValue(self.derived[name]), pending)
+            elif name in self.columns:
+                columns.add(name)
+                for value in self.columns[name]:
+                    compiled = compileValue(value)
+                    if any(type(part) is DeferredError for part in compiled.parts):
+                        #a stray [ in a column can join up with the text around it
+                        return None
+                    self.findNames(compiled, pending)
+            elif name in self.userMacros:
+                self.findNames(compileValue(self.userMacros[name]), pending)
+            elif name in impureMacros or name in opaqueMacros:
+                return None
+        return frozenset(columns)
 
 
 ###############################################################################
@@ -220,6 +685,10 @@ class MacroStore():
 ###############################################################################
 
  
+#toggles given by the comparison macros, if and not read them without parsing
+trueText = TypedText('true', True)
+falseText = TypedText('false', False)
+
 @MacroStore.addStdlib('if', (2,3))
 def ifMacro(context, test, true, false=''):
 
@@ -237,41 +706,41 @@ def ifMacro(context, test, true, false=''):
 @MacroStore.addStdlib('eq', 2)
 def eqMacro(context, left, right):
     if context.parse(left) == context.parse(right):
-        return 'true'
+        return trueText
     else:
-        return 'false'
+        return falseText
 
 @MacroStore.addStdlib('ne', 2)
 def neMacro(context, left, right):
     if context.parse(left) != context.parse(right):
-        return 'true'
+        return trueText
     else:
-        return 'false'
+        return falseText
 
 @MacroStore.addStdlib('in', (2, 99))
 def inMacro(context, value, *args):
     parsed = evalEscapes(context.parse(value))
     if len(args) == 0:
-        return 'false'
+        return falseText
     parsedList = ListParser(args[0], context.elem, context.prop).parse()
     if parsedList == None:
         parsedList = args
     for arg in parsedList:
         if parsed == evalEscapes(context.parse(arg)):
-            return 'true'
-    return 'false'
+            return trueText
+    return falseText
 
-@MacroStore.addStdlib('not', 1)
+@MacroStore.addStdlib('not', 1, pure=True)
 def notMacro(context, value):
     parseVal = context.parse(value)
     boolVal = asBool(parseVal)
     if boolVal is not None:
         if boolVal:
-            return 'false'
+            return falseText
         else:
-            return 'true'
+            return trueText
     else:
-        return 'false'
+        return falseText
 
 @MacroStore.addStdlib('either', 2)
 def eitherMacro(context, left, right):
@@ -307,10 +776,13 @@ def repeatMacro(context, times, value):
     times = unit.toInt()
     ofs = 0 if unit.sign == '0' else 1
     result = []
-    newStore = context.store.copy()
-    for i in range(times):
-        newStore.add('d', str(i+ofs))
-        result.append(newStore.parse(value))
+    frame = LocalFrame('d')
+    #a body without macros never checks the clock itself, so it's checked every 256 steps
+    for start in range(0, times, 256):
+        context.store.checkClock(context)
+        for i in range(start, min(start+256, times)):
+            frame.value = str(i+ofs)
+            result.append(context.store.parseIn(frame, value))
     return ''.join(result)
 
 @MacroStore.addStdlib('for-each', 2)
@@ -320,13 +792,15 @@ def forMacro(context, lst, body):
     if parsedList == None:
         raise InvalidArgError(context.elem, context.prop, 'for-each', 'LIST', lst)
     result = []
-    newStore = context.store.copy()
-    for item in parsedList:
-        newStore.add('item', item)
-        result.append(newStore.parse(body))
+    frame = LocalFrame('item')
+    for start in range(0, len(parsedList), 256):
+        context.store.checkClock(context)
+        for item in parsedList[start:start+256]:
+            frame.value = item
+            result.append(context.store.parseIn(frame, body))
     return ''.join(result)
 
-@MacroStore.addStdlib('capitalize', 1)
+@MacroStore.addStdlib('capitalize', 1, pure=True)
 def capitalizeMacro(context, value):
     value = context.parse(value)
     value = value[0].upper()+value[1:]
@@ -334,21 +808,21 @@ def capitalizeMacro(context, value):
         return m.group(1).upper() + m.group(2)
     return re.sub(r'\b([a-z])(\w{3,})\b', repl, value)
 
-@MacroStore.addStdlib('upper', 1)
+@MacroStore.addStdlib('upper', 1, pure=True)
 def upperMacro(context, value):
     value = context.parse(value)
     def repl(m):
         return m.group(1).upper()
     return re.sub(r'(?<!\\)([a-z])', repl, value)
     
-@MacroStore.addStdlib('lower', 1)
+@MacroStore.addStdlib('lower', 1, pure=True)
 def upperMacro(context, value):
     value = context.parse(value)
     def repl(m):
         return m.group(1).lower()
     return re.sub(r'(?<!\\)([A-Z])', repl, value)
 
-@MacroStore.addStdlib('substr', 3)
+@MacroStore.addStdlib('substr', 3, pure=True)
 def substrMacro(context, value, start, length):
     value = context.parse(value)
     
@@ -368,7 +842,7 @@ def substrMacro(context, value, start, length):
     
     return value[start:start+length]
 
-@MacroStore.addStdlib('slice', (2, 3))
+@MacroStore.addStdlib('slice', (2, 3), pure=True)
 def sliceMacro(context, value, start, stop=None):
     value = context.parse(value)   
 
@@ -395,14 +869,14 @@ def sliceMacro(context, value, start, stop=None):
     else:
         return value[start:stop]
 
-@MacroStore.addStdlib('length', 1)
+@MacroStore.addStdlib('length', 1, pure=True)
 def lengthMacro(context, value):
     parsedValue = evalEscapes(context.parse(value))
     parsedList = ListParser(context.parse(value), context.elem, context.prop).parse()
     if parsedList is not None:
-        return len(parsedList)
+        return str(len(parsedList))
     else:
-        return len(parsedValue)
+        return str(len(parsedValue))
 
 @MacroStore.addStdlib('rnd', (1,2))
 def randomMacro(context, start, stop=None):
@@ -423,12 +897,12 @@ def randomMacro(context, start, stop=None):
     return str(num)
 
 
-@MacroStore.addStdlib('/', 1)
+@MacroStore.addStdlib('/', 1, pure=True)
 def expansionMacro(context, value):
     value = context.parse(value)
     return evalEscapes(value)
 
-@MacroStore.addStdlib('?', 1)
+@MacroStore.addStdlib('?', 1, pure=True)
 def comparisonMacro(context, value):
     nValue = context.parse(value)
     try:
@@ -463,144 +937,305 @@ def comparisonMacro(context, value):
         prop=context.prop, elem=context.elem, value=value
         )
     if final:
-        return 'true'
+        return trueText
     else:
-        return 'false'
-
-def makeOp(op):
-    if op not in '+-*/%(':
-        return None
-    elif op == '+':
-        return AttrDict(prec=1, op=operator.add, name=op)
-    elif op == '-':
-        return AttrDict(prec=1, op=operator.sub, name=op)
-    elif op == '*':
-        return AttrDict(prec=2, op=operator.mul, name=op)
-    elif op == '/':
-        return AttrDict(prec=2, op=operator.truediv, name=op)
-    elif op == '%':
-        return AttrDict(prec=2, op=operator.mod, name=op)
-    elif op == '(':
-        return AttrDict(prec=0, op=(lambda x, y: None), name=op)
-
-@MacroStore.addStdlib('=', 1)
-def mathMacro(context, value):
-    '''makes use of dijkstra's shunting yard algorithm to conver to
-    reverse polish notation, then parses the rpn'''
-    #tokens = context.parse(value).split()
-
-    tokens = re.split(r"\s+(\+|\-|\*|\%|/|\(|\))\s+", context.parse(value.strip()))
-
-    rpn = deque()
+        return falseText
+
+mathOps = {
+    '+': (1, operator.add),
+    '-': (1, operator.sub),
+    '*': (2, operator.mul),
+    '/': (2, operator.truediv),
+    '%': (2, operator.mod),
+}
+mathSplit = re.compile(r"\s+(\+|\-|\*|\%|/|\(|\))\s+")
+
+class MathError(Exception):
+    '''raised while compiling or running math, turned into a CLSError by [=| ]
+    token is the offending token, if there is one'''
+    def __init__(self, msg:str, token:str=None):
+        self.msg = msg
+        self.token = token
+
+class MathProgram():
+    '''an expression for [=| ] compiled into reverse polish notation
+    steps are floats, ints which are slots filled in when the program is run, and operators
+    error holds a MathError when the program is malformed'''
+    __slots__ = ('steps', 'error')
+
+    def __init__(self, steps:list, error:MathError=None):
+        self.steps = steps
+        self.error = error
+
+    def run(self, slots:list[float]=()) -> float:
+        if self.error is not None:
+            return self.runChecked(slots)
+        accum = []
+        for step in self.steps:
+            kind = type(step)
+            if kind is float:
+                accum.append(step)
+            elif kind is int:
+                accum.append(slots[step])
+            else:
+                right = accum.pop()
+                accum[-1] = step(accum[-1], right)
+        return accum[0]
+
+    def runChecked(self, slots:list[float]) -> float:
+        '''run a program with too many or too few operands, this goes as far as
+        it can before raising so things like division by zero still come first'''
+        accum = []
+        for step in self.steps:
+            kind = type(step)
+            if kind is float:
+                accum.append(step)
+            elif kind is int:
+                accum.append(slots[step])
+            else:
+                if len(accum) < 2:
+                    raise self.error
+                right = accum.pop()
+                left = accum.pop()
+                accum.append(step(left, right))
+        raise self.error
+
+def compileMath(tokens:list[str], slots:dict[str, int]={}) -> MathProgram:
+    '''makes use of dijkstra's shunting yard algorithm to convert to
+    reverse polish notation, then checks the rpn and folds any operation
+    that only has numbers for operands. slots maps placeholder tokens
+    to the slot they're filled from'''
+    rpn = []
     opStack = []
     for token in tokens:
         if token == '':
             continue
-        num = Unit.fromStr(token)
-        op = makeOp(token)
         length = len(opStack)
-        if num is not None:
+        if token in slots:
+            rpn.append(slots[token])
+        elif (num := Unit.fromStr(token)) is not None:
             rpn.append(num.toFloat())
         elif token == '(':
-            opStack.append(op)
+            opStack.append((0, token))
         elif token == ')':
-            if length == 0:
-                raise CLSError("'{value}' is missing an opening parenthesis in macro [{name}| ]", 
-                elem=context.elem, prop=context.prop, name=context.name, value=value
-                )
             while length > 0:
-                if opStack[length-1].name != '(':
-                    rpn.append(opStack.pop())
+                if opStack[length-1][1] != '(':
+                    rpn.append(opStack.pop()[1])
                 else:
                     break
                 length = len(opStack)
             else:
-                raise CLSError("'{value}' is missing an opening parenthesis in macro [{name}| ]", 
-                elem=context.elem, prop=context.prop, name=context.name, value=value
-                )
+                raise MathError("'{value}' is missing an opening parenthesis in macro [{name}| ]")
             opStack.pop()
-        elif op != None:
-            if length > 0 and opStack[length-1].prec >= op.prec:
-                rpn.append(opStack.pop())
+        elif token in mathOps:
+            op = mathOps[token]
+            if length > 0 and opStack[length-1][0] >= op[0]:
+                rpn.append(opStack.pop()[1])
             opStack.append(op)
         else:
-            raise CLSError("'{value}' is an unknown operator in macro [{name}| ]", 
-                elem=context.elem, prop=context.prop, name=context.name, value=token
-                )
+            raise MathError("'{value}' is an unknown operator in macro [{name}| ]", token)
     while len(opStack) > 0:
-        op = opStack.pop()
-        if op.name == '(':
-            raise CLSError("'{value}' is missing a closing parenthesis in macro [{name}| ]", 
-                elem=context.elem, prop=context.prop, name=context.name, value=value
-                )
+        prec, op = opStack.pop()
+        if op == '(':
+            raise MathError("'{value}' is missing a closing parenthesis in macro [{name}| ]")
         rpn.append(op)
 
-    accum = []
     if len(rpn) < 3:
-        raise CLSError("'{value}' is not a valid mathematical expression in macro [{name}| ]", 
-                elem=context.elem, prop=context.prop, name=context.name, value=value
-                )
-    for op in rpn:
-        if type(op) == float:
-            accum.append(op)
+        raise MathError("'{value}' is not a valid mathematical expression in macro [{name}| ]")
+
+    #check the operands line up, and fold constants while we're at it
+    steps = []
+    depth = 0
+    for step in rpn:
+        if type(step) in (float, int):
+            steps.append(step)
+            depth += 1
+        elif depth < 2:
+            return MathProgram(rpn, MathError("'{value}' does not have enough operands in macro [{name}| ]"))
         else:
-            if len(accum) < 2:
-                print(accum, op)
-                raise CLSError("'{value}' does not have enough operands in macro [{name}| ]", 
-                elem=context.elem, prop=context.prop, name=context.name, value=value
-                )
-            right = accum.pop()
-            left = accum.pop()
-            accum.append(op.op(left, right))
-    if len(accum) != 1:
-        raise CLSError("'{value}' has too many operands in macro [{name}| ]", 
-                elem=context.elem, prop=context.prop, name=context.name, value=value
-                )
-    
-    if int(accum[0]) == accum[0]:
-        return str(int(accum[0]))
-    else:
-        return str(accum[0])
+            depth -= 1
+            left, right = steps[-2], steps[-1]
+            if type(left) is float and type(right) is float:
+                try:
+                    steps[-2:] = [step(left, right)]
+                    continue
+                except ArithmeticError:
+                    #leave it for when the program runs so the error happens then
+                    pass
+            steps.append(step)
+    if depth != 1:
+        return MathProgram(rpn, MathError("'{value}' has too many operands in macro [{name}| ]"))
+    return MathProgram(steps)
+
+@lru_cache(maxsize=1024)
+def compileMathText(text:str) -> MathProgram|MathError:
+    '''compile an expression that has no macros left in it'''
+    try:
+        return compileMath(mathSplit.split(text))
+    except MathError as e:
+        return e
+
+class MathTemplate():
+    '''an expression for [=| ] that still has its macros, each macro that
+    makes up a whole operand becomes a slot in the program'''
+    __slots__ = ('compiled', 'slotParts', 'program')
+
+    def __init__(self, compiled:CompiledValue, slotParts:list[int], program:MathProgram):
+        self.compiled = compiled
+        self.slotParts = slotParts
+        self.program = program
+
+@lru_cache(maxsize=1024)
+def compileMathTemplate(value:str) -> MathTemplate|None:
+    '''compile an expression before its macros are evaluated, returns None
+    when a macro isn't a whole operand or the expression has errors'''
+    compiled = compileValue(value)
+    if not compiled.hasMacros:
+        return None
+    text = []
+    slots = {}
+    slotParts = []
+    for index, part in enumerate(compiled.parts):
+        if type(part) is str:
+            text.append(part)
+        elif type(part) is MacroCall:
+            placeholder = f'\0{len(slotParts)}\0'
+            slots[placeholder] = len(slotParts)
+            slotParts.append(index)
+            text.append(placeholder)
+        else:
+            return None
+    tokens = mathSplit.split(''.join(text))
+    for token in tokens:
+        if '\0' in token and token not in slots:
+            return None
+    try:
+        program = compileMath(tokens, slots)
+    except MathError:
+        return None
+    if program.error is not None:
+        return None
+    return MathTemplate(compiled, slotParts, program)
+
+def formatNumber(num:float) -> str:
+    '''the text of a number, as TypedText when it can be read back as the same number'''
+    if int(num) == num:
+        return TypedText(str(int(num)), float(int(num)))
+    text = str(num)
+    if 'e' in text:
+        #Unit doesn't read exponents, so these stay text
+        return text
+    return TypedText(text, num)
+
+@MacroStore.addStdlib('=', 1)
+def mathMacro(context, value):
+    '''expressions are compiled once and cached. when every macro in an expression
+    gives a number the compiled template is run with those numbers, otherwise
+    the expression is compiled again after its macros are evaluated'''
+    template = compileMathTemplate(value.strip())
+    try:
+        if template is not None:
+            parts = context.store.evalParts(template.compiled)
+            slots = []
+            for index in template.slotParts:
+                part = parts[index]
+                if type(part) is TypedText and type(part.value) is float:
+                    slots.append(part.value)
+                    continue
+                num = Unit.fromStr(part)
+                if num is None:
+                    break
+                slots.append(num.toFloat())
+            else:
+                return formatNumber(template.program.run(slots))
+            text = context.parse(''.join(parts))
+        else:
+            text = context.parse(value.strip())
+
+        program = compileMathText(text)
+        if type(program) is MathError:
+            raise program
+        return formatNumber(program.run())
+    except MathError as e:
+        raise CLSError(e.msg, elem=context.elem, prop=context.prop, name=context.name,
+            value=e.token if e.token is not None else value
+        )
 
 
 @MacroStore.addStdlib('file', 1)
 def fileMacro(context, filename):
     name = context.parse(filename)
-    if not os.path.isfile(name):
-        raise InvalidArgError(context.elem, context.prop, 'file', 'FILENAME', filename)
     try:
-        with open(name, encoding='utf-8') as file:
-            fileContents = file.read()
+        fileContents = FileGetter.getFile(resolvePath(context.store.directory, name))
     except OSError:
         raise CLSError("Could not open '{filename}'", elem=context.elem, prop=context.prop, filename=filename)
+    if fileContents is None:
+        raise InvalidArgError(context.elem, context.prop, 'file', 'FILENAME', filename)
     return fileContents
 
+class SwitchTable():
+    '''the cases of a [switch| ], cases without macros are looked up in a dict
+    and the rest are checked in order like they always were'''
+    __slots__ = ('constant', 'dynamic', 'results', 'default')
+
+    def __init__(self, args:tuple[str]):
+        args = list(args)
+        if args[-2] == 'default':
+            self.default = args.pop()
+            args.pop()
+        else:
+            self.default = None
+        self.constant = {}
+        #case value -> the index of the first case it matches
+        self.dynamic = []
+        #indexes of cases that have to be parsed on every call
+        self.results = args[1::2]
+
+        for index, case in enumerate(args[0::2]):
+            if compileValue(case).hasMacros:
+                self.dynamic.append(index)
+                continue
+            try:
+                testList = ListParser(case, None, None).parse()
+            except CLSError:
+                #let the error happen when the switch gets to this case
+                self.dynamic.append(index)
+                continue
+            if testList is not None:
+                for item in testList:
+                    self.constant.setdefault(item, index)
+            else:
+                self.constant.setdefault(evalEscapes(case), index)
+
+@lru_cache(maxsize=1024)
+def compileSwitch(args:tuple[str]) -> SwitchTable:
+    return SwitchTable(args)
+
 @MacroStore.addStdlib('switch', (3, 99))
 def switchMacro(context, sentinal, *args):
     if len(args)% 2 != 0:
         raise CLSError("case and results are not balanced in macro [switch| ]", elem=context.elem, prop=context.prop)
     
     sentinal = evalEscapes(context.parse(sentinal))
-    args = list(args)
-
-    if args[-2] == 'default':
-        default = True
-        defaultValue = args.pop()
-        args.pop()
-    else:
-        default = False
-
-    for pair in range(0, len(args), 2):
-        testValue = context.parse(args[pair])
+    table = compileSwitch(args)
+    match = table.constant.get(sentinal)
+
+    #dynamic cases before the constant match still get their chance
+    for index in table.dynamic:
+        if match is not None and index > match:
+            break
+        testValue = context.parse(args[index*2])
         testList = ListParser(testValue, context.elem, context.prop).parse()
         if testList is not None:
             if sentinal in testList:
-                return args[pair+1]
+                return table.results[index]
         else:
             if sentinal == evalEscapes(testValue):
-                return args[pair+1]
-    if default:
-        return defaultValue
+                return table.results[index]
+    if match is not None:
+        return table.results[match]
+    if table.default is not None:
+        return table.default
     else:
         return ''
 
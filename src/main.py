@@ -1,12 +1,15 @@
 import sys
 import os
 import argparse
+import json
+import multiprocessing
 
 from PySide6.QtCore import *
 from PySide6.QtGui import *
 from PySide6.QtWidgets import *
 
 from renderer import *
+from macros import MacroStore, MacroProfiler
 
 def getResource(filename):
     if getattr(sys, "frozen", False):
@@ -26,19 +29,16 @@ state.painter = None
 state.asset = 0
 
 def openFile(filename):
-    startingDir = os.getcwd()
     directory, filename = os.path.split(os.path.realpath(filename))
-    os.chdir(directory)
     app.setOverrideCursor(waitCursor)
     try:
         #layoutText = _openFile(filename)
-        layout = buildLayout(filename)
+        layout = buildLayout(filename, directory)
         painter = CardRenderer(layout)
         painter.render()
         #state.asset = 0        
 
     except CLSError as e:
-        os.chdir(startingDir)
         #state.layout = None
         #state.painter = None
         #state.assetSpin.setValue(1)
@@ -56,6 +56,24 @@ def openFile(filename):
     finally:
         app.setOverrideCursor(arrowCursor)
 
+def exportJobs(filename, jobs):
+    '''render and save the cards of a layout with a pool of worker processes'''
+    directory, filename = os.path.split(os.path.realpath(filename))
+    try:
+        layout = buildLayout(filename, directory)
+        if layout.data is None:
+            #one card isn't worth starting workers for
+            painter = CardRenderer(layout)
+            painter.render()
+            painter.export()
+            count = len(painter.images)
+        else:
+            count = exportPool(layout, jobs)
+    except CLSError as e:
+        return False, e.message
+    state.layout = layout
+    return True, f'generated {count} assets'
+
 def setImage():
     if state.painter is None:
         return
@@ -69,7 +87,8 @@ def openFunc(earlyOpen):
     if earlyOpen:
         filename = state.filename
     else:
-        filename, filter = QFileDialog.getOpenFileName(window, 'Open Layout File', '.', 'Layout Files (*.cls)')
+        filename, filter = QFileDialog.getOpenFileName(window, 'Open Layout File',
+            os.path.dirname(state.filename) or '.', 'Layout Files (*.cls)')
 
     if not os.path.isfile(filename):
         return
@@ -89,6 +108,8 @@ def openFunc(earlyOpen):
 
 @Slot()
 def reloadFunc():
+    FileGetter.clearCache()
+    TextCache.clearCache()
     result, message = openFile(state.filename)
     if result:
         setImage()
@@ -112,7 +133,7 @@ def exportFunc():
         else:
             export = state.layout.export[state.exportChoice.currentText()].output
             if export == '':
-                export = os.path.split(os.getcwd())[1]
+                export = os.path.split(state.layout.directory)[1]
             window.textLog.append(f"saved cards to {export}")
         finally:
             app.setOverrideCursor(arrowCursor)
@@ -122,6 +143,8 @@ def exportFunc():
 @Slot()
 def clearCacheFunc():
     ImageGetter.clearCache()
+    FileGetter.clearCache()
+    TextCache.clearCache()
 
 class MainWindow(QMainWindow):
     
@@ -217,33 +240,120 @@ commandParser.add_argument('-w', '--windowless',
     help='render and save cards without displaying a window, FILE must be provided'
 )
 
-app = QApplication()
-window = MainWindow()
-args = commandParser.parse_args()
+commandParser.add_argument('-p', '--profile',
+    action='store_true',
+    dest='profile',
+    help='time every macro call and print the slowest macros when done'
+)
 
-waitCursor = QCursor(Qt.WaitCursor)
-arrowCursor = QCursor()
+commandParser.add_argument('--profile-json',
+    metavar='JSON',
+    dest='profileJson',
+    default=None,
+    type=os.path.realpath,
+    help='also save the macro profile to JSON, implies --profile'
+)
 
+commandParser.add_argument('-j', '--jobs',
+    metavar='N',
+    dest='jobs',
+    default=1,
+    type=int,
+    help='with --windowless, render cards in N worker processes'
+)
 
-if args.file is not None and args.windowless:
-    result, message = openFile(args.file)
-    print(message)
-    if result:
-        try:
-            state.painter.save()
-        except CLSError as e:
-            print(e.message)
-        else:
-            print(f"saved cards to {state.layout.output}")
+commandParser.add_argument('--no-cache',
+    action='store_false',
+    dest='cache',
+    help="don't read or write parsed layouts in the .cls-cache folder"
+)
+
+def limitType(kind):
+    '''an argparse type for a macro limit, 0 turns the limit off'''
+    def parse(text):
+        value = kind(text)
+        if value < 0:
+            raise argparse.ArgumentTypeError(f"'{text}' is less than 0")
+        return value if value > 0 else None
+    return parse
+
+commandParser.add_argument('--max-depth',
+    metavar='N',
+    dest='maxDepth',
+    default=MacroStore.maxDepth,
+    type=limitType(int),
+    help=f'how deep macros can call each other, 0 for no limit, the default is {MacroStore.maxDepth}'
+)
+
+commandParser.add_argument('--max-calls',
+    metavar='N',
+    dest='maxCalls',
+    default=MacroStore.maxCalls,
+    type=limitType(int),
+    help=f'how many macros a single property can call, 0 for no limit, the default is {MacroStore.maxCalls}'
+)
 
-elif not args.windowless:
-    if args.file is not None:
-        state.filename = args.file
-        openFunc(True)
-    window.show()
-    window.resize(800, 600)
-    app.exec()
+commandParser.add_argument('--max-card-time',
+    metavar='SECONDS',
+    dest='maxCardTime',
+    default=MacroStore.maxCardTime,
+    type=limitType(float),
+    help=f'how long a card can spend evaluating macros, 0 for no limit, the default is {MacroStore.maxCardTime:g}'
+)
+
+#workers import this file, so only the app itself runs from here
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    app = QApplication()
+    window = MainWindow()
+    args = commandParser.parse_args()
+
+    ParseCache.enabled = args.cache
+    MacroStore.maxDepth = args.maxDepth
+    MacroStore.maxCalls = args.maxCalls
+    MacroStore.maxCardTime = args.maxCardTime
+
+    if args.profile or args.profileJson is not None:
+        MacroStore.profiler = MacroProfiler()
 
-elif args.windowless and args.file is None:
-    commandParser.print_help()
+    waitCursor = QCursor(Qt.WaitCursor)
+    arrowCursor = QCursor()
 
+
+    if args.file is not None and args.windowless:
+        if args.jobs > 1:
+            result, message = exportJobs(args.file, args.jobs)
+            print(message)
+        else:
+            result, message = openFile(args.file)
+            print(message)
+            if result:
+                try:
+                    state.painter.export()
+                except CLSError as e:
+                    print(e.message)
+                    result = False
+        if result:
+            export = state.layout.export['bulk'].output
+            if export == '':
+                export = os.path.split(state.layout.directory)[1]
+            print(f"saved cards to {export}")
+
+    elif not args.windowless:
+        if args.file is not None:
+            state.filename = args.file
+            openFunc(True)
+        window.show()
+        window.resize(800, 600)
+        app.exec()
+
+    elif args.windowless and args.file is None:
+        commandParser.print_help()
+
+    if MacroStore.profiler is not None:
+        print(MacroStore.profiler.table(limit=40))
+        print(MacroStore.cache.summary())
+        print(TextCache.stats())
+        if args.profileJson is not None:
+            with open(args.profileJson, 'w', encoding='utf-8') as file:
+                json.dump(MacroStore.profiler.rows(), file, indent=2)
@@ -3,9 +3,19 @@
 import re
 from utils import *
 
-__all__ = ['CSVParser', 'LayoutParser']
+__all__ = ['CSVParser', 'LayoutParser', 'iterLines']
 
 
+#every line that isn't empty, splitting where str.splitlines would
+lineRe = re.compile('[^\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]+')
+#blank lines and comments
+skipRe = re.compile(r'\s*(?:#|$)')
+
+def iterLines(source:str):
+    '''yield the lines of source that aren't empty, without splitting it all at once'''
+    for match in lineRe.finditer(source):
+        yield match.group()
+
 class CSVParser():
     '''Parse a csv file'''
     def __init__(self, source:str):
@@ -14,79 +24,22 @@ class CSVParser():
         self.source = source
 
     def parseRow(self, line):
-        record = []
-        pos = 0
-        accum = []
-        stack = []
-
-        while pos < len(line):
-            char = line[pos]
-
-            if char == '\\':
-                accum.append(line[pos:pos+2])
-                pos += 1
-
-            elif char in '([':
-                stack.append(char)
-                accum.append(char)
-            
-            elif char in '])':
-                stack.pop()
-                accum.append(char)
-
-            elif char == ',':
-                if len(stack) == 0:
-                    record.append(build(accum))
-                    accum = []
-                else:
-                    accum.append(char)
-            
-            else:
-                accum.append(char)
-            
-            pos += 1
-        
-        record.append(build(accum))
-
-        return record
+        return splitTop(line, ',')
     
     def parseHeaders(self, line):
         headers = []
-        char = ''
-        accum = []
-        pos = 0
-        while pos < len(line):
-            char = line[pos]
-
-            if char == ',':
-                name = build(accum)
-                if name != '':
-                    headers.append(name)
-                accum = []
-            
-            else:
-                accum.append(char)
-            
-            pos += 1
-        
-        name = build(accum)
-        if name != '':
-            headers.append(name)
-
+        for name in line.split(','):
+            name = name.strip()
+            if name != '':
+                headers.append(name)
         return headers
 
-    
-    def parseCSV(self):
-
-        lines = self.source.splitlines()
+    def iterRows(self):
+        '''yield each row as a dict, lines are only parsed as rows are asked for'''
         headers = None
-        rows = []
-
-        for line in lines:
-            #skip blank lines and commas
-            if re.match(r'^\s*#', line):
-                continue
-            elif re.match(r'^\s*$', line):
+        for line in iterLines(self.source):
+            #skip blank lines and comments
+            if skipRe.match(line):
                 continue
 
             elif headers is None:
@@ -96,120 +49,88 @@ class CSVParser():
                 row = self.parseRow(line)
                 while len(row) < len(headers):
                     row.append('')
-                rows.append(row)
-        
-        if len(rows) == 0:
+                yield dict(zip(headers, row))
+    
+    def parseCSV(self):
+        '''returns every row, or None if there aren't any'''
+        sheet = list(self.iterRows())
+        if len(sheet) == 0:
             return None
-        
-        sheet = []
-        for row in rows:
-            sheet.append(dict(zip(headers, row)))
         return sheet
 
-        #return self.sheet
+#what ends a name in a section, and the values and data sections, escapes included
+nameEnd = re.compile(r'[:{}=]')
+valueRe = re.compile(r'[^\\\n;}]*(?:\\[\s\S]?[^\\\n;}]*)*')
+nilRe = re.compile(r'[^\\}]*(?:\\[\s\S]?[^\\}]*)*')
+commentRe = re.compile(r'\s*#')
 
 class LayoutParser():
     '''parse a layout file'''
     def __init__(self, source, filename):
 
         lines = source.splitlines()
-        newLines = []
-        for line in lines:
-            if (not re.match(r'\s*#', line)) and line != '':
-                newLines.append(line)
+        newLines = [line for line in lines if line != '' and not commentRe.match(line)]
         source = '\n'.join(newLines)
 
         self.pos = 0
         self.string = source
         self.filename = filename
 
-
+    def parseName(self, elem):
+        '''returns the text up to the next : { } or =, and which one it was'''
+        match = nameEnd.search(self.string, self.pos)
+        if match is None:
+            raise err.UnexpectedEOFError(self.filename, elem)
+        name = self.string[self.pos:match.start()].strip()
+        self.pos = match.end()
+        return name, match.group()
 
     def parseValue(self, prop):
         '''parses a single value and returns when it's ended'''
         #takes over after a :
-        accum = []
-        char = ''
-
-        while self.pos < len(self.string):
-            char = self.string[self.pos]
-
-            if char == '\\':
-                accum.append(self.string[self.pos:self.pos+2])
-                self.pos += 1
-            
-            elif char in '\n;':
-                if len(accum) == 0:
-                    return ''
-                value = build(accum)
-                return value
-            
-            elif char == '}':
-                value = build(accum)
-                self.pos -= 1 #OH NO A BCKTRACK
-                return value
-            
-            else:
-                accum.append(char)
-
-            self.pos += 1
-        
-        raise err.UnexpectedEOFError(self.filename, prop)
+        match = valueRe.match(self.string, self.pos)
+        end = match.end()
+        if end == len(self.string):
+            raise err.UnexpectedEOFError(self.filename, prop)
+        if self.string[end] == '}':
+            #leave the } for the section
+            self.pos = end
+        else:
+            self.pos = end + 1
+        return match.group().strip()
 
     def parseSection(self, elem):
         '''parses the contents of a section
         parsing includes both properties and sub sections
         don't call directly'''
-        accum = []
-        char = ''
         section = dict(children={})
-        name = ''
 
-        while self.pos < len(self.string):
-            char = self.string[self.pos]
+        while True:
+            name, char = self.parseName(elem)
 
             if char == ':':
-                name = build(accum)
-                accum = []
-                self.pos += 1
                 section[name] = self.parseValue(name)
 
             elif char == '{':
-                name = build(accum)
-                self.pos += 1
                 section['children'][name] = self.parseSection(name)
-                accum = []
 
             elif char == '}':
-                name = build(accum)
                 if name != '':
                     raise err.NoValueError(self.filename, elem, name)
                 return section
             
-            elif char == '=':
-                name = build(accum)
+            else:
                 raise err.CLSSyntaxError("'{elem}' section can not define macros",
                 elem=elem, file=self.filename)
-        
-            else:
-                accum.append(char)
-
-            self.pos += 1
-        raise err.UnexpectedEOFError(self.filename, elem)
 
     def parseProps(self, elem):
         '''parses property only sections'''
-        
         section = {}
-        accum = []
-        name = ''
-        while self.pos < len(self.string):
-            char = self.string[self.pos]
+
+        while True:
+            name, char = self.parseName(elem)
 
             if char == ':':
-                name = build(accum)
-                accum = []
-                self.pos += 1
                 section[name] = self.parseValue(name)
             
             elif char == '{':
@@ -217,82 +138,45 @@ class LayoutParser():
                 file=self.filename, elem=elem)
             
             elif char == '}':
-                name = build(accum)
                 if name != '':
                     raise err.NoValueError(self.filename, elem, name)
                 return section
             
-            elif char == '=':
-                name = build(accum)
+            else:
                 raise err.CLSSyntaxError("'{elem}' section can not define macros",
                 elem=elem, file=self.filename)
-            
-            else:
-                accum.append(char)
-            
-            self.pos += 1
-        
-        raise err.UnexpectedEOFError(self.filename, elem)
-        
-
-    def parseUserMacros(self):
 
+    def parseUserMacros(self, elem='macros'):
+        '''parses sections made of macro definitions, like macros, computed and columns'''
         names = {}
-        accum = []
-        name = ''
 
-        while self.pos < len(self.string):
-            char = self.string[self.pos]
+        while True:
+            name, char = self.parseName(elem)
 
             if char == '=':
-                name = build(accum)
-                accum = []
-                self.pos += 1
                 names[name] = self.parseValue(name)
             
             elif char == '}':
-                name = build(accum)
                 if name != '':
-                    raise err.NoValueError(self.filename, 'macros', name)
+                    raise err.NoValueError(self.filename, elem, name)
                 return names
             
             elif char == ':':
                 raise err.CLSSyntaxError("'{elem}' cannot conaint properties",
-                file=self.filename, elem='macros')
+                file=self.filename, elem=elem)
             
-            elif char == '{':
-                raise err.CLSSyntaxError("'{elem}' cannot contain subsections",
-                file=self.filename, elem='macros')
-
             else:
-                accum.append(char)
-            
-            self.pos += 1
-        
-        raise err.UnexpectedEOFError(self.filename, 'macros')
+                raise err.CLSSyntaxError("'{elem}' cannot contain subsections",
+                file=self.filename, elem=elem)
 
     def parseNil(self, elem):
         '''parse nothing, return a string'''
-
-        accum = []
-        name = ''
-
-        while self.pos < len(self.string):
-            char = self.string[self.pos]
-
-            if char == '\\':
-                accum.append(self.string[self.pos:self.pos+2])
-                self.pos += 1
-            
-            elif char == '}':
-                return build(accum)
-            
-            else:
-                accum.append(char)
-            
-            self.pos += 1
-        raise err.UnexpectedEOFError(self.filename, elem)
-
+        match = nilRe.match(self.string, self.pos)
+        end = match.end()
+        if end == len(self.string):
+            raise err.UnexpectedEOFError(self.filename, elem)
+        self.pos = end + 1
+        return match.group().strip()
 
     def parseLayoutFile(self) -> dict:
         """returns a parsed layout file as a dict with three items
@@ -300,24 +184,20 @@ class LayoutParser():
         ['sections'] holds the special sections
         ['elements'] holes the elements
         """
-
-        accum = []
         layout = dict(props={}, elements={}, sections={})
-        name = ''
 
-        while self.pos < len(self.string):
-            char = self.string[self.pos]
+        while (match := nameEnd.search(self.string, self.pos)) is not None:
+            name = self.string[self.pos:match.start()].strip()
+            char = match.group()
+            self.pos = match.end()
             
             if char == '{':
-                name = build(accum)
-                self.pos += 1
-                accum = []
                 if name == 'layout':
                     layout['props'] = self.parseProps(name)
                 elif name in ('defaults', 'csv'):
                     layout['sections'][name] = self.parseProps(name)
-                elif name == 'macros':
-                    layout['sections'][name] = self.parseUserMacros()
+                elif name in ('macros', 'computed', 'columns'):
+                    layout['sections'][name] = self.parseUserMacros(name)
                 elif name == 'export':
                     layout['sections'][name] = self.parseSection(name)
                 elif name == 'data':
@@ -327,25 +207,19 @@ class LayoutParser():
 
             elif char == ':':
                 raise err.CLSSyntaxError("properties not allowed at the top level of a layout file",
-                file=self.filename, name=build(accum))
+                file=self.filename, name=name)
 
             elif char == '=':
                 raise err.CLSSyntaxError("macro definitions not allowed at the top level of a layout file",
-                file=self.filename, name=build(accum))
-            
-            elif char == '}':
-                raise err.CLSSyntaxError("unexpected }} near '{name}'",
-                file=self.filename, name=build(accum))
+                file=self.filename, name=name)
             
             else:
-                accum.append(char)
-
-            self.pos += 1
+                raise err.CLSSyntaxError("unexpected }} near '{name}'",
+                file=self.filename, name=name)
         
-        if len(build(accum)) > 0:
+        leftover = self.string[self.pos:].strip()
+        if len(leftover) > 0:
             raise err.CLSSyntaxError("'{elem}' has no section",
-            file=self.filename, elem=build(accum))
+            file=self.filename, elem=leftover)
         
         return layout
-
-
@@ -2,6 +2,12 @@
 
 import os
 import csv
+import math
+import bisect
+import itertools
+import multiprocessing
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
 
 from PySide6.QtCore import *
 from PySide6.QtGui import *
@@ -11,41 +17,50 @@ from utils import *
 from parsers import *
 from elements import *
 from sections import *
-from macros import MacroStore
+from macros import MacroStore, MacroProfiler, ArgFrame, DependencyFinder, compileValue, compileBody
 
 
-def parseLayout(filename):
+def parseLayout(filename, directory=None):
     '''Parses the layout out of the file and turns it into a dict
-    also handles templates'''
-    if not os.path.isfile(filename):
+    also handles templates, which are found relative to directory like the
+    rest of the layout's files and share its parse cache'''
+    if directory is None:
+        directory, filename = os.path.split(os.path.abspath(filename))
+    path = os.path.join(directory, filename)
+    if not os.path.isfile(path):
         raise CLSError("'{file}' is not a valid file",
         file=filename
         )
     try:
-        with open(filename, encoding='utf-8') as file:
+        with open(path, encoding='utf-8') as file:
             layoutText = file.read()
     except OSError:
         raise CLSError("'{file}' could not be opened",
         file=filename
         )
 
-    layout = LayoutParser(layoutText, filename).parseLayoutFile()
+    layout = ParseCache.load('layout', layoutText, directory,
+        lambda text: LayoutParser(text, filename).parseLayoutFile())
     if 'template' in layout['props']:
-        template = parseLayout(layout['props']['template'])
+        template = parseLayout(layout['props']['template'], directory)
         deepUpdate(template, layout)
         template['props'].pop('template', None)
         return template
     else:
         return layout
 
-def buildLayout(filename):
+def buildLayout(filename, directory=None):
+    '''build a layout from a file. filename is relative to directory, and so are
+    the files the layout names, without a directory filename is split into one'''
+    if directory is None:
+        directory, filename = os.path.split(os.path.abspath(filename))
 
-    parsedLayout = parseLayout(filename)
+    parsedLayout = parseLayout(filename, directory)
 
     layoutProto = LayoutSection.defaults.new_child(parsedLayout['props'])
 
     frame = AttrDict()
-    layout = AttrDict(filename=filename)
+    layout = AttrDict(filename=filename, directory=directory)
 
     for prop, value in layoutProto.items():
         if prop not in LayoutSection.validators:
@@ -67,18 +82,58 @@ def buildLayout(filename):
 
     sections = parsedLayout['sections']
 
+    #macros
+    def makeMacro(value):
+        body = compileBody(value)
+        def func(context, *args):
+            return context.store.evalBody(ArgFrame(args), body)
+        return func
+    layout.userMacros = {}
+    layout.macroSources = {}
+    if 'macros' in sections:
+        macros = sections['macros']
+        for name, value in macros.items():
+            layout.userMacros[name] = (makeMacro(value), (0, 99))
+            layout.macroSources[name] = value
+
+    #columns
+    def makeDerive(columns):
+        '''returns a function that evaluates the columns section for one row of data'''
+        store = MacroStore()
+        store.directory = directory
+        store.macros.update(layout.userMacros)
+        store.add('elementName', 'columns')
+        derived = {}
+        #earlier columns are visible to later ones, and shadow the data
+        store.frames.append(derived)
+        def derive(row):
+            derived.clear()
+            store.macros.update(row)
+            for name, compiled in columns.items():
+                store.add('propertyName', name)
+                derived[name] = store.evaluate(compiled)
+            return dict(derived)
+        return derive
+    if 'columns' in sections:
+        layout.columnSources = dict(sections['columns'])
+        derive = makeDerive({name: compileValue(value) for name, value in layout.columnSources.items()})
+    else:
+        layout.columnSources = {}
+        derive = None
+
     #data
     if layout.data != '':
         #prefer the data property over section
         dataFilename = layout.data
         if 'data' in sections:
             sections.pop('data')
-        if not os.path.isfile(dataFilename):
+        dataPath = os.path.join(directory, dataFilename)
+        if not os.path.isfile(dataPath):
             raise CLSError("'{filename}' is not a valid file",
             file=filename, filename=dataFilename
             )
         try:
-            with open(dataFilename, encoding='utf-8') as file:
+            with open(dataPath, encoding='utf-8') as file:
                 userData = file.read()
         except OSError:
             raise CLSError("'{filename}' could not be opened",
@@ -89,14 +144,17 @@ def buildLayout(filename):
     else:
         userData = None
     if userData != None:
+        #rows are parsed again every time the cards are read rather than kept or cached,
+        #parsing is quick next to rendering and only the rows being rendered are held on to
         if layout.csv == 'cls':
-            reader = CSVParser(userData)
-            data = reader.parseCSV()
+            source = lambda: CSVParser(userData).iterRows()
         else:
-            reader = csv.DictReader(userData.splitlines(), restval='')
-            data = list(reader)
-        layout.data = parseData(data)
-        
+            source = lambda: csv.DictReader(iterLines(userData), restval='')
+        layout.data = parseData(source, derive)
+        if len(layout.data.repeats) == 0:
+            #data without rows is the same as no data, whichever kind it is
+            layout.data = None
+
     else:
         layout.data = None
 
@@ -143,21 +201,11 @@ def buildLayout(filename):
     else:
         layout.defaults = {}
 
-    #macros
-    def makeMacro(value):
-        def func(context, *args):
-            newStore = context.store.copy()
-            newStore.add('arg-total', str(len(args)))
-            for num, arg in enumerate(args):
-                newStore.add(str(num+1), arg)
-            newStore.add('args', makeList(args))
-            return newStore.parse(value)
-        return func
-    layout.userMacros = {}
-    if 'macros' in sections:
-        macros = sections['macros']
-        for name, value in macros.items():
-            layout.userMacros[name] = (makeMacro(value), (0, 99))
+    #computed
+    layout.computed = {}
+    if 'computed' in sections:
+        for name, value in sections['computed'].items():
+            layout.computed[name] = compileValue(value)
 
     #elemnts
     def fix(elemName, source, dest, type, renames):
@@ -199,6 +247,7 @@ def buildLayout(filename):
             fix(name, layout.defaults, newProps, type_, renames)
             fix(name, props, newProps, type_, renames)
             proto = ElementProtoype(container, name, newProps, renames, type_)
+            proto.prevalidate(layout)
             dest[name] = proto
 
             children = props.pop('children')
@@ -209,24 +258,83 @@ def buildLayout(filename):
     layout.elements = {}
     makeElements(parsedLayout['elements'], layout.elements)
 
+    #dependencies
+    #the finder reads the rows as they are in the data, the counts are set on every card
+    #and the columns section is followed through its bodies instead of being run for every row
+    if layout.data is not None:
+        finder = DependencyFinder(layout.macroSources, layout.data.source(),
+            set(layout.computed) | {assetI, rowI, repeatI, repeatT}, layout.columnSources)
+    else:
+        finder = DependencyFinder(layout.macroSources, None, set(layout.computed))
+    def findDependencies(elements, containerDeps=frozenset()):
+        '''an element depends on the columns its properties use and the columns its container uses
+        elements using impure macros, or that can't be analyzed, get None'''
+        for proto in elements.values():
+            deps = finder.find(proto.compiled.values())
+            if deps is None or containerDeps is None:
+                proto.dependencies = None
+                findDependencies(proto.subelements, None)
+            else:
+                deps |= containerDeps
+                proto.dependencies = tuple(sorted(deps))
+                findDependencies(proto.subelements, deps)
+
+    findDependencies(layout.elements)
+
     return layout
 
 class CardRenderer():
     def __init__(self, layout):
         self.layout = layout
         self.store = MacroStore()
+        self.store.directory = layout.directory
         if layout.data is not None:
-            self.store.add('asset-total', str(len(layout.data)))
-            self.store.add('row-total', str(layout.data[-1]['row-index']))
+            self.store.add('asset-total', str(layout.data.cardTotal))
+            self.store.add('row-total', str(layout.data.rowTotal))
        
         self.store.macros.update(self.layout.userMacros)
 
+        self.computed = {}
+        #the computed section for the current card, it shadows every other macro
+        if len(layout.computed) > 0:
+            self.store.frames.append(self.computed)
+
         self.images = []
+        self.memo = {}
+
+    memoLimit = 128
+    #how many compiled versions of each element to hold on to
+
+    def compileElement(self, proto:ElementProtoype, container):
+        '''compile an element, or reuse an earlier compile when the columns it depends on
+        have the same values as they did then'''
+        if proto.dependencies is None:
+            return proto.compile(container, self.store, self.layout)
+        key = tuple(self.store.lookup(dep) for dep in proto.dependencies)
+        memo = self.memo.setdefault(proto.qualName, OrderedDict())
+        if key in memo:
+            memo.move_to_end(key)
+            elem = memo[key]
+        else:
+            elem = proto.compile(container, self.store, self.layout)
+            memo[key] = elem
+            if len(memo) > self.memoLimit:
+                memo.popitem(last=False)
+        #elements get changed after compiling, so everyone gets their own copy
+        return elem.copy()
+
+    def computeValues(self):
+        '''evaluate the computed section for the current card, entries can use the ones before them'''
+        self.computed.clear()
+        self.store.add('elementName', 'computed')
+        for name, compiled in self.layout.computed.items():
+            self.store.add('propertyName', name)
+            self.computed[name] = self.store.evaluate(compiled)
 
     def compile(self, source:dict[str, ElementProtoype], dest, container=None):
         '''turn a dict of element prototypes into a dict of compiled elements'''
         for name, proto in source.items():
-            elem = proto.compile(container, self.store, self.layout)
+            elem = self.compileElement(proto, container)
             if elem.draw:
                 dest[name] = elem
                 elem.subelements = {}
@@ -249,6 +357,8 @@ class CardRenderer():
 
     def renderCard(self):
         '''render the layout and the contained elements'''
+        self.store.startCard()
+        self.computeValues()
         elements = {}
         self.compile(self.layout.elements, elements)
 
@@ -268,8 +378,9 @@ class CardRenderer():
         return image
 
 
-    def render(self):
-        '''paint a set of assets based on the current layout and data file.'''
+    def render(self, start:int=0, stop:int=None):
+        '''paint a set of assets based on the current layout and data file.
+        start and stop pick out a range of cards, so a deck can be rendered in pieces'''
 
         if self.layout.data is None:
                 image = self.renderCard()
@@ -278,10 +389,10 @@ class CardRenderer():
                 self.images.append((image, name))
 
         else:
-            for row in  self.layout.data:
+            for row in self.layout.data.cards(start, stop):
                 #TODO figure out a better way to do this
                 #unless this is the good way
-                self.store.macros.update(row)
+                row.addTo(self.store.macros)
                 image = self.renderCard()
                 self.store.macros.update(dict(propertyName='card-name', elementName='layout'))
                 name = evalEscapes(self.store.parse(self.layout.assetName))
@@ -290,26 +401,108 @@ class CardRenderer():
     
     def export(self, target='bulk'):
         '''save the generated images.'''
-        path = os.getcwd()
         if target not in exportTypes:
             raise CLSError("illegal error, unknown export target", file=self.layout.filename)
         exportType = exportTypes[target]
         exportSection = self.layout.export[target]
-        outputPath = exportSection.output
-        if  outputPath != '' and not os.path.isdir(outputPath):
+        outputPath = os.path.join(self.layout.directory, exportSection.output)
+        if not os.path.isdir(outputPath):
             try:
                 os.mkdir(outputPath)
             except IOError:
-                os.chdir(path)
                 raise CLSError("failed to make output directory", file=self.layout.filename)
-        os.chdir(os.path.realpath(outputPath))
 
+        exportType.export(self, exportSection, outputPath)
+
+#the layout a worker process renders, set up once by startWorker
+worker = Collection()
+
+def workerSettings() -> dict:
+    '''the settings main can change for the whole process, workers start
+    as new processes so they're handed these when they start'''
+    return dict(
+        cache=ParseCache.enabled,
+        profile=MacroStore.profiler is not None,
+        limits=dict(maxDepth=MacroStore.maxDepth, maxCalls=MacroStore.maxCalls, maxCardTime=MacroStore.maxCardTime),
+    )
+
+def startWorker(directory:str, filename:str, settings:dict):
+    '''build the layout in a new worker process, it's kept for every range of cards the worker gets'''
+    ParseCache.enabled = settings['cache']
+    for name, value in settings['limits'].items():
+        setattr(MacroStore, name, value)
+    if settings['profile']:
+        MacroStore.profiler = MacroProfiler()
+    worker.app = QGuiApplication.instance() or QGuiApplication([])
+    worker.renderer = CardRenderer(buildLayout(filename, directory))
+    if MacroStore.profiler is not None:
+        #building the layout was already profiled by the main process
+        MacroStore.profiler.clear()
+
+def renderCards(span:tuple[int, int]) -> tuple[list[tuple[str, bytes|None]], tuple|None]:
+    '''render a range of cards in a worker process, returns the name of each card and its image
+    encoded the way bulk export saves it, or None if it can't be, along with the profile
+    entries and macro cache hits and misses of the range if the worker is profiling'''
+    renderer = worker.renderer
+    renderer.images = []
+    before = MacroStore.cache.stats()
+    renderer.render(*span)
+    bulk = renderer.layout.export['bulk']
+    cards = []
+    for image, name in renderer.images:
+        if not bulk.includeBleed:
+            image = image.copy(renderer.layout.content)
+        data = QByteArray()
+        buffer = QBuffer(data)
+        buffer.open(QIODevice.WriteOnly)
+        #like QImage.save, the format comes from the name
+        suffix = os.path.splitext(name)[1][1:].lower()
+        if suffix != '' and image.save(buffer, suffix):
+            cards.append((name, data.data()))
+        else:
+            cards.append((name, None))
+    profile = None
+    if MacroStore.profiler is not None:
+        after = MacroStore.cache.stats()
+        profile = (MacroStore.profiler.entries, after['hits']-before['hits'], after['misses']-before['misses'])
+        MacroStore.profiler.clear()
+    return cards, profile
+
+def exportPool(layout, jobs:int) -> int:
+    '''render and save the bulk export of a layout with jobs worker processes, returns
+    how many cards there were. the deck is split into ranges that workers take as they
+    finish, and cards are saved in order so the files are the same as rendering serially'''
+    bulk = layout.export['bulk']
+    output = os.path.join(layout.directory, bulk.output)
+    if not os.path.isdir(output):
         try:
-            exportType.export(self, exportSection)
-        finally:
-            os.chdir(path)
-
-        #os.chdir(path)
+            os.mkdir(output)
+        except IOError:
+            raise CLSError("failed to make output directory", file=layout.filename)
+
+    cards = len(layout.data)
+    chunk = max(1, math.ceil(cards/(jobs*4)))
+    spans = [(start, min(start+chunk, cards)) for start in range(0, cards, chunk)]
+    #a forked Qt is not safe to use, so workers start fresh
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(jobs, startWorker, (layout.directory, layout.filename, workerSettings())) as pool:
+        for rendered, profile in pool.imap(renderCards, spans):
+            if profile is not None and MacroStore.profiler is not None:
+                entries, hits, misses = profile
+                MacroStore.profiler.merge(entries)
+                MacroStore.cache.count(hits, misses)
+            for name, data in rendered:
+                if data is None:
+                    #QImage.save fails quietly in serial export too
+                    continue
+                try:
+                    with open(os.path.join(output, name), 'wb') as file:
+                        file.write(data)
+                except OSError:
+                    raise CLSError("failed to save image '{asset}' to {output}",
+                        output=bulk.output, layout=layout.filename, asset=name
+                    )
+    return cards
 
 assetI = 'card-index'
 assetT = 'card-total'
@@ -318,37 +511,134 @@ rowT = 'row-total'
 repeatI = 'repeat-index'
 repeatT = 'repeat-total'
 
-def parseData(data):
-    #adds the counts to the roes as if they were columns
-    #this should maybe be moved to the csv parser
-    if data is None:
+class CardRow(Mapping):
+    '''one card of a CardData, its counts laid over the row it came from without copying the row'''
+    __slots__ = ('row', 'counts')
+
+    def __init__(self, row:dict, counts:dict):
+        self.row = row
+        self.counts = counts
+
+    def __getitem__(self, key):
+        if key in self.counts:
+            return self.counts[key]
+        return self.row[key]
+
+    def __iter__(self):
+        for key in self.row:
+            if key not in self.counts:
+                yield key
+        yield from self.counts
+
+    def __len__(self):
+        return len(self.row) + sum(1 for key in self.counts if key not in self.row)
+
+    def items(self):
+        return (self.row | self.counts).items()
+
+    def addTo(self, target:dict):
+        '''the same as target.update(self), without going through the mapping one key at a time'''
+        target.update(self.row)
+        target.update(self.counts)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class CardData(Sequence):
+    '''the cards of the data after the columns section, read from the data as they're asked for.
+    the data is read through once when it's made to count the cards, keeping only the repeat
+    of each row, then rows are read again and run through the columns section as cards are
+    rendered, so only the card being rendered has to be held on to'''
+
+    def __init__(self, source, derive=None):
+        '''source returns a new iterable of the rows each time it's called'''
+        self.source = source
+        self.derive = derive
+        self.repeats = []
+        #the repeat total of each row
+        self.starts = []
+        #the index of the first card of each row
+        self.cardTotal = 0
+        self.rowTotal = 0
+        #the row index of the last card, rows without cards don't count at the end
+
+        for rowIndex, row in enumerate(source(), 1):
+            repeatTotal = row.get('repeat', '1')
+            self.repeats.append(repeatTotal)
+            self.starts.append(self.cardTotal)
+            count = self.count(rowIndex-1)
+            if count > 0:
+                self.cardTotal += count
+                self.rowTotal = rowIndex
+
+    def count(self, rowPos:int) -> int:
+        '''how many cards the row at rowPos makes'''
+        repeatTotal = self.repeats[rowPos]
+        return 1 if repeatTotal == '1' else max(int(repeatTotal), 0)
+
+    def prepare(self, rowPos:int, row:dict) -> dict:
+        '''the row at rowPos as cards see it, without repeat and with the columns section'''
+        if 'repeat' in row:
+            #the source may hand out the same dicts every time, so don't change them
+            row = {key: value for key, value in row.items() if key != 'repeat'}
+        if self.derive is not None:
+            row = row | self.derive(row | {rowI:str(rowPos+1), repeatT:self.repeats[rowPos]})
+        return row
+
+    def card(self, rowPos:int, repeat:int, row:dict) -> CardRow:
+        '''the card for one repeat of a prepared row, both start at 0'''
+        counts = {assetI:str(self.starts[rowPos]+repeat+1), rowI:str(rowPos+1), repeatI:str(repeat+1), repeatT:self.repeats[rowPos]}
+        return CardRow(row, counts)
+
+    def cards(self, start:int=0, stop:int=None):
+        '''yield the cards from start up to stop, the rows before start are
+        read past without running the columns section'''
+        if stop is None or stop > self.cardTotal:
+            stop = self.cardTotal
+        if start >= stop:
+            return
+        #rows without cards share a start with the next row, so take the last row starting at or before start
+        first = bisect.bisect_right(self.starts, start) - 1
+        for rowPos, row in enumerate(self.source()):
+            if rowPos < first:
+                continue
+            rowStart = self.starts[rowPos]
+            if rowStart >= stop:
+                return
+            count = self.count(rowPos)
+            if count == 0:
+                continue
+            row = self.prepare(rowPos, row)
+            for repeat in range(max(start-rowStart, 0), min(stop-rowStart, count)):
+                yield self.card(rowPos, repeat, row)
+
+    def rows(self):
+        '''yield the first card of every row that has cards, for looking over the columns'''
+        for rowPos, row in enumerate(self.source()):
+            if self.count(rowPos) > 0:
+                yield self.card(rowPos, 0, self.prepare(rowPos, row))
+
+    def __len__(self):
+        return self.cardTotal
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.cardTotal)
+            if step == 1:
+                return list(self.cards(start, stop))
+            return [self[i] for i in range(start, stop, step)]
+        if index < 0:
+            index += self.cardTotal
+        if not 0 <= index < self.cardTotal:
+            raise IndexError('card index out of range')
+        return next(self.cards(index, index+1))
+
+    def __iter__(self):
+        return self.cards()
+
+def parseData(source, derive=None):
+    #adds the counts to the rows as if they were columns
+    #source returns the rows, derive adds the columns section to each row as it's read
+    if source is None:
         return None
-
-    newData = []
-
-    if 'repeat' in data[0]:
-        assetIndex = 1
-        rowIndex = 1
-        for row in data: #change to enumerate?
-            
-            repeatTotal = row.pop('repeat')
-            if repeatTotal == '1':
-                counts = {assetI:str(assetIndex), rowI:str(rowIndex), repeatI:'1', repeatT:repeatTotal}
-                newData.append(row | counts)
-                assetIndex += 1
-                rowIndex += 1
-            else:
-                for repeat in range(int(repeatTotal)):
-                    counts = {assetI:str(assetIndex), rowI:str(rowIndex), repeatI:str(repeat+1), repeatT:repeatTotal}
-                    newData.append(row | counts)
-                    assetIndex += 1
-                rowIndex += 1
-
-    else:
-        for index, row in enumerate(data):
-            counts = {assetI:str(index+1), rowI:str(index+1), repeatI:'1', repeatT:'1'}
-            newData.append(row | counts)
-
-    return newData
-
-
+    return CardData(source, derive)
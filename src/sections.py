@@ -204,14 +204,14 @@ class BulkExport(ExportSection):
     
 
     @staticmethod
-    def export(painter, bulk):
+    def export(painter, bulk, directory):
 
         try:
             for image, name in painter.images:
                 if bulk.includeBleed:
-                    image.save(name)
+                    image.save(os.path.join(directory, name))
                 else:
-                    image.copy(painter.layout.content).save(name)
+                    image.copy(painter.layout.content).save(os.path.join(directory, name))
 
         except OSError:
             raise CLSError("failed to save image '{asset}' to {ouput}",
@@ -256,7 +256,7 @@ class PDFExport(ExportSection):
 
     
     @staticmethod
-    def export(painter, pdf):
+    def export(painter, pdf, directory):
         
         dpi = painter.layout.dpi
         border = pdf.border.toInt(dpi=dpi)
@@ -304,7 +304,7 @@ class PDFExport(ExportSection):
         if mod > 0:
             assetPages += 1
         
-        pdfWriter = QPdfWriter(pdf.name)
+        pdfWriter = QPdfWriter(os.path.join(directory, pdf.name))
         painter._pdf = pdfWriter
         pdfWriter.setPageLayout(pageLayout)
         pdfWriter.setResolution(dpi)
@@ -372,7 +372,7 @@ class TTSExport(ExportSection):
             sec.name = name+'.png'
         
     @staticmethod
-    def export(painter, tts):
+    def export(painter, tts, directory):
         layout = painter.layout
         if tts.includeBleed:
             bleedWidth = 0
@@ -415,10 +415,10 @@ class TTSExport(ExportSection):
         
         try:
             if len(tts.pages) == 1:
-                tts.pages[0].save(tts.name)
+                tts.pages[0].save(os.path.join(directory, tts.name))
             else:
                 for index, page in enumerate(tts.pages.values()):
-                    page.save(str(index+1)+tts.name)
+                    page.save(os.path.join(directory, str(index+1)+tts.name))
         except OSError:
             raise CLSError("failed to save Tabletop Simulator image to {output}",
                 output=painter.layout.output, layout=painter.layout.filename
@@ -0,0 +1,23 @@
+import os
+import sys
+
+#the modules import each other by name from src
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import pytest
+from PySide6.QtGui import QGuiApplication
+
+@pytest.fixture(scope='session')
+def app():
+    '''painting and laying out text needs an application'''
+    return QGuiApplication.instance() or QGuiApplication([])
+
+@pytest.fixture
+def writeLayout(tmp_path):
+    '''write a dict of file names and text into a fresh folder, returns the folder'''
+    def write(files:dict):
+        for name, text in files.items():
+            (tmp_path / name).write_text(text, encoding='utf-8')
+        return str(tmp_path)
+    return write
@@ -0,0 +1,484 @@
+'''the code that the rewrites replaced, kept so the tests and bench.py can compare against it'''
+
+import re
+
+from utils import *
+from macros import CompiledValue, MacroCall, DeferredError
+
+class LegacyCompiler():
+    '''MacroCompiler as it was before the lexer'''
+
+    class ScanError(Exception):
+        def __init__(self, error):
+            self.error = error
+
+    def __init__(self, string:str):
+        self.string = string
+        self.pos = 0
+
+    def compileMacroArg(self) -> str:
+        argB = []
+        macroStack = []
+        char = ''
+
+        while self.pos < len(self.string):
+            char = self.string[self.pos]
+
+            if char == '\\':
+                argB.append(self.string[self.pos:self.pos+2])
+                self.pos += 1
+
+            elif char in '[(':
+                macroStack.append(char)
+                argB.append(char)
+            
+            elif char == ')':
+                if len(macroStack) == 0:
+                    #we never saw the opener
+                    raise self.ScanError(ImbalancedDelimError)
+                opener = macroStack.pop()
+                if opener == '[':
+                    raise self.ScanError(ImbalancedDelimError)
+                argB.append(char)
+
+            elif char in ',|]':
+                if len(macroStack) == 0:
+                    self.pos -= 1 #backtrack so compileMacro can see the comma/bracket
+                    return ''.join(argB).strip()
+                else:
+                    if char == ']':
+                        opener = macroStack.pop()
+                        if opener == '(':
+                            raise self.ScanError(ImbalancedDelimError)
+                    argB.append(char)
+            
+            else:
+                argB.append(char)
+
+            self.pos += 1
+        
+        raise self.ScanError(ImbalancedDelimError)
+
+    def compileMacro(self) -> MacroCall:
+        nameB = []
+        args = []
+        char = ''
+
+        while self.pos < len(self.string):
+            char = self.string[self.pos]
+            if char == '\\':
+                nameB.append(self.string[self.pos:self.pos+2])
+                self.pos += 1
+                
+            elif char in ',|':
+                self.pos += 1
+                args.append(self.compileMacroArg())
+            
+            elif char == ']':
+                return MacroCall(build(nameB), args)
+            
+            elif char == ')': #? might be wrong, or might need a stack
+                raise self.ScanError(ImbalancedDelimError)
+
+            else:
+                nameB.append(char)
+
+            self.pos += 1
+        raise self.ScanError(UnclosedMacroError)
+
+    def compile(self) -> CompiledValue:
+        parts = []
+        textB = []
+        char = ''
+
+        try:
+            while self.pos < len(self.string):
+                char = self.string[self.pos]
+            
+                if char == '\\':
+                    textB.append(self.string[self.pos:self.pos+2])
+                    self.pos += 1
+                    #ignore escapes
+            
+                elif char == '[':
+                    self.pos += 1
+                    if len(textB) > 0:
+                        parts.append(''.join(textB))
+                        textB = []
+                    parts.append(self.compileMacro())
+            
+                else:
+                    textB.append(char)
+                
+                self.pos += 1
+        except self.ScanError as e:
+            if len(textB) > 0:
+                parts.append(''.join(textB))
+            parts.append(DeferredError(e.error))
+        else:
+            if len(textB) > 0:
+                parts.append(''.join(textB))
+
+        return CompiledValue(self.string, parts)
+
+#the character at a time scanners that utils.lexer replaced
+
+def legacyCommaSplit(string):
+    accum = []
+    values = []
+    pos = 0
+    stack = []
+    while pos < len(string):
+        char = string[pos]
+        if char == '\\':
+            accum.append(string[pos:pos+2])
+            pos += 1
+        elif char in "[(":
+            stack.append(char)
+            accum.append(char)
+        elif char in ")]":
+            stack.pop()
+            accum.append(char)
+        elif char == ',':
+            if len(stack) == 0:
+                values.append(build(accum))
+                accum = []
+            else:
+                accum.append(char)
+        else:
+            accum.append(char)
+        pos += 1
+    values.append(build(accum))
+    return values
+
+def legacyEvalEscapes(string):
+    from utils.data import expansions
+    pos = 0
+    accum = []
+    while pos < len(string):
+        char = string[pos]
+        if char == '\\':
+            pos += 1
+            char = string[pos]
+            accum.append(expansions.get(char, char))
+        else:
+            accum.append(char)
+        pos += 1
+    return build(accum)
+
+def legacyParseList(source):
+    string = source.strip()
+    if string == ':':
+        return []
+    if string[0] != '(' or string[-1] != ')':
+        return None
+    pos = 1
+    contents = []
+    while pos < len(string):
+        accum = []
+        innerStack = []
+        while pos < len(string):
+            char = string[pos]
+            if char == '\\':
+                accum.append(string[pos:pos+2])
+                pos += 1
+            elif char in '([':
+                innerStack.append(char)
+                accum.append(char)
+            elif char == ']':
+                if len(innerStack) == 0 or innerStack.pop() == '(':
+                    raise CLSError('imbalanced')
+                accum.append(char)
+            elif char in ',)':
+                if len(innerStack) == 0:
+                    if pos != len(string)-1 and char == ')':
+                        raise CLSError('imbalanced')
+                    item = build(accum)
+                    if not (char == ')' and item == ''):
+                        contents.append(item)
+                    break
+                if char == ')' and innerStack.pop() == '[':
+                    raise CLSError('imbalanced')
+                accum.append(char)
+            else:
+                accum.append(char)
+            pos += 1
+        else:
+            raise CLSError('imbalanced')
+        pos += 1
+    return contents
+
+#the character at a time layout parser
+
+class LegacyLayoutParser():
+    '''LayoutParser as it was before it scanned with regexes'''
+    def __init__(self, source, filename):
+
+        lines = source.splitlines()
+        newLines = []
+        for line in lines:
+            if (not re.match(r'\s*#', line)) and line != '':
+                newLines.append(line)
+        source = '\n'.join(newLines)
+
+        self.pos = 0
+        self.string = source
+        self.filename = filename
+
+
+
+    def parseValue(self, prop):
+        '''parses a single value and returns when it's ended'''
+        #takes over after a :
+        accum = []
+        char = ''
+
+        while self.pos < len(self.string):
+            char = self.string[self.pos]
+
+            if char == '\\':
+                accum.append(self.string[self.pos:self.pos+2])
+                self.pos += 1
+            
+            elif char in '\n;':
+                if len(accum) == 0:
+                    return ''
+                value = build(accum)
+                return value
+            
+            elif char == '}':
+                value = build(accum)
+                self.pos -= 1 #OH NO A BCKTRACK
+                return value
+            
+            else:
+                accum.append(char)
+
+            self.pos += 1
+        
+        raise err.UnexpectedEOFError(self.filename, prop)
+
+    def parseSection(self, elem):
+        '''parses the contents of a section
+        parsing includes both properties and sub sections
+        don't call directly'''
+        accum = []
+        char = ''
+        section = dict(children={})
+        name = ''
+
+        while self.pos < len(self.string):
+            char = self.string[self.pos]
+
+            if char == ':':
+                name = build(accum)
+                accum = []
+                self.pos += 1
+                section[name] = self.parseValue(name)
+
+            elif char == '{':
+                name = build(accum)
+                self.pos += 1
+                section['children'][name] = self.parseSection(name)
+                accum = []
+
+            elif char == '}':
+                name = build(accum)
+                if name != '':
+                    raise err.NoValueError(self.filename, elem, name)
+                return section
+            
+            elif char == '=':
+                name = build(accum)
+                raise err.CLSSyntaxError("'{elem}' section can not define macros",
+                elem=elem, file=self.filename)
+        
+            else:
+                accum.append(char)
+
+            self.pos += 1
+        raise err.UnexpectedEOFError(self.filename, elem)
+
+    def parseProps(self, elem):
+        '''parses property only sections'''
+        
+        section = {}
+        accum = []
+        name = ''
+        while self.pos < len(self.string):
+            char = self.string[self.pos]
+
+            if char == ':':
+                name = build(accum)
+                accum = []
+                self.pos += 1
+                section[name] = self.parseValue(name)
+            
+            elif char == '{':
+                raise err.CLSSyntaxError("'{elem}' cannot contain subsections",
+                file=self.filename, elem=elem)
+            
+            elif char == '}':
+                name = build(accum)
+                if name != '':
+                    raise err.NoValueError(self.filename, elem, name)
+                return section
+            
+            elif char == '=':
+                name = build(accum)
+                raise err.CLSSyntaxError("'{elem}' section can not define macros",
+                elem=elem, file=self.filename)
+            
+            else:
+                accum.append(char)
+            
+            self.pos += 1
+        
+        raise err.UnexpectedEOFError(self.filename, elem)
+        
+
+    def parseUserMacros(self, elem='macros'):
+        '''parses sections made of macro definitions, like macros, computed and columns'''
+
+        names = {}
+        accum = []
+        name = ''
+
+        while self.pos < len(self.string):
+            char = self.string[self.pos]
+
+            if char == '=':
+                name = build(accum)
+                accum = []
+                self.pos += 1
+                names[name] = self.parseValue(name)
+            
+            elif char == '}':
+                name = build(accum)
+                if name != '':
+                    raise err.NoValueError(self.filename, elem, name)
+                return names
+            
+            elif char == ':':
+                raise err.CLSSyntaxError("'{elem}' cannot conaint properties",
+                file=self.filename, elem=elem)
+            
+            elif char == '{':
+                raise err.CLSSyntaxError("'{elem}' cannot contain subsections",
+                file=self.filename, elem=elem)
+
+            else:
+                accum.append(char)
+            
+            self.pos += 1
+        
+        raise err.UnexpectedEOFError(self.filename, elem)
+
+    def parseNil(self, elem):
+        '''parse nothing, return a string'''
+
+        accum = []
+        name = ''
+
+        while self.pos < len(self.string):
+            char = self.string[self.pos]
+
+            if char == '\\':
+                accum.append(self.string[self.pos:self.pos+2])
+                self.pos += 1
+            
+            elif char == '}':
+                return build(accum)
+            
+            else:
+                accum.append(char)
+            
+            self.pos += 1
+        raise err.UnexpectedEOFError(self.filename, elem)
+
+
+    def parseLayoutFile(self) -> dict:
+        """returns a parsed layout file as a dict with three items
+        ['props'] holds the properties of the layout section
+        ['sections'] holds the special sections
+        ['elements'] holes the elements
+        """
+
+        accum = []
+        layout = dict(props={}, elements={}, sections={})
+        name = ''
+
+        while self.pos < len(self.string):
+            char = self.string[self.pos]
+            
+            if char == '{':
+                name = build(accum)
+                self.pos += 1
+                accum = []
+                if name == 'layout':
+                    layout['props'] = self.parseProps(name)
+                elif name in ('defaults', 'csv'):
+                    layout['sections'][name] = self.parseProps(name)
+                elif name in ('macros', 'computed', 'columns'):
+                    layout['sections'][name] = self.parseUserMacros(name)
+                elif name == 'export':
+                    layout['sections'][name] = self.parseSection(name)
+                elif name == 'data':
+                    layout['sections'][name] = self.parseNil(name)
+                else:
+                    layout['elements'][name] = self.parseSection(name)
+
+            elif char == ':':
+                raise err.CLSSyntaxError("properties not allowed at the top level of a layout file",
+                file=self.filename, name=build(accum))
+
+            elif char == '=':
+                raise err.CLSSyntaxError("macro definitions not allowed at the top level of a layout file",
+                file=self.filename, name=build(accum))
+            
+            elif char == '}':
+                raise err.CLSSyntaxError("unexpected }} near '{name}'",
+                file=self.filename, name=build(accum))
+            
+            else:
+                accum.append(char)
+
+            self.pos += 1
+        
+        if len(build(accum)) > 0:
+            raise err.CLSSyntaxError("'{elem}' has no section",
+            file=self.filename, elem=build(accum))
+        
+        return layout
+
+#the data pipeline as it was before rows were streamed
+
+def legacyParseCSV(source:str) -> list[dict]|None:
+    headers = None
+    rows = []
+    for line in source.splitlines():
+        if re.match(r'^\s*#', line):
+            continue
+        elif re.match(r'^\s*$', line):
+            continue
+        elif headers is None:
+            headers = [name.strip() for name in line.split(',') if name.strip() != '']
+        else:
+            row = splitTop(line, ',')
+            while len(row) < len(headers):
+                row.append('')
+            rows.append(row)
+    if len(rows) == 0:
+        return None
+    return [dict(zip(headers, row)) for row in rows]
+
+def legacyParseData(data:list[dict]) -> list[dict]:
+    newData = []
+    assetIndex = 1
+    for rowIndex, row in enumerate(data, 1):
+        repeatTotal = row.pop('repeat')
+        for repeat in range(int(repeatTotal)):
+            counts = {'card-index':str(assetIndex), 'row-index':str(rowIndex), 'repeat-index':str(repeat+1), 'repeat-total':repeatTotal}
+            newData.append(row | counts)
+            assetIndex += 1
+    return newData
@@ -0,0 +1,89 @@
+'''inputs shared by the tests and bench.py, taken from the examples or made up in their shape'''
+
+import os
+
+from macros import compileValue
+
+examples = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'examples')
+
+suits = ('spade', 'heart', 'club', 'diamond')
+
+def exampleCorpus() -> tuple[list[str], list[str]]:
+    '''every property value in the examples and templates, and the macro arguments
+    inside them, along with every line of their data'''
+    from parsers import LayoutParser
+    values = []
+    lines = []
+    def walk(section):
+        for value in section.values():
+            if isinstance(value, dict):
+                walk(value)
+            else:
+                values.append(value)
+    def addArgs(value):
+        for part in compileValue(value).parts:
+            if hasattr(part, 'args'):
+                for arg in part.args:
+                    values.append(arg)
+                    addArgs(arg)
+    root = os.path.dirname(examples)
+    for folder in (examples, os.path.join(root, 'tgc templates')):
+        for path, dirs, files in os.walk(folder):
+            for filename in files:
+                fullName = os.path.join(path, filename)
+                if filename.endswith('.cls'):
+                    with open(fullName, encoding='utf-8') as file:
+                        layout = LayoutParser(file.read(), filename).parseLayoutFile()
+                    data = layout['sections'].pop('data', None)
+                    if data is not None:
+                        lines.extend(data.splitlines())
+                    walk(layout)
+                elif filename.endswith('.csv'):
+                    with open(fullName, encoding='utf-8') as file:
+                        lines.extend(file.read().splitlines())
+    for value in list(values):
+        addArgs(value)
+    return values, [line for line in lines if line.strip() != '']
+
+def makeLayout(elements:int) -> str:
+    '''a layout file in the shape of the examples with the given number of elements'''
+    parts = [
+        '#a synthetic layout',
+        'layout {\n    width: 2.5in; height: 3.5in\n    name: card[card-index].png\n}',
+        'defaults {\n    font-size: 8pt\n}',
+        'macros {\n    red = #ff0000\n    black = #000000\n    color = [if| [in| [suit], spade, club], [black], [red]]\n}',
+        'computed {\n    pips = [=| [rank] * 2]\n}',
+    ]
+    for i in range(elements):
+        parts.append(f'''name{i} {{
+    #element {i}
+    type: text
+    x: 1/8in; y: [=| {i} * 1/16]in
+    width: 1in; height: .3in
+    color: [color]
+    text: [rank] of [suit]\\s{i}
+    align: center
+    child {{
+        type: image
+        source: images/[suit]-small.png
+        x: .1in; y: .1in
+    }}
+}}''')
+    parts.append('data {\n' + '\n'.join(f'{i},{suits[i%4]}' for i in range(elements)) + '\n}')
+    return '\n\n'.join(parts)
+
+def makeTokenSheet(rows:int) -> str:
+    '''a data file in the shape of a token or counter sheet, with heavy repeats'''
+    lines = ['name, strength, art, repeat']
+    for i in range(rows):
+        lines.append(f'token {i}, {i%7}, images/token{i%12}.png, {i%40+1}')
+    return '\n'.join(lines)
+
+#card text from short to long, some of it rich text
+fitTexts = (
+    'Fireball',
+    'Deal 3 damage to any target.',
+    'When this enters play, draw a card. <b>Flying</b>\nAt the start of your turn, you may discard a card to gain 2 life.',
+    ' '.join(['Each player reveals the top card of their deck and puts it into their hand.'] * 4),
+    '<i>An ancient power stirs beneath the mountain, and the ground itself remembers the old names.</i>',
+)
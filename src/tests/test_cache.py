@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from utils import *
+from renderer import buildLayout
+
+class Parser():
+    '''a parse function that counts how many times it's called'''
+    def __init__(self):
+        self.calls = 0
+    def __call__(self, text:str) -> list:
+        self.calls += 1
+        return text.split()
+
+@pytest.fixture
+def big() -> str:
+    return 'word ' * (ParseCache.minSize//5 + 1)
+
+def entries(directory:str) -> list[str]:
+    folder = os.path.join(directory, ParseCache.folder)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.listdir(folder))
+
+def testSecondLoadIsCached(tmp_path, big):
+    parse = Parser()
+    assert ParseCache.load('test', big, str(tmp_path), parse) == big.split()
+    assert ParseCache.load('test', big, str(tmp_path), parse) == big.split()
+    assert parse.calls == 1
+    assert len(entries(tmp_path)) == 1
+
+def testChangedTextIsParsedAgain(tmp_path, big):
+    parse = Parser()
+    ParseCache.load('test', big, str(tmp_path), parse)
+    changed = big + 'more'
+    assert ParseCache.load('test', changed, str(tmp_path), parse) == changed.split()
+    assert parse.calls == 2
+    assert len(entries(tmp_path)) == 2
+
+def testKindsAreKeptApart(tmp_path, big):
+    parse = Parser()
+    ParseCache.load('layout', big, str(tmp_path), parse)
+    ParseCache.load('csv', big, str(tmp_path), parse)
+    assert parse.calls == 2
+
+def testNewVersionIsParsedAgain(tmp_path, big, monkeypatch):
+    parse = Parser()
+    ParseCache.load('test', big, str(tmp_path), parse)
+    monkeypatch.setattr(ParseCache, 'version', ParseCache.version+1)
+    ParseCache.load('test', big, str(tmp_path), parse)
+    assert parse.calls == 2
+
+def testBrokenEntryIsParsedAgain(tmp_path, big):
+    parse = Parser()
+    ParseCache.load('test', big, str(tmp_path), parse)
+    path = os.path.join(tmp_path, ParseCache.folder, entries(tmp_path)[0])
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('{"not finished": ')
+    assert ParseCache.load('test', big, str(tmp_path), parse) == big.split()
+    assert parse.calls == 2
+    #and the entry is fixed
+    assert ParseCache.load('test', big, str(tmp_path), parse) == big.split()
+    assert parse.calls == 2
+
+def testDisabledAndSmallTextSkipTheCache(tmp_path, big, monkeypatch):
+    parse = Parser()
+    ParseCache.load('test', 'too small', str(tmp_path), parse)
+    ParseCache.load('test', 'too small', str(tmp_path), parse)
+    monkeypatch.setattr(ParseCache, 'enabled', False)
+    ParseCache.load('test', big, str(tmp_path), parse)
+    ParseCache.load('test', big, str(tmp_path), parse)
+    assert parse.calls == 4
+    assert entries(tmp_path) == []
+
+def testOldEntriesArePruned(tmp_path, big, monkeypatch):
+    monkeypatch.setattr(ParseCache, 'limit', 3)
+    for i in range(6):
+        ParseCache.load('test', big + str(i), str(tmp_path), Parser())
+    assert len(entries(tmp_path)) == 3
+
+def testEditedLayoutIsPickedUp(app, writeLayout):
+    source = 'layout {\n    size: 2.5in, 3.5in\n}\n' + '#padding\n' * (ParseCache.minSize//9 + 1)
+    assert ParseCache.wants(source)
+    directory = writeLayout({'big.cls': source})
+    assert buildLayout('big.cls', directory).cardSize.width() == 750
+    assert len(entries(directory)) == 1
+    with open(os.path.join(directory, 'big.cls'), 'w', encoding='utf-8') as file:
+        file.write(source.replace('size: 2.5in', 'size: 2in', 1))
+    assert buildLayout('big.cls', directory).cardSize.width() == 600
+    assert len(entries(directory)) == 2
@@ -0,0 +1,146 @@
+import os
+import random
+
+import pytest
+
+from utils import *
+from parsers import CSVParser, LayoutParser
+import renderer
+from renderer import parseData, buildLayout
+from legacy import legacyParseCSV, legacyParseData
+from samples import makeTokenSheet, examples
+
+def dataSources() -> list[tuple[str, str]]:
+    '''the name and text of every data file and data section in the examples,
+    along with made up data that has lots of repeats and rows without cards'''
+    sources = []
+    for path, dirs, names in os.walk(examples):
+        for name in sorted(names):
+            fullName = os.path.join(path, name)
+            if name.endswith('.csv'):
+                with open(fullName, encoding='utf-8') as file:
+                    sources.append((name, file.read()))
+            elif name.endswith('.cls'):
+                with open(fullName, encoding='utf-8') as file:
+                    layout = LayoutParser(file.read(), name).parseLayoutFile()
+                if 'data' in layout['sections']:
+                    sources.append((name, layout['sections']['data']))
+    sources.append(('tokens', makeTokenSheet(60)))
+    rng = random.Random(5)
+    lines = ['name, repeat'] + [f'row {i}, {rng.choice(["0", "1", "2", "3", "01", "-1"])}' for i in range(40)]
+    sources.append(('repeats', '\n'.join(lines)))
+    sources.append(('trailing empty rows', 'name, repeat\na, 2\nb, 0\nc, 0'))
+    return sources
+
+def legacyCards(text:str) -> list[dict]:
+    '''every card the way they were made before they were streamed'''
+    rows = legacyParseCSV(text) or []
+    for row in rows:
+        row.setdefault('repeat', '1')
+    return legacyParseData(rows)
+
+@pytest.mark.parametrize('name, text', dataSources(), ids=[name for name, text in dataSources()])
+def testCardsMatchLists(name, text):
+    expected = legacyCards(text)
+    data = parseData(lambda: CSVParser(text).iterRows())
+    assert len(data) == len(expected)
+    assert list(data) == expected
+    if len(expected) > 0:
+        assert data.rowTotal == int(expected[-1]['row-index'])
+
+    for i in range(len(expected)):
+        assert data[i] == expected[i]
+        assert data[-i-1] == expected[-i-1]
+    rng = random.Random(len(text))
+    for _ in range(30):
+        start, stop = sorted(rng.randint(-2, len(expected)+2) for _ in range(2))
+        assert data[start:stop] == expected[start:stop]
+        start, stop = max(start, 0), max(stop, 0)
+        assert list(data.cards(start, stop)) == expected[start:stop]
+    assert data[::3] == expected[::3]
+    with pytest.raises(IndexError):
+        data[len(expected)]
+
+    firsts = [card for card in expected if card['repeat-index'] == '1']
+    assert list(data.rows()) == firsts
+
+    #a source may hand out the same rows every time it is read, cards must not change them
+    rows = list(CSVParser(text).iterRows())
+    copies = [dict(row) for row in rows]
+    cached = parseData(lambda: rows)
+    assert list(cached) == expected
+    assert list(cached) == expected
+    assert rows == copies
+
+def testColumnsAreAddedToEachCard():
+    text = 'name, repeat\na, 2\nb, 0\nc, 1'
+    derived = []
+    def derive(row):
+        derived.append(row['name'])
+        return {'label': f"{row['name']}{row['row-index']}/{row['repeat-total']}"}
+    data = parseData(lambda: CSVParser(text).iterRows(), derive)
+    assert [card['label'] for card in data] == ['a1/2', 'a1/2', 'c3/1']
+    #the columns run once for each row that makes cards, and only for rows that are read
+    derived.clear()
+    assert data[2]['label'] == 'c3/1'
+    assert derived == ['c']
+
+def testDataFilesAreNotKept(app, writeLayout):
+    text = makeTokenSheet(2000)
+    assert ParseCache.wants(text)
+    layout = 'layout {\n    size: 1in, 1in\n    data: tokens.csv\n}\n'
+    directory = writeLayout({'tokens.csv': text, 'tokens.cls': layout})
+    for _ in range(2):
+        data = buildLayout('tokens.cls', directory).data
+        assert not isinstance(data.source(), list)
+        assert len(data) == len(legacyCards(text))
+    assert not os.path.exists(os.path.join(directory, ParseCache.folder))
+
+columnsLayout = '''layout {
+    size: 1in, 1in
+}
+
+columns {
+    label = [name] [=| [row-index] * 2]
+    size = [if|? [strength] > 3, big, small]
+}
+
+small {
+    type: text
+    text: [size]
+}
+
+both {
+    type: text
+    text: [label] [art]
+}
+
+plain {
+    type: text
+    text: hello
+}
+
+data {
+name, strength, art
+a, 1, [x]
+b, 5, y
+}
+'''
+
+def testColumnsAreFollowedWithoutRunning(app, writeLayout, monkeypatch):
+    prepared = []
+    prepare = renderer.CardData.prepare
+    def counted(self, rowPos, row):
+        prepared.append(rowPos)
+        return prepare(self, rowPos, row)
+    monkeypatch.setattr(renderer.CardData, 'prepare', counted)
+    layout = buildLayout('columns.cls', writeLayout({'columns.cls': columnsLayout}))
+    assert prepared == []
+    deps = {name: proto.dependencies for name, proto in layout.elements.items()}
+    assert deps == {
+        'small': ('size', 'strength'),
+        'both': ('art', 'label', 'name', 'row-index'),
+        'plain': (),
+    }
+    assert [card['label'] for card in layout.data] == ['a 2', 'b 4']
+    assert prepared == [0, 1]
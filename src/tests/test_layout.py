@@ -0,0 +1,54 @@
+import os
+import random
+
+import pytest
+
+from utils import *
+from parsers import LayoutParser
+from legacy import LegacyLayoutParser
+from samples import makeLayout, examples
+
+def layoutFiles() -> list[str]:
+    '''every layout in the examples and templates'''
+    root = os.path.dirname(examples)
+    files = []
+    for folder in (examples, os.path.join(root, 'tgc templates')):
+        for path, dirs, names in os.walk(folder):
+            files.extend(os.path.join(path, name) for name in names if name.endswith('.cls'))
+    return sorted(files)
+
+def parse(parser, source:str):
+    '''the parsed layout, or the error parsing it gave'''
+    try:
+        return parser(source, 'test.cls').parseLayoutFile()
+    except CLSError as e:
+        return type(e), e.message
+
+def mutations(source:str, count:int, seed:int) -> list[str]:
+    '''copies of source with a few characters dropped or doubled, to reach the error paths'''
+    rng = random.Random(seed)
+    results = []
+    for _ in range(count):
+        chars = list(source)
+        for _ in range(rng.randint(1, 3)):
+            pos = rng.randrange(len(chars))
+            if rng.random() < 0.5:
+                del chars[pos]
+            else:
+                chars.insert(pos, chars[pos])
+        results.append(''.join(chars))
+    return results
+
+@pytest.mark.parametrize('path', layoutFiles(), ids=os.path.basename)
+def testExamplesParseTheSame(path):
+    with open(path, encoding='utf-8') as file:
+        source = file.read()
+    assert parse(LayoutParser, source) == parse(LegacyLayoutParser, source)
+    for mutated in mutations(source, 50, len(source)):
+        assert parse(LayoutParser, mutated) == parse(LegacyLayoutParser, mutated)
+
+def testSyntheticLayout():
+    source = makeLayout(50)
+    layout = parse(LayoutParser, source)
+    assert len(layout['elements']) == 50
+    assert layout == parse(LegacyLayoutParser, source)
@@ -0,0 +1,51 @@
+import random
+
+import pytest
+
+from utils import *
+from utils.lexer import tokenize
+from parsers import CSVParser
+from legacy import legacyCommaSplit, legacyEvalEscapes, legacyParseList
+from samples import exampleCorpus
+
+def generated(count:int, seed:int) -> list[str]:
+    '''short strings made mostly of the characters the scanners care about'''
+    rng = random.Random(seed)
+    alphabet = ['\\', '[', ']', '(', ')', ',', '|', ':', ' ', 'a', 'b', 'n', 's', '\n']
+    return [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12))) for _ in range(count)]
+
+@pytest.fixture(scope='module')
+def corpus() -> list[str]:
+    values, lines = exampleCorpus()
+    return values + lines + generated(20000, 1)
+
+def agree(old, new, corpus:list[str]):
+    '''new gives what old did for everything old could scan, the character loops
+    raised on some broken values that the lexer is more forgiving of'''
+    checked = 0
+    for value in corpus:
+        try:
+            expected = old(value)
+        except (CLSError, IndexError):
+            continue
+        assert new(value) == expected, value
+        checked += 1
+    assert checked > len(corpus)//4
+
+def testTokensJoinBack(corpus):
+    for value in corpus:
+        assert ''.join(tokenize(value)) == value
+
+def testSplitTop(corpus):
+    agree(legacyCommaSplit, commaSplit, corpus)
+
+def testSubEscapes(corpus):
+    agree(legacyEvalEscapes, evalEscapes, corpus)
+
+def testListParser(corpus):
+    lists = [f'({value})' for value in corpus]
+    agree(legacyParseList, lambda value: ListParser(value, None, None).parse(), lists)
+
+def testCSVRows(corpus):
+    parser = CSVParser('')
+    agree(legacyCommaSplit, parser.parseRow, [value for value in corpus if '\n' not in value])
@@ -0,0 +1,61 @@
+import pytest
+
+from utils import *
+from macros import MacroStore, compileValue
+from main import commandParser
+
+def makeStore() -> MacroStore:
+    store = MacroStore()
+    store.add('elementName', 'test')
+    store.add('propertyName', 'test')
+    store.add('word', 'card')
+    return store
+
+def testCardTimeSpansProperties():
+    #each property makes fewer calls than the clock is checked after, but the card makes plenty
+    store = makeStore()
+    store.maxCardTime = 0.0
+    store.startCard()
+    with pytest.raises(ExpansionLimitError):
+        for i in range(300):
+            store.evaluate(compileValue('[word]'))
+
+@pytest.mark.parametrize('value', ['[dup| 1000, ab]', '[for-each| (' + ', '.join(['a']*1000) + '), ab]'])
+def testLoopsWithoutMacrosCheckTheClock(value):
+    store = makeStore()
+    store.startCard()
+    assert len(store.evaluate(compileValue(value))) == 2000
+    store.maxCardTime = 0.0
+    store.startCard()
+    with pytest.raises(ExpansionLimitError):
+        store.evaluate(compileValue(value))
+
+def testStartCardResetsTheClock():
+    store = makeStore()
+    store.startCard()
+    for i in range(300):
+        assert store.evaluate(compileValue('[word]')) == 'card'
+    store.maxCardTime = 0.0
+    store.startCard()
+    #the card before doesn't count towards this one
+    for i in range(255):
+        store.evaluate(compileValue('[word]'))
+    with pytest.raises(ExpansionLimitError):
+        store.evaluate(compileValue('[word]'))
+
+def testCallsAreCountedPerProperty():
+    store = makeStore()
+    store.maxCalls = 3
+    store.startCard()
+    for i in range(10):
+        assert store.evaluate(compileValue('[word][word][word]')) == 'cardcardcard'
+    with pytest.raises(ExpansionLimitError):
+        store.evaluate(compileValue('[word][word][word][word]'))
+
+def testLimitOptions():
+    args = commandParser.parse_args([])
+    assert (args.maxDepth, args.maxCalls, args.maxCardTime) == (MacroStore.maxDepth, MacroStore.maxCalls, MacroStore.maxCardTime)
+    args = commandParser.parse_args(['--max-depth', '8', '--max-calls', '0', '--max-card-time', '1.5', 'test.cls'])
+    assert (args.maxDepth, args.maxCalls, args.maxCardTime) == (8, None, 1.5)
+    with pytest.raises(SystemExit):
+        commandParser.parse_args(['--max-depth', '-1'])
@@ -0,0 +1,167 @@
+import pytest
+
+from utils import *
+from macros import MacroStore, MacroCompiler, ArgFrame, DeferredError, compileValue, compileBody
+from legacy import LegacyCompiler
+from samples import exampleCorpus
+
+class Error(str):
+    '''an expected error message'''
+
+#values and what the macro interpreter that came before compiled values made of them,
+#the old [length| ] gave back an int, here it's the text of that int
+interpreted = [
+    ('plain', 'plain'),
+    ('', ''),
+    ('a\\[b\\]', 'a\\[b\\]'),
+    ('[suit]', 'spade'),
+    ('[suit][rank]x', 'spade3x'),
+    ('[=| 1 + 2]', '3'),
+    ('[=| [rank] * 0.25 + 1]', '1.75'),
+    ('[=| 1/8in + 1/4in]', '0.375'),
+    ('[=| ( 1 + 2 ) * 3]', Error("'( 1' is an unknown operator in macro [=| ]")),
+    ('[=| 10 / 4]', '2.5'),
+    ('[=| 7 % 3]', '1'),
+    ('[=| 1 +]', Error("'1 +' is an unknown operator in macro [=| ]")),
+    ('[=| ( 1 + 2]', Error("'[=| ( 1 + 2]' has unbalanced delimiters in 'p' property")),
+    ('[=| 1 + 2 )]', Error("'[=| 1 + 2 )]' has unbalanced delimiters in 'p' property")),
+    ('[if| [eq| [suit], spade], yes, no]', 'yes'),
+    ('[if|? [rank] == 3, a, b]', 'a'),
+    ('[if|? [rank] >= 4, a, b]', 'b'),
+    ('[in| [rank], 8, 9, 10]', 'false'),
+    ('[in| [rank], (1, 3, 5)]', 'true'),
+    ('[not| yes]', 'false'),
+    ('[not| maybe]', 'false'),
+    ('[either| [], fallback]', 'fallback'),
+    ('[either| x, fallback]', 'x'),
+    ('[i| x][b| y][s| z][u| w]', '<i>x</i><b>y</b><s>z</s><u>w</u>'),
+    ('[dup| 3, [d]-]', '1-2-3-'),
+    ('[dup| 03, [d]-]', '0-1-2-'),
+    ('[for-each| (a, b, c), <[item]>]', '<a><b><c>'),
+    ('[for-each| :, x]', ''),
+    ('[capitalize| hello world of things]', 'Hello World of Things'),
+    ('[upper| abc\\n]', 'ABC\\n'),
+    ('[lower| ABC]', 'abc'),
+    ('[substr| abcdef, 2, 3]', 'bcd'),
+    ('[substr| abcdef, 02, 3]', 'cde'),
+    ('[slice| abcdef, 2]', 'bcdef'),
+    ('[slice| abcdef, 2, 4]', 'bc'),
+    ('[slice| abcdef, -3]', 'def'),
+    ('[slice| (a, b, c, d), 2, 4]', '(b:c)'),
+    ('[length| abc]', '3'),
+    ('[length| (a, b)]', '2'),
+    ('[/| a\\sb]', 'a b'),
+    ('[?| 1in > 2mm]', 'false'),
+    ('[?| 3 != 3]', 'false'),
+    ('[?| nope]', Error("'nope' does not contain a valid comparison")),
+    ('[switch| [suit], spade, S, heart, H, default, D]', 'S'),
+    ('[switch| [suit], (spade, club), black, (heart, diamond), red]', 'black'),
+    ('[switch| x, a, b]', ''),
+    ('[switch| x, a]', Error('too few arguments for [switch| ], expected at least 3 got 2')),
+    ('[unknown| a]', ''),
+    ('[unknown]', ''),
+    ('[eq| a]', Error('wrong number of arguments for [eq| ], expected 2 got 1')),
+    ('[eq| a, b, c]', Error('wrong number of arguments for [eq| ], expected 2 got 3')),
+    ('[suit', Error("'[suit' has an unclosed macro in 'p' property")),
+    ('[eq| (a], b]', Error("'[eq| (a], b]' has unbalanced delimiters in 'p' property")),
+    ('[eq| a), b]', Error("'[eq| a), b]' has unbalanced delimiters in 'p' property")),
+    ('x]y', 'x]y'),
+    ('[if| yes, [[suit]x], n]', 'x]'),
+    ('[twice| ab]', 'abab'),
+    ('[args-m| a, b, c]', '3:(a:b:c):b'),
+    ('[rec]', ''),
+    ('[ne| a, b]', 'true'),
+    ('[eq| a\\, b, a\\, b]', 'true'),
+    ('[if| yes, a\\|b, c]', 'a\\|b'),
+    ('[eq|[suit],spade]', 'true'),
+    ('[ if | yes , a , b ]', 'a'),
+    ('[card-index]/[repeat-index]', '/'),
+    ('[=| [=| 2 * 3] + 1]', '7'),
+    ('\\[not a macro]', '\\[not a macro]'),
+    ('[b|[i|x]]', '<b><i>x</i></b>'),
+    ('[dup| 2, [for-each| (p, q), [d][item]]]', '1p1q2p2q'),
+    ('[capitalize| a]', 'A'),
+    ('[=| 0.1 + 0.2]', '0.30000000000000004'),
+    ('[=| 3 - 5]', '-2'),
+    ('[=| 2.5 * 2]', '5'),
+    ('[/| \\[suit\\]]', 'spade'),
+    ('[/| \\[rank\\]\\[suit\\]]', '3spade'),
+    ('[/| plain]', 'plain'),
+    ('[length| [for-each| (a, b), [item]]]', '2'),
+    ('[for-each| (a, [suit], c), [upper| [item]]]', 'ASPADEC'),
+    ('[for-each| (1, 2), [for-each| (x, y), [item]]]', 'xyxy'),
+    ('[for-each| (), x]', ''),
+    ('[switch| [rank], 1, one, 3, three, default, other]', 'three'),
+    ('[switch| [upper| [suit]], SPADE, yes, default, no]', 'yes'),
+    ('[switch| [rank], (1, 2, 3), low, default, high]', 'low'),
+    ('[switch| [rank], [rank], same, default, different]', 'same'),
+    ('[switch| [rank], 1, one, 2, two]', ''),
+    ('[switch| [suit], \\(spade\\), paren, spade, plain]', 'plain'),
+    ('[length| (a, (b, c), d)]', '3'),
+    ('[length| [suit]]', '5'),
+    ('[twice| [suit]]', 'spadespade'),
+    ('[wrap| [twice| x]]', '<xx>'),
+    ('[args-m| [suit], (a, b)]', '2:(spade:(a, b)):(a, b)'),
+    ('[dup| [rank], ab]', 'ababab'),
+    ('[if| [in| [suit], spade, club], [=| [rank] * 2], no]', '6'),
+    ('[eq| [/| \\[rank\\]], 3]', 'true'),
+    ('[switch| a, (a, b), [for-each| (p, q), [item]!], default, none]', 'p!q!'),
+]
+
+userMacros = {'twice': '[1][1]', 'args-m': '[arg-total]:[args]:[2]', 'wrap': '<[1]>'}
+
+def makeStore() -> MacroStore:
+    store = MacroStore()
+    for name, value in dict(suit='spade', rank='3', elementName='e', propertyName='p').items():
+        store.add(name, value)
+    #the same as buildLayout's user macros
+    for name, value in userMacros.items():
+        body = compileBody(value)
+        store.macros[name] = (lambda context, *args, body=body: context.store.evalBody(ArgFrame(args), body), (0, 99))
+    return store
+
+@pytest.mark.parametrize('value, expected', interpreted)
+def testCompiledMatchesInterpreted(value, expected):
+    store = makeStore()
+    if isinstance(expected, Error):
+        with pytest.raises(CLSError) as info:
+            store.evaluate(compileValue(value))
+        assert info.value.message.endswith(expected)
+    else:
+        assert store.evaluate(compileValue(value)) == expected
+
+@pytest.mark.parametrize('value, expected', [case for case in interpreted if not isinstance(case[1], Error)])
+def testParseMatchesEvaluate(value, expected):
+    assert makeStore().parse(value) == expected
+
+def shape(compiled) -> list:
+    '''the parts of a CompiledValue as plain values that can be compared'''
+    parts = []
+    for part in compiled.parts:
+        if isinstance(part, DeferredError):
+            parts.append((type(part.error).__name__, part.error.message))
+        elif isinstance(part, str):
+            parts.append(part)
+        else:
+            parts.append((part.name, part.args))
+    return parts
+
+def testCompilerMatchesCharLoop():
+    values, lines = exampleCorpus()
+    values += [case[0] for case in interpreted]
+    for value in values:
+        assert shape(MacroCompiler(value).compile()) == shape(LegacyCompiler(value).compile()), value
+
+def testPureMacrosParseTheirArgumentsOnce():
+    store = makeStore()
+    calls = []
+    def count(context):
+        calls.append(context.name)
+        return 'spade'
+    store.macros['count'] = (count, 0)
+    MacroStore.cache.clear()
+    assert store.parse('[capitalize| [count]]') == 'Spade'
+    assert store.parse('[capitalize| [count]]') == 'Spade'
+    #a miss hands capitalize the argument it already parsed, a hit only parses it for the key
+    assert calls == ['count', 'count']
+    assert MacroStore.cache.stats()['hits'] == 1
@@ -0,0 +1,81 @@
+import pytest
+from PySide6.QtCore import Qt, QSize
+from PySide6.QtGui import QColor, QFont
+
+from utils import *
+from elements import TextCache, parseColor, validateFontWeight, makeTextDocument
+from samples import fitTexts
+
+#what a QLabel style sheet made of each color, which is how text used to be painted
+styleSheetColors = [
+    ('red', '#ffff0000'),
+    ('DarkRed', '#ff8b0000'),
+    ('#f00', '#ffff0000'),
+    ('#80ff0000', '#80ff0000'),
+    ('transparent', '#00000000'),
+    ('rgb(255,0,0)', '#ffff0000'),
+    ('rgb( 1 , 2 , 3 )', '#ff010203'),
+    ('rgb(100%,0%,50%)', '#ffff007f'),
+    ('rgb(12.7,0,0)', '#ff0d0000'),
+    ('rgba(255,0,0,0.5)', '#7fff0000'),
+    ('rgba(255,0,0,128)', '#80ff0000'),
+    ('rgba(255,0,0,1)', '#ffff0000'),
+    ('rgba(255,0,0,50%)', '#7fff0000'),
+    ('rgba(1,2,3,2)', '#02010203'),
+    ('hsv(120,255,255)', '#ff00ff00'),
+    ('hsv(50%,1.4,99.5%)', '#fffdfefe'),
+    ('hsl(120,255,128)', '#ff01ff01'),
+    ('hsl(-1,0.5,1)', '#ff010101'),
+    ('hsla(120,255,128,0.5)', '#7f01ff01'),
+    ('hsva(120, 100%, 100%, 0.25)', '#3f00ff00'),
+]
+
+@pytest.mark.parametrize('string, argb', styleSheetColors)
+def testColorsMatchStyleSheets(string, argb):
+    assert parseColor(string).name(QColor.HexArgb) == argb
+
+@pytest.mark.parametrize('string', ['nonsense', '', 'dark-red', 'RGB(255,0,0)', 'rgb(255 0 0)',
+    'rgb(255,0,0,9)', 'rgba(255,0,0)', 'rgb(300,0,0)', 'rgb(-5,0,0)', 'hsv(360,0,0)', 'rgb(1,2,3);color:blue'])
+def testNotColors(string):
+    assert parseColor(string) is None
+
+@pytest.mark.parametrize('string, weight', [('bold', 700), ('Normal', 400), ('450', 450), ('0', 1),
+    ('1200', 1000), ('700.5', 700)])
+def testFontWeights(string, weight):
+    elem = AttrDict()
+    assert validateFontWeight(AttrDict(prop='fontWeight', value=string), elem)
+    assert isinstance(elem.fontWeight, QFont.Weight)
+    assert elem.fontWeight.value == weight
+
+@pytest.mark.parametrize('string', ['bolder', '-5', '10px'])
+def testNotFontWeights(string):
+    assert not validateFontWeight(AttrDict(prop='fontWeight', value=string), AttrDict())
+
+def fitElement(text:str, fontSize:int=60) -> AttrDict:
+    return AttrDict(text=text, fontFamily='Verdana', fontSize=fontSize, italic=False, bold=False,
+        overline=False, underline=False, lineThrough=False, wordWrap=True, directory='')
+
+def stepDown(elem, align, box) -> int:
+    '''auto-fit as it would be done one pixel at a time, from the top'''
+    for fontSize in range(elem.fontSize, 1, -1):
+        doc = makeTextDocument(elem, align, box.width(), fontSize)
+        if doc.size().height() <= box.height() and doc.idealWidth() <= box.width():
+            return fontSize
+    return 1
+
+@pytest.mark.parametrize('width, height', [(600, 240), (300, 300), (120, 40), (40, 10)])
+def testAutoFitMatchesSteppingDown(app, width, height):
+    align = Qt.AlignTop|Qt.AlignHCenter
+    box = QSize(width, height)
+    TextCache.clearCache()
+    for text in fitTexts:
+        elem = fitElement(text)
+        expected = stepDown(elem, align, box)
+        assert TextCache.fitFontSize(elem, align, box) == expected
+        #again from the measurements that were kept
+        assert TextCache.fitFontSize(elem, align, box) == expected
+
+def testAutoFitKeepsSizesThatFit(app):
+    align = Qt.AlignTop|Qt.AlignLeft
+    elem = fitElement('Fireball', fontSize=12)
+    assert TextCache.fitFontSize(elem, align, QSize(600, 240)) == 12
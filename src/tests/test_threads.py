@@ -0,0 +1,47 @@
+import os
+import threading
+
+from utils import *
+from elements import TextCache
+from renderer import buildLayout, CardRenderer
+
+examples = os.path.join(os.path.dirname(__file__), '..', '..', 'examples')
+#rich text images are drawn a little differently off the gui thread, so these don't have any
+layouts = [('werewolf', 'werewolf.cls'), ('playing cards', 'ranks.cls'), ('playing cards', 'faceCards.cls')]
+
+def renderLayout(folder:str, filename:str) -> list:
+    renderer = CardRenderer(buildLayout(filename, os.path.join(examples, folder)))
+    renderer.render()
+    return [(name, image) for image, name in renderer.images]
+
+def clearCaches():
+    TextCache.clearCache()
+    ImageGetter.clearCache()
+    SvgGetter.clearChache()
+    FileGetter.clearCache()
+
+def testThreadsMatchSerial(app):
+    clearCaches()
+    threaded = {}
+    def run(layout):
+        threaded[layout] = renderLayout(*layout)
+    threads = [threading.Thread(target=run, args=(layout,)) for layout in layouts*2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    clearCaches()
+    for layout in layouts:
+        assert threaded[layout] == renderLayout(*layout)
+
+def testNoWorkingDirectory(app, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cards = renderLayout('werewolf', 'werewolf.cls')
+    assert len(cards) == 7
+    assert os.listdir(tmp_path) == []
+
+def testEmptyPathStaysEmpty():
+    assert resolvePath('/some/folder', '') == ''
+    assert resolvePath('/some/folder', 'art/a.png') == os.path.join('/some/folder', 'art/a.png')
+    assert ImageGetter.getImage(resolvePath('/some/folder', '')).isNull()
@@ -0,0 +1,28 @@
+import pytest
+
+from utils import *
+from utils import data
+from macros import MacroStore, compileValue, formatNumber
+
+unitArgs = [('-+', ('px', 'in', 'mm')), ('+', ('px', 'in', 'mm')), ('-+^', ('px', 'in', 'mm', '%')),
+    ('-+', ('%', 'px')), ('+', ('',)), ('+', 'all')]
+
+@pytest.mark.parametrize('num', [0.0, 3.0, -3.0, 12.5, -0.25, 1/3, 1e15, 100.0])
+@pytest.mark.parametrize('signs, units', unitArgs)
+def testTypedNumbersReadLikeText(num, signs, units):
+    typed = formatNumber(num)
+    assert type(typed) is TypedText
+    assert Unit.fromStr(typed, signs, units) == Unit.fromStr(str(typed), signs, units)
+
+def testTypedNumbersSkipParsing(monkeypatch):
+    store = MacroStore()
+    store.add('elementName', 'test')
+    store.add('propertyName', 'width')
+    value = store.evaluate(compileValue('[=| 2 * 3.5]'))
+    def parseUnit(*args):
+        raise AssertionError('typed text was parsed')
+    monkeypatch.setattr(data, 'parseUnit', parseUnit)
+    assert Unit.fromStr(value, '+', ('px', 'in', 'mm')).toIntAt(300) == 7
+
+def testTogglesSkipParsing():
+    assert asBool(TypedText('not a toggle', True)) is True
@@ -0,0 +1,129 @@
+import os
+import pickle
+import multiprocessing
+
+import pytest
+
+from utils import *
+from macros import MacroStore, MacroProfiler
+from renderer import buildLayout, CardRenderer, exportPool
+
+deck = '''layout {
+    size: 1in, 1in
+    dpi: 40
+    data: deck.csv
+}
+export {
+    bulk {
+        output: out
+        name: card[card-index].png
+    }
+}
+label {
+    type: text
+    size: 100%, 100%
+    font-size: [size]
+    text: [upper| [name]] [if| [eq| [n], 3], three, other]
+}
+'''
+
+def makeData(rows:int, badRow:int=None) -> str:
+    lines = ['repeat, name, n, size']
+    for i in range(rows):
+        size = 'big' if i == badRow else '10pt'
+        lines.append(f'{i%3}, card number {i} with padding to make the data longer, {i%5}, {size}')
+    return '\n'.join(lines)
+
+errors = [
+    CLSError("failed to save image '{asset}' to {output}", output='out', layout='deck.cls', asset='a.png'),
+    CLSError("there is no {what}", file='deck.cls', what='data'),
+    InvalidValueError('label', 'font-size', 'big'),
+    InvalidArgError('label', 'text', 'dup', 'TIMES', 'x'),
+    UnclosedMacroError('label', 'text', '[upper| a'),
+    ImbalancedDelimError('label', 'text', '(a, b'),
+    ExpansionLimitError('label', 'text', 'too deep', '[a] -> [b]'),
+    CLSSyntaxError("'{name}' is broken", file='deck.cls', name='label'),
+    NoValueError('deck.cls', 'label', 'text'),
+]
+
+def raiseError(index:int):
+    raise errors[index]
+
+@pytest.mark.parametrize('error', errors, ids=lambda error: type(error).__name__)
+def testErrorsPickle(error):
+    copy = pickle.loads(pickle.dumps(error))
+    assert type(copy) is type(error)
+    assert copy.message == error.message
+
+def testErrorsThroughPool():
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        for index, error in enumerate(errors):
+            with pytest.raises(type(error)) as raised:
+                list(pool.imap(raiseError, [index]))
+            assert type(raised.value) is type(error)
+            assert raised.value.message == error.message
+
+def readCards(folder:str) -> dict:
+    cards = {}
+    for name in os.listdir(folder):
+        with open(os.path.join(folder, name), 'rb') as file:
+            cards[name] = file.read()
+    return cards
+
+def testPoolMatchesSerial(app, writeLayout):
+    directory = writeLayout({'deck.cls': deck, 'deck.csv': makeData(20)})
+    layout = buildLayout('deck.cls', directory)
+    renderer = CardRenderer(layout)
+    renderer.render()
+    renderer.export()
+    serial = readCards(os.path.join(directory, 'out'))
+    for name in serial:
+        os.remove(os.path.join(directory, 'out', name))
+
+    assert exportPool(layout, 2) == len(layout.data)
+    assert readCards(os.path.join(directory, 'out')) == serial
+    assert len(serial) == len(layout.data)
+
+def testPoolRaisesRenderErrors(app, writeLayout):
+    directory = writeLayout({'deck.cls': deck, 'deck.csv': makeData(20, badRow=7)})
+    layout = buildLayout('deck.cls', directory)
+    with pytest.raises(InvalidValueError) as serial:
+        CardRenderer(layout).render()
+    with pytest.raises(InvalidValueError) as pooled:
+        exportPool(layout, 2)
+    assert pooled.value.message == serial.value.message
+
+@pytest.fixture
+def settings():
+    '''put the process wide settings back after a test changes them'''
+    saved = (ParseCache.enabled, MacroStore.profiler, MacroStore.maxCalls)
+    yield
+    ParseCache.enabled, MacroStore.profiler, MacroStore.maxCalls = saved
+
+def testWorkersGetSettings(app, writeLayout, settings):
+    data = makeData(300)
+    assert ParseCache.wants(data)
+    directory = writeLayout({'deck.cls': deck, 'deck.csv': data})
+    ParseCache.enabled = False
+    MacroStore.profiler = MacroProfiler()
+    layout = buildLayout('deck.cls', directory)
+    MacroStore.profiler.clear()
+    MacroStore.cache.clear()
+
+    exportPool(layout, 2)
+    assert not os.path.exists(os.path.join(directory, ParseCache.folder))
+    #the cards are only rendered in the workers, so these come from their profiles
+    rows = MacroStore.profiler.rows()
+    assert {'upper', 'eq', 'if'} <= {row['macro'] for row in rows}
+    #upper is the only pure macro in the deck
+    stats = MacroStore.cache.stats()
+    assert stats['hits'] + stats['misses'] == sum(row['calls'] for row in rows if row['macro'] == 'upper')
+    assert stats['misses'] > 0
+
+def testWorkersGetLimits(app, writeLayout, settings):
+    directory = writeLayout({'deck.cls': deck, 'deck.csv': makeData(6)})
+    layout = buildLayout('deck.cls', directory)
+    MacroStore.maxCalls = 2
+    with pytest.raises(ExpansionLimitError):
+        exportPool(layout, 2)
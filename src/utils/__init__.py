@@ -1,4 +1,5 @@
 
 from .err import *
 from .util import *
-from .data import *
\ No newline at end of file
+from .data import *
+from .lexer import *
\ No newline at end of file
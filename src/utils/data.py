@@ -2,15 +2,17 @@
 
 from . import err
 from . import util
+from . import lexer
 import re
 from dataclasses import dataclass
+from functools import lru_cache
 
-__all__ = ['Unit', 'ListParser', 'asBool', 'evalEscapes', 'makeList']
+__all__ = ['Unit', 'TypedText', 'ListParser', 'asBool', 'evalEscapes', 'makeList']
 
 
-@dataclass
+@dataclass(frozen=True)
 class Unit():
-    '''Unit represents a unitized number'''
+    '''Unit represents a unitized number, Units are shared so they can't be changed'''
     sign: str
     num: int
     unit: str
@@ -42,47 +44,102 @@ class Unit():
     def toInt(self, **data) -> int:
         return int(self.toFloat(**data))
 
+    def toFloatAt(self, dpi:int) -> float:
+        '''the same as toFloat(dpi=dpi), for the hot paths that only convert with dpi'''
+        unit = self.unit
+        if unit == 'in':
+            return self.num*dpi
+        elif unit == 'mm':
+            return (self.num/25.4)*dpi
+        elif unit == 'pt':
+            return (self.num/72)*dpi
+        else:
+            return self.num
+
+    def toIntAt(self, dpi:int) -> int:
+        return int(self.toFloatAt(dpi))
+
     @staticmethod
     def fromStr(string, signs='-+', units=('px', 'in', 'mm')):
         """Generate a Unit from a string.
         Passing the string 'all' to units will allow the number to match any unit
+        results are cached, so the same Unit may be handed out more than once
         """
         #TODO use the string "any" for units to match anything
         if units == 'all':
             units = ('px', 'pt', 'in', 'mm', '%', 'x', 'deg')
-
-        signs = r'^(?P<sign>['+signs+r']?)'
-        unitRe = r'(?P<unit>(?:' + '|'.join(units) + r')?)$'
-        whole = signs + r'(?P<num>\d+)' + unitRe
-        flt = signs + r'(?P<num>\d*\.\d+)' + unitRe
-        frac = signs + r'(?P<whole>\d+)[\./ ](?P<numer>\d+)/(?P<denom>\d+)' + unitRe
-        fracOnly = signs + r'(?P<numer>\d+)/(?P<denom>\d+)' + unitRe
-
-        if (match := re.match(whole, string)) or (match := re.match(flt, string)):
-            sign = match.group('sign')
-            num = float(match.group('num'))
-            unit = match.group('unit')
-        elif match := re.match(fracOnly, string):
-            sign = match.group('sign')
-            numer = match.group('numer')
-            denom = match.group('denom')
-            unit = match.group('unit')
-            num = (int(numer)/int(denom))
-        elif match := re.match(frac, string):
-            sign = match.group('sign')
-            whole = match.group('whole')
-            numer = match.group('numer')
-            denom = match.group('denom')
-            unit = match.group('unit')
-            num = int(whole)+(int(numer)/int(denom))
-        else:
+        if type(string) is TypedText and type(string.value) is float:
+            return numberUnit(string.value, signs, units)
+        return parseUnit(string, signs, units)
+
+@lru_cache(maxsize=4096)
+def numberUnit(num:float, signs:str, units:tuple[str]) -> Unit|None:
+    '''the Unit parseUnit gives for the text of a number, without reading the text
+    numbers from macros don't have units, so they get the default one'''
+    if num < 0:
+        if '-' not in signs:
             return None
-        
-        if unit == '':
-            unit = units[0]
-        if sign == '-' and unit != '%':
-            num *= -1
-        return Unit(sign, num, unit)
+        sign = '-'
+    else:
+        sign = ''
+    unit = units[0]
+    if unit == '%':
+        #parseUnit leaves percentages positive, the sign says which way they go
+        num = abs(num)
+    return Unit(sign, num, unit)
+
+@lru_cache(maxsize=None)
+def unitPatterns(signs:str, units:tuple[str]) -> tuple[re.Pattern]:
+    '''the patterns for one combination of signs and units, compiled once'''
+    signs = r'^(?P<sign>['+signs+r']?)'
+    unitRe = r'(?P<unit>(?:' + '|'.join(units) + r')?)$'
+    whole = signs + r'(?P<num>\d+)' + unitRe
+    flt = signs + r'(?P<num>\d*\.\d+)' + unitRe
+    frac = signs + r'(?P<whole>\d+)[\./ ](?P<numer>\d+)/(?P<denom>\d+)' + unitRe
+    fracOnly = signs + r'(?P<numer>\d+)/(?P<denom>\d+)' + unitRe
+    return re.compile(whole), re.compile(flt), re.compile(fracOnly), re.compile(frac)
+
+@lru_cache(maxsize=4096)
+def parseUnit(string:str, signs:str, units:tuple[str]) -> Unit|None:
+    '''does the work for Unit.fromStr'''
+    whole, flt, fracOnly, frac = unitPatterns(signs, units)
+
+    if (match := whole.match(string)) or (match := flt.match(string)):
+        sign = match.group('sign')
+        num = float(match.group('num'))
+        unit = match.group('unit')
+    elif match := fracOnly.match(string):
+        sign = match.group('sign')
+        numer = match.group('numer')
+        denom = match.group('denom')
+        unit = match.group('unit')
+        num = (int(numer)/int(denom))
+    elif match := frac.match(string):
+        sign = match.group('sign')
+        wholeNum = match.group('whole')
+        numer = match.group('numer')
+        denom = match.group('denom')
+        unit = match.group('unit')
+        num = int(wholeNum)+(int(numer)/int(denom))
+    else:
+        return None
+    
+    if unit == '':
+        unit = units[0]
+    if sign == '-' and unit != '%':
+        num *= -1
+    return Unit(sign, num, unit)
+
+class TypedText(str):
+    '''text that remembers the value it was made from, so the next macro or
+    validator doesn't have to parse it again, Unit.fromStr and asBool read the value.
+    value must be what parsing the text would give, a float for numbers and a bool for toggles
+    it's still a str, so anything that wants text can use it as is'''
+
+    def __new__(cls, text:str, value):
+        self = super().__new__(cls, text)
+        self.value = value
+        return self
 
 trues = 'yes on true'.split()
 falses = 'no off false 0'.split()
@@ -90,6 +147,8 @@ falses.extend((0, ''))
 def asBool(string:str, err:err.CLSError = False) -> bool | None:
     '''tries to turn a toggle into a bool
     if a toggle isn't found raise an error if present else return None'''
+    if type(string) is TypedText and type(string.value) is bool:
+        return string.value
     folded = string.lower()
     if folded in trues:
         return True
@@ -109,22 +168,7 @@ expansions = {
 
 def evalEscapes(string:str) -> str:
     '''converts the escape sequences in a string into their unescaped counterparts'''
-    pos = 0
-    accum = []
-    while pos < len(string):
-        char = string[pos]
-        if char == '\\':
-            pos += 1
-            char = string[pos]
-            if char in expansions:
-                accum.append(expansions[char])
-            else:
-                accum.append(char)
-        else:
-            accum.append(char)
-        pos += 1
-    
-    return util.build(accum)
+    return lexer.subEscapes(string, lambda char: expansions.get(char, char)).strip()
 
 
 class ListParser():
@@ -133,75 +177,58 @@ class ListParser():
     def __init__(self, source, elem, prop):
         
         self.string = source.strip()
-        self.pos = 1
         self.elem = elem
         self.prop = prop
 
-    def parseItem(self):
+    def parse(self):
+        '''turn a CLS list into a python list, nested lists are left as text'''
+        if self.string == ':':
+            return []
+        if self.string[:1] != '(' or self.string[-1:] != ')':
+            return None
+        inner = self.string[1:-1]
+        if '\\' not in inner and '(' not in inner and '[' not in inner and ')' not in inner and ']' not in inner:
+            #nothing nested, so every comma splits
+            contents = [item.strip() for item in inner.split(',')]
+            if contents[-1] == '':
+                contents.pop()
+            return contents
+        contents = []
         accum = []
         innerStack = []
+        tokens = lexer.tokenize(self.string[1:])
+        last = len(tokens)-1
 
-        while self.pos < len(self.string):
-            char = self.string[self.pos]
+        for index, token in enumerate(tokens):
+            if token in '([':
+                innerStack.append(token)
 
-            if char == '\\':
-                accum.append(self.string[self.pos:self.pos+2])
-                self.pos += 1
-
-            elif char in '([':
-                innerStack.append(char)
-                accum.append(char)
-
-            elif char == ']':
-                if len(innerStack) == 0:
+            elif token == ']':
+                if len(innerStack) == 0 or innerStack.pop() == '(':
                     raise err.ImbalancedDelimError(self.elem, self.prop, self.string)
-                opener = innerStack.pop()
-                if opener == '(':
-                    raise err.ImbalancedDelimError(self.elem, self.prop, self.string)
-                accum.append(char)
-                    
-            elif char in ',)':
+
+            elif token in ',)':
                 if len(innerStack) == 0:
-                    if self.pos != len(self.string)-1 and char == ')':
-                        #if we see a ) without an opener and it's notthe last character of the string
-                        raise err.ImbalancedDelimError(self.elem, self.prop, self.string)
-                    
                     item = util.build(accum)
-                    if char == ')' and item == '':
-                        return None
-                    else:
-                        return item
+                    accum = []
+                    if token == ',':
+                        contents.append(item)
+                        continue
+                    if index != last:
+                        #a ) without an opener that isn't the end of the list
+                        raise err.ImbalancedDelimError(self.elem, self.prop, self.string)
+                    if item != '':
+                        contents.append(item)
+                    return contents
                 else:
                     #we preserve nested lists
-                    if char == ')':
-                        opener = innerStack.pop()
-                        if   opener == '[':
-                            raise err.ImbalancedDelimError(self.elem, self.prop, self.string)
-                    accum.append(char)
+                    if token == ')' and innerStack.pop() == '[':
+                        raise err.ImbalancedDelimError(self.elem, self.prop, self.string)
 
-            else:
-                accum.append(char)
+            accum.append(token)
 
-            self.pos += 1
-        #return build(accum)
         raise err.ImbalancedDelimError(self.elem, self.prop, self.string)
 
-    def parse(self):
-        '''turn a CLS list into a python list, nested lists are left as text'''
-        if self.string == ':':
-            return []
-        if self.string[0] != '(' or self.string[-1] != ')':
-            return None
-        contents = []
-
-        while self.pos < len(self.string):
-            item = self.parseItem()
-            if item is not None:
-                contents.append(item)
-            self.pos += 1
-
-        return contents
-
 def makeList(lst):
     '''turn a python list into a CLS list'''
     if lst == []:
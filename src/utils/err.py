@@ -46,6 +46,12 @@ class ImbalancedDelimError(CLSError):
         elem=elem, prop=prop, source=source
         )
 
+class ExpansionLimitError(CLSError):
+    def __init__(self, elem, prop, limit, chain):
+        super().__init__("{limit} while expanding {chain}",
+        elem=elem, prop=prop, limit=limit, chain=chain
+        )
+
 class CLSSyntaxError(CLSError):
     def __init__(self, msg, /, **kwargs):
         if 'origin' in kwargs:
@@ -65,5 +71,5 @@ class NoValueError(CLSSyntaxError):
 
 class UnexpectedEOFError(CLSSyntaxError):
     def __init__(self, file, name):
-        super.__init__("unexpected EOF in '{name}'",
+        super().__init__("unexpected EOF in '{name}'",
         file=file, name=name)
\ No newline at end of file
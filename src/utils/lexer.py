@@ -0,0 +1,44 @@
+### lexer.py ###
+
+import re
+
+__all__ = ['tokenize', 'splitTop', 'subEscapes']
+
+#an escape with the character after it, a single delimiter, or a run of anything else
+tokenRe = re.compile(r'\\.?|[\[\]\(\),|]|[^\\\[\]\(\),|]+', re.S)
+escapeRe = re.compile(r'\\(.?)', re.S)
+
+openers = frozenset('[(')
+closers = frozenset('])')
+
+def tokenize(string:str) -> list[str]:
+    '''split a string into escapes, delimiters, and runs of plain text
+    escapes are kept with the character they escape, so joining the tokens gives back the string'''
+    return tokenRe.findall(string)
+
+def splitTop(string:str, sep:str=',') -> list[str]:
+    '''split a string on sep, skipping escaped seps and seps inside brackets or parens
+    every value is stripped'''
+    if '\\' not in string and '[' not in string and '(' not in string:
+        return [value.strip() for value in string.split(sep)]
+    values = []
+    accum = []
+    depth = 0
+    for token in tokenRe.findall(string):
+        if token == sep and depth == 0:
+            values.append(''.join(accum).strip())
+            accum = []
+            continue
+        if token in openers:
+            depth += 1
+        elif token in closers and depth > 0:
+            depth -= 1
+        accum.append(token)
+    values.append(''.join(accum).strip())
+    return values
+
+def subEscapes(string:str, func) -> str:
+    '''replace every escape in string with func(char), char is the escaped character'''
+    if '\\' not in string:
+        return string
+    return escapeRe.sub(lambda match: func(match.group(1)), string)
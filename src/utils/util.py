@@ -1,13 +1,21 @@
 ### util.py ###
 
+import os
+import stat
+import json
+import hashlib
+import threading
+import itertools
+from collections import OrderedDict
 from collections.abc import Mapping
 from types import SimpleNamespace
 from PySide6.QtGui import QImage
 from PySide6.QtSvg import QSvgRenderer
 from typing import *
+from .lexer import splitTop
 
 
-__all__ = ['AttrDict', 'Collection', 'ImageGetter', 'build', 'commaSplit', 'deepUpdate', 'SvgGetter']
+__all__ = ['AttrDict', 'Collection', 'ImageGetter', 'build', 'commaSplit', 'deepUpdate', 'SvgGetter', 'FileGetter', 'ParseCache', 'resolvePath', 'threadKey']
 
 
 class Collection(SimpleNamespace):
@@ -31,39 +39,183 @@ class AttrDict():
         return key in self.__dict__
     def items(self):
         return self.__dict__.items()
+    def update(self, other):
+        self.__dict__.update(other)
     def copy(self):
         "return a shallow copy of this AttrDict"
         copy = AttrDict()
         copy.__dict__.update(self.__dict__)
         return copy
 
+def resolvePath(directory:str, name:str) -> str:
+    '''name relative to directory, an empty name stays empty so it still means no file'''
+    if name == '':
+        return ''
+    return os.path.join(directory, name)
+
+threadKeys = itertools.count()
+threadLocal = threading.local()
+
+def threadKey() -> int:
+    '''a number for the calling thread that isn't given to any other thread, even after
+    it ends. Qt objects that hold fonts or paint devices are kept per thread under it'''
+    if not hasattr(threadLocal, 'key'):
+        threadLocal.key = next(threadKeys)
+    return threadLocal.key
+
 class ImageGetter():
-    """A static class that holds a cache of images"""
+    """A static class that holds a cache of images
+    painting one QImage from two threads at once isn't safe, so each thread gets its own"""
     cache = {}
+    #(thread, name) -> image
+    lock = threading.Lock()
     
     @staticmethod
     def getImage(name) -> QImage:
-        if name not in ImageGetter.cache:
-            ImageGetter.cache[name] = QImage(name)
-        return ImageGetter.cache[name]
+        key = (threadKey(), name)
+        with ImageGetter.lock:
+            if key not in ImageGetter.cache:
+                ImageGetter.cache[key] = QImage(name)
+            return ImageGetter.cache[key]
     
     @staticmethod
     def clearCache():
-        ImageGetter.cache = {}
+        with ImageGetter.lock:
+            ImageGetter.cache = {}
 
 class SvgGetter():
-    '''a static class that holds a cache of svg files'''
+    '''a static class that holds a cache of svg files
+    a QSvgRenderer can't be painted from two threads at once, so each thread gets its own'''
     cache = {}
+    #(thread, name) -> renderer
+    lock = threading.Lock()
 
     @staticmethod
     def getSvg(name) -> QSvgRenderer:
-        if name not in SvgGetter.cache:
-            SvgGetter.cache[name] = QSvgRenderer(name)
-        return SvgGetter.cache[name]
+        key = (threadKey(), name)
+        with SvgGetter.lock:
+            if key not in SvgGetter.cache:
+                SvgGetter.cache[key] = QSvgRenderer(name)
+            return SvgGetter.cache[key]
     
     @staticmethod
     def clearChache():
-        SvgGetter.cache = {}
+        with SvgGetter.lock:
+            SvgGetter.cache = {}
+
+class FileGetter():
+    '''a static class that holds a cache of text files, entries are checked
+    against the file's modification time and size so edits are picked up'''
+    cache = OrderedDict()
+    #absolute path -> ((mtime, size), text), least recently used first
+    budget = 8*1024*1024
+    #how many bytes of files to hold on to
+    size = 0
+    lock = threading.Lock()
+
+    @staticmethod
+    def getFile(name) -> str|None:
+        '''returns the text of a file, or None if name isn't a file
+        raises OSError if the file can't be read'''
+        path = os.path.abspath(name)
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(info.st_mode):
+            return None
+        version = (info.st_mtime_ns, info.st_size)
+        with FileGetter.lock:
+            entry = FileGetter.cache.get(path)
+            if entry is not None and entry[0] == version:
+                FileGetter.cache.move_to_end(path)
+                return entry[1]
+
+        with open(path, encoding='utf-8') as file:
+            text = file.read()
+        with FileGetter.lock:
+            FileGetter.discard(path)
+            if info.st_size <= FileGetter.budget:
+                FileGetter.cache[path] = (version, text)
+                FileGetter.size += info.st_size
+                while FileGetter.size > FileGetter.budget:
+                    oldPath, ((mtime, size), oldText) = FileGetter.cache.popitem(last=False)
+                    FileGetter.size -= size
+        return text
+
+    @staticmethod
+    def discard(path):
+        '''drop a single file from the cache, the caller holds the lock'''
+        entry = FileGetter.cache.pop(path, None)
+        if entry is not None:
+            FileGetter.size -= entry[0][1]
+
+    @staticmethod
+    def clearCache():
+        with FileGetter.lock:
+            FileGetter.cache = OrderedDict()
+            FileGetter.size = 0
+
+class ParseCache():
+    '''a static class that keeps parsed files on disk, in a .cls-cache folder
+    next to the layout. entries are named by a hash of the text that was parsed,
+    so a changed file is a different entry and old entries age out on their own'''
+    folder = '.cls-cache'
+    enabled = True
+    version = 2
+    #bump when a parser changes what it returns
+    minSize = 8*1024
+    #text shorter than this parses faster than the cache can be read
+    limit = 64
+    #how many entries to keep in each cache folder
+
+    @staticmethod
+    def wants(text:str) -> bool:
+        '''if load would cache text'''
+        return ParseCache.enabled and len(text) >= ParseCache.minSize
+
+    @staticmethod
+    def load(kind:str, text:str, directory:str, parse:Callable[[str], Any]) -> Any:
+        '''returns parse(text), read from the cache in directory when text has been parsed before
+        kind tells apart different parses of the same text, the result must survive json'''
+        if not ParseCache.wants(text):
+            return parse(text)
+        key = hashlib.sha256(f'{kind}\0{ParseCache.version}\0{text}'.encode('utf-8', 'surrogatepass')).hexdigest()
+        folder = os.path.join(directory, ParseCache.folder)
+        path = os.path.join(folder, f'{kind}-{key}.json')
+        try:
+            with open(path, encoding='utf-8') as file:
+                result = json.load(file)
+            os.utime(path)
+            return result
+        except (OSError, ValueError):
+            pass
+
+        result = parse(text)
+        #the cache is only ever a shortcut, so failing to write it isn't an error
+        try:
+            os.makedirs(folder, exist_ok=True)
+            temp = f'{path}.{os.getpid()}.{threadKey()}.tmp'
+            with open(temp, 'w', encoding='utf-8') as file:
+                json.dump(result, file)
+            os.replace(temp, path)
+            ParseCache.prune(folder)
+        except (OSError, TypeError, ValueError):
+            pass
+        return result
+
+    @staticmethod
+    def prune(folder:str):
+        '''remove the least recently used entries past the limit'''
+        entries = [entry for entry in os.scandir(folder) if entry.name.endswith('.json')]
+        if len(entries) <= ParseCache.limit:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+        for entry in entries[:len(entries)-ParseCache.limit]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
 
 def deepUpdate(self:Mapping, other:Mapping):
     '''like update, but if a given index is a mapping in both self and other we recurse'''
@@ -82,36 +234,5 @@ def build(accum:list) -> str:
     return ''.join(accum).strip()
 
 def commaSplit(string) -> str:
-    accum = []
-    values = []
-    pos = 0
-    stack = []
-    char = ''
-    while pos < len(string):
-        char = string[pos]
-        if char == '\\':
-            accum.append(string[pos:pos+2])
-            pos += 1
-
-        elif char in "[(":
-            stack.append(char)
-            accum.append(char)
-        
-        elif char in ")]":
-            stack.pop()
-            accum.append(char)
-
-        elif char == ',':
-            if len(stack) == 0:
-                values.append(build(accum))
-                accum = []
-            else:
-                accum.append(char)
-        
-        else:
-            accum.append(char)
-
-        pos += 1
-    values.append(build(accum))
-    return values
+    return splitTop(string, ',')
 